@@ -8,6 +8,7 @@ const char* password = "stenella";
 // ===== Server Settings =====
 const char* host = "192.168.137.1"; // Laptop IP
 const int port = 5005;
+const char* bottleId = "BOTTLE123";  // sent as "id:<bottleId>" on connect; must match subjects.bottleId
 
 // ===== Sampling Settings =====
 const unsigned long ts = 1000 / 100;  // 100 Hz sampling
@@ -103,6 +104,8 @@ void tryConnect() {
   Serial.printf("Connecting to %s:%d ...\n", host, port);
   if (client.connect(host, port)) {
     Serial.println("✅ Connected to server!");
+    client.print("id:");
+    client.println(bottleId);  // tells the server which subject this bottle belongs to
   } else {
     Serial.println("❌ Failed to connect. Will retry...");
   }
@@ -0,0 +1,77 @@
+import threading
+
+
+def adherence_score(total_events, bad_events):
+    # Same formula insert_to_supabase has always used (string, whole percent)
+    return str(int(100 * (1 - bad_events / total_events))) if total_events > 0 else "100"
+
+
+def count_day(anomaly_ids):
+    # (total, bad) for a list of anomalyIds as stored in `events`
+    return len(anomaly_ids), sum(1 for a in anomaly_ids if a != "0")
+
+
+class AdherenceTracker:
+    # Running (total, bad) event counters per subject for the current day.
+    #
+    # `load_day(subject_id, event_date)` returns the anomalyIds already stored
+    # for that subject/day. It is only called the first time a subject is seen
+    # on a given day (or on every event in verify mode, to cross-check the
+    # counters against a full recount). Only the latest day is kept per
+    # subject, so a new day rolls the counters over.
+    def __init__(self, load_day, verify=False):
+        self.load_day = load_day
+        self.verify = verify
+
+        self._lock = threading.Lock()
+        self._days = {}  # subject_id -> [event_date, total, bad]
+
+        self.warms = 0
+        self.rollovers = 0
+        self.mismatches = 0
+
+    def record(self, subject_id, event_date, anomaly_id):
+        # Count one new event and return the day's adherence score
+        recount = None
+        while True:
+            with self._lock:
+                counters = self._days.get(subject_id)
+                stale = counters is None or counters[0] != event_date
+                if recount is not None or not (stale or self.verify):
+                    return self._count(subject_id, event_date, anomaly_id, counters, stale, recount)
+            # Fetch outside the lock so one slow query doesn't stall other subjects
+            recount = count_day(self.load_day(subject_id, event_date))
+
+    def _count(self, subject_id, event_date, anomaly_id, counters, stale, recount):
+        if stale:
+            if counters is not None:
+                self.rollovers += 1
+            self.warms += 1
+            counters = self._days[subject_id] = [event_date, *recount]
+        elif self.verify and (counters[1], counters[2]) != recount:
+            print(f"Adherence mismatch for subject {subject_id} on {event_date}: "
+                  f"counters={counters[1:]} recount={list(recount)}")
+            self.mismatches += 1
+            counters[1], counters[2] = recount
+
+        counters[1] += 1
+        if anomaly_id != "0":
+            counters[2] += 1
+        return adherence_score(counters[1], counters[2])
+
+    def forget(self, subject_id=None):
+        # Drop counters so the next event re-warms from the events table
+        with self._lock:
+            if subject_id is None:
+                self._days.clear()
+            else:
+                self._days.pop(subject_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subjects": len(self._days),
+                "warms": self.warms,
+                "rollovers": self.rollovers,
+                "mismatches": self.mismatches,
+            }
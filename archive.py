@@ -0,0 +1,398 @@
+# Columnar archive of the `events` table, for analysis without REST paging.
+#
+# events keeps everything as text (date "%m/%d/%y", time "%I:%M %p", grams
+# and adherenceScore as str), so every analysis re-parses strings. The
+# archive stores typed columns instead:
+#
+#   id         int64    events.id
+#   subject    int32    subjectId
+#   ts         int64    epoch milliseconds of the local wall-clock time
+#                       (no timezone, like classify_batch's datetime64)
+#   grams      float32
+#   anomaly    int8     anomalyId
+#   adherence  float32  adherenceScore as stored
+#
+# Layout: one directory per snapshot segment, each column a .npy file, rows
+# sorted by (subject, ts, id) with a subject -> row range index
+# (keys.npy/offsets.npy). Columns are opened as read-only memmaps, so a
+# subject's range scan is two searchsorted calls on a slice and a cohort
+# scan touches only the columns it reads.
+#
+#   archive/manifest.json        segments + last archived event id per subject
+#   archive/seg-000001/*.npy
+#
+#   python archive.py snapshot --path archive        # append events newer than the last snapshot
+#   python archive.py compact --path archive         # merge segments into one
+#   python archive.py export --path archive --parquet events_parquet/   (needs pyarrow)
+#   python archive.py query --path archive --subject 12 --start 2025-09-01 --end 2025-10-01
+#
+# snapshot pages through storage.events_page (keyset by id), so each run
+# only reads events added since the previous one. Pages are converted to
+# columns as they arrive and written out every SEGMENT_ROWS rows, each
+# segment recorded in the manifest as soon as it is written, so a first
+# snapshot of a large table needs memory for one segment, not the table
+# (compact merges them afterwards).
+#
+# Only new ids are archived: rows rewritten in place later (backfill.py
+# re-scoring anomalyId/adherenceScore) keep their old values here. After a
+# backfill, rebuild the archive into a fresh directory:
+#
+#   python archive.py snapshot --path archive.new && rm -r archive && mv archive.new archive
+
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+
+import numpy as np
+
+import storage
+
+ARCHIVE_PATH = "archive"
+PAGE_SIZE = 1000  # events per events_page request
+SEGMENT_ROWS = 1_000_000  # rows buffered per segment written by snapshot (~29 MB of columns)
+BUCKET_SUBJECTS = 10000  # subjects per Parquet partition (same as woz.py)
+SMALL_COHORT = 64  # up to this many subjects, slice ranges instead of masking the whole column
+
+COLUMNS = {
+    "id": np.int64,
+    "subject": np.int32,
+    "ts": np.int64,
+    "grams": np.float32,
+    "anomaly": np.int8,
+    "adherence": np.float32,
+}
+TIME_FORMATS = ("%m/%d/%y %I:%M %p", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M")  # live path, woz.py
+
+_parsed = {}
+
+
+def to_epoch_ms(event_date, event_time):
+    # Memoized: there are only so many distinct date/time strings
+    key = (event_date, event_time)
+    ms = _parsed.get(key)
+    if ms is None:
+        text = f"{event_date} {event_time}"
+        for fmt in TIME_FORMATS:
+            try:
+                parsed = datetime.strptime(text, fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            raise ValueError(f"Unrecognized event date/time: {text!r}")
+        ms = _parsed[key] = int(np.datetime64(parsed, "ms").astype(np.int64))
+    return ms
+
+
+def to_ms(value):
+    # datetime / ISO string / None -> epoch ms (local wall clock) or None
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(np.datetime64(value, "ms").astype(np.int64))
+
+
+def rows_to_columns(subject_id, rows):
+    # events_page rows for one subject -> {column: array}
+    n = len(rows)
+    return {
+        "id": np.fromiter((r["id"] for r in rows), np.int64, n),
+        "subject": np.full(n, subject_id, dtype=np.int32),
+        "ts": np.fromiter((to_epoch_ms(r["date"], r["time"]) for r in rows), np.int64, n),
+        "grams": np.fromiter((float(r["grams"]) for r in rows), np.float32, n),
+        "anomaly": np.fromiter((int(r["anomalyId"]) for r in rows), np.int8, n),
+        "adherence": np.fromiter((float(r["adherenceScore"]) for r in rows), np.float32, n),
+    }
+
+
+# --- Writing ---
+
+def _load_manifest(path):
+    try:
+        with open(os.path.join(path, "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"segments": [], "last_ids": {}, "next_segment": 1}
+
+
+def _save_manifest(path, manifest):
+    tmp = os.path.join(path, "manifest.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(path, "manifest.json"))  # readers see the old or the new one, never half
+
+
+def _recover(path, manifest):
+    # Writers only: drop segment directories the manifest doesn't list. They
+    # are left by a crash between renaming a segment into place and saving
+    # the manifest (its events weren't recorded in last_ids, so the next
+    # snapshot reads them again), or after compact() saved the merged
+    # manifest but before it removed the old segments. next_segment is moved
+    # past every name on disk so a new segment never lands on an old one.
+    listed = set(manifest["segments"])
+    for name in os.listdir(path):
+        if not name.startswith("seg-"):
+            continue
+        number = name[4:].split(".")[0]
+        if number.isdigit():
+            manifest["next_segment"] = max(manifest["next_segment"], int(number) + 1)
+        if name not in listed:
+            print(f"Removing unlisted segment {name}")
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+def write_segment(path, columns, manifest=None):
+    # Sort and write one segment; returns its name (not yet in the manifest
+    # unless one is passed, in which case it is added and saved)
+    manifest = manifest if manifest is not None else _load_manifest(path)
+    order = np.lexsort((columns["id"], columns["ts"], columns["subject"]))
+    name = f"seg-{manifest['next_segment']:06d}"
+    tmp = os.path.join(path, name + ".tmp")
+    os.makedirs(tmp, exist_ok=True)
+    for column, dtype in COLUMNS.items():
+        np.save(os.path.join(tmp, column + ".npy"), np.asarray(columns[column], dtype=dtype)[order])
+
+    subject = np.asarray(columns["subject"], dtype=np.int32)[order]
+    keys, starts = np.unique(subject, return_index=True)
+    np.save(os.path.join(tmp, "keys.npy"), keys.astype(np.int32))
+    np.save(os.path.join(tmp, "offsets.npy"), np.append(starts, len(subject)).astype(np.int64))
+    os.replace(tmp, os.path.join(path, name))
+
+    manifest["next_segment"] += 1
+    manifest["segments"].append(name)
+    return name
+
+
+def snapshot(path=ARCHIVE_PATH, db=None, page_size=PAGE_SIZE, segment_rows=SEGMENT_ROWS):
+    # Append every event newer than the last snapshot, as one new segment
+    # per segment_rows rows; returns the number of events archived
+    db = db or storage.get_storage()
+    os.makedirs(path, exist_ok=True)
+    manifest = _load_manifest(path)
+    _recover(path, manifest)
+    last_ids = manifest["last_ids"]
+
+    parts, buffered, archived = [], 0, 0
+    pending_ids = {}  # last id per subject among the buffered rows
+
+    def write():
+        # Buffered rows -> one segment; last_ids only move once it is listed
+        columns = {c: np.concatenate([p[c] for p in parts]) for c in COLUMNS}
+        write_segment(path, columns, manifest)
+        last_ids.update(pending_ids)
+        _save_manifest(path, manifest)
+        parts.clear()
+        pending_ids.clear()
+
+    for subject_id in db.subject_ids():
+        after_id = last_ids.get(str(subject_id), 0)
+        while True:
+            page = db.events_page(subject_id, after_id, page_size)
+            if page:
+                parts.append(rows_to_columns(subject_id, page))
+                after_id = pending_ids[str(subject_id)] = page[-1]["id"]
+                buffered += len(page)
+                archived += len(page)
+                if buffered >= segment_rows:
+                    write()
+                    buffered = 0
+            if len(page) < page_size:
+                break
+
+    if parts:
+        write()
+    return archived
+
+
+def compact(path=ARCHIVE_PATH):
+    # Merge all segments into one; returns the number of rows
+    manifest = _load_manifest(path)
+    _recover(path, manifest)
+    old = list(manifest["segments"])
+    if len(old) <= 1:
+        return EventArchive(path).rows
+    archive = EventArchive(path)
+    columns = {c: np.concatenate([np.asarray(seg[c]) for seg in archive.segments]) for c in COLUMNS}
+    manifest["segments"] = []
+    write_segment(path, columns, manifest)
+    _save_manifest(path, manifest)
+    del archive
+    for name in old:
+        shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+    return len(columns["id"])
+
+
+def export_parquet(path, out_dir, bucket_subjects=BUCKET_SUBJECTS):
+    # Subject-bucketed Parquet copy (out_dir/bucket=B/part-<segment>.parquet)
+    # for tools that read Parquet; returns the number of files written
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    archive = EventArchive(path)
+    written = 0
+    for name, seg in zip(archive.names, archive.segments):
+        bucket = seg["subject"] // bucket_subjects
+        edges = np.flatnonzero(np.diff(bucket)) + 1  # rows are sorted by subject
+        for lo, hi in zip(np.r_[0, edges], np.r_[edges, len(bucket)]):
+            if hi <= lo:
+                continue
+            table = pa.table({c: np.asarray(seg[c][lo:hi]) for c in COLUMNS})
+            out = os.path.join(out_dir, f"bucket={int(bucket[lo])}")
+            os.makedirs(out, exist_ok=True)
+            pq.write_table(table, os.path.join(out, f"part-{name}.parquet"))
+            written += 1
+    return written
+
+
+# --- Reading ---
+
+class EventArchive:
+    # Read-only view over every segment, memory-mapped. Query methods return
+    # {column: ndarray} sorted by (subject, ts) for a subject, or grouped by
+    # segment then subject for cohorts/scans (sort on "ts" if you need time order).
+    def __init__(self, path=ARCHIVE_PATH):
+        self.path = path
+        self.names = list(_load_manifest(path)["segments"])
+        self.segments = []
+        for name in self.names:
+            seg_dir = os.path.join(path, name)
+            seg = {c: np.load(os.path.join(seg_dir, c + ".npy"), mmap_mode="r") for c in COLUMNS}
+            seg["keys"] = np.load(os.path.join(seg_dir, "keys.npy"))
+            seg["offsets"] = np.load(os.path.join(seg_dir, "offsets.npy"))
+            self.segments.append(seg)
+
+    @property
+    def rows(self):
+        return sum(len(seg["id"]) for seg in self.segments)
+
+    def subject_ids(self):
+        if not self.segments:
+            return np.zeros(0, dtype=np.int32)
+        return np.unique(np.concatenate([seg["keys"] for seg in self.segments]))
+
+    @staticmethod
+    def _range(seg, subject_id, start_ms, end_ms):
+        # Row range of one subject (and time range) in a segment
+        keys = seg["keys"]
+        k = np.searchsorted(keys, subject_id)
+        if k == len(keys) or keys[k] != subject_id:
+            return 0, 0
+        lo, hi = int(seg["offsets"][k]), int(seg["offsets"][k + 1])
+        ts = seg["ts"][lo:hi]
+        if start_ms is not None:
+            lo += int(np.searchsorted(ts, start_ms, side="left"))
+        if end_ms is not None:
+            hi = int(seg["offsets"][k]) + int(np.searchsorted(ts, end_ms, side="left"))
+        return lo, max(lo, hi)
+
+    def _gather(self, pieces, columns):
+        columns = columns or list(COLUMNS)
+        if not pieces:
+            return {c: np.zeros(0, dtype=COLUMNS[c]) for c in columns}
+        return {c: np.concatenate([np.asarray(seg[c][sel]) for seg, sel in pieces]) for c in columns}
+
+    def subject(self, subject_id, start=None, end=None, columns=None):
+        # One subject's events with start <= time < end, in time order
+        start_ms, end_ms = to_ms(start), to_ms(end)
+        pieces = []
+        for seg in self.segments:
+            lo, hi = self._range(seg, subject_id, start_ms, end_ms)
+            if hi > lo:
+                pieces.append((seg, slice(lo, hi)))
+        result = self._gather(pieces, columns and list(dict.fromkeys([*columns, "ts"])))
+        if len(pieces) > 1:  # segments are each sorted; merge them
+            order = np.argsort(result["ts"], kind="stable")
+            result = {c: v[order] for c, v in result.items()}
+        return result
+
+    def cohort(self, subject_ids, start=None, end=None, columns=None):
+        # Events of several subjects with start <= time < end
+        start_ms, end_ms = to_ms(start), to_ms(end)
+        subject_ids = np.unique(np.asarray(subject_ids, dtype=np.int32))
+        pieces = []
+        for seg in self.segments:
+            if len(subject_ids) <= SMALL_COHORT:
+                for subject_id in subject_ids.tolist():
+                    lo, hi = self._range(seg, subject_id, start_ms, end_ms)
+                    if hi > lo:
+                        pieces.append((seg, slice(lo, hi)))
+            else:
+                mask = np.isin(seg["subject"], subject_ids)
+                if start_ms is not None:
+                    mask &= seg["ts"] >= start_ms
+                if end_ms is not None:
+                    mask &= seg["ts"] < end_ms
+                pieces.append((seg, np.flatnonzero(mask)))
+        return self._gather(pieces, columns)
+
+    def scan(self, start=None, end=None, columns=None):
+        # Every event with start <= time < end
+        start_ms, end_ms = to_ms(start), to_ms(end)
+        pieces = []
+        for seg in self.segments:
+            if start_ms is None and end_ms is None:
+                pieces.append((seg, slice(None)))
+                continue
+            mask = np.ones(len(seg["ts"]), dtype=bool)
+            if start_ms is not None:
+                mask &= seg["ts"] >= start_ms
+            if end_ms is not None:
+                mask &= seg["ts"] < end_ms
+            pieces.append((seg, np.flatnonzero(mask)))
+        return self._gather(pieces, columns)
+
+    def anomaly_counts(self, subject_ids=None, start=None, end=None):
+        # Events per anomalyId (index 0-3) for a cohort, or everyone
+        if subject_ids is None:
+            anomaly = self.scan(start, end, columns=["anomaly"])["anomaly"]
+        else:
+            anomaly = self.cohort(subject_ids, start, end, columns=["anomaly"])["anomaly"]
+        return np.bincount(anomaly.astype(np.int64), minlength=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar archive of the events table")
+    parser.add_argument("command", choices=("snapshot", "compact", "export", "query"))
+    parser.add_argument("--path", default=ARCHIVE_PATH, help="archive directory")
+    parser.add_argument("--parquet", help="export: output directory")
+    parser.add_argument("--subject", type=int, action="append", help="query: subjectId (repeat for a cohort)")
+    parser.add_argument("--start", help="query: ISO time, inclusive")
+    parser.add_argument("--end", help="query: ISO time, exclusive")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--segment-rows", type=int, default=SEGMENT_ROWS, help="snapshot: rows per segment written")
+    args = parser.parse_args()
+
+    began = time.perf_counter()
+    if args.command == "snapshot":
+        n = snapshot(args.path, page_size=args.page_size, segment_rows=args.segment_rows)
+        print(f"Archived {n} new events in {time.perf_counter() - began:.1f}s")
+    elif args.command == "compact":
+        n = compact(args.path)
+        print(f"Compacted {n} events into one segment in {time.perf_counter() - began:.1f}s")
+    elif args.command == "export":
+        if not args.parquet:
+            parser.error("export needs --parquet DIR")
+        n = export_parquet(args.path, args.parquet)
+        print(f"Wrote {n} Parquet files to {args.parquet} in {time.perf_counter() - began:.1f}s")
+    else:
+        archive = EventArchive(args.path)
+        if args.subject and len(args.subject) == 1:
+            result = archive.subject(args.subject[0], args.start, args.end)
+        elif args.subject:
+            result = archive.cohort(args.subject, args.start, args.end)
+        else:
+            result = archive.scan(args.start, args.end)
+        elapsed = (time.perf_counter() - began) * 1000
+        counts = np.bincount(result["anomaly"].astype(np.int64), minlength=4)
+        print(f"{len(result['id'])} events of {archive.rows} in {elapsed:.1f} ms; by anomalyId: {counts.tolist()}")
+        if len(result["id"]):
+            first, last = (np.datetime64(int(t), "ms") for t in (result["ts"].min(), result["ts"].max()))
+            print(f"first {first}, last {last}, mean grams {result['grams'].mean():.3f}")
+
+
+if __name__ == "__main__":
+    main()
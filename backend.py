@@ -1,148 +1,400 @@
+import argparse
+import asyncio
+import atexit
+import itertools
+import os
+import signal
 import socket
-from datetime import datetime, timedelta
-from supabase import create_client, Client
-from config import SUPABASE_URL, SUPABASE_KEY
-
-# Supabase setup
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-# Global state
-previous_weight = 0.0
-previous_subject_id = -1
+import sys
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import log
+import metrics
+from debounce import QUIET_SECONDS, TOLERANCE_GRAMS, Debouncer
+from framing import MAX_LINE_BYTES, LineFramer, parse_bottle_id, parse_grams
+from ingest import (BottleState, adherence, insert_to_supabase, refresh_subjects, resolve_subject, routes, storage,
+                    subject_cache)
+from ingest import writer as journal
+from ingest_queue import HIGH_WATERMARK, LOW_WATERMARK, POLICIES, IngestQueue
+from presence import OFFLINE_AFTER, RETENTION, PresenceTracker
+from push import PUSH_HOST, RING_SIZE, PushHub
+from shards import ShardPool
+from stability import SAMPLE_HZ, StabilityDetector, parse_samples
 
 # Server setup
 HOST = "0.0.0.0"
 PORT = 5005
+SOCKET_TIMEOUT = 60  # seconds without a line (bottles ping every 5 s)
+LISTEN_BACKLOG = 4096
+DB_WORKERS = 32  # threads available for blocking Supabase calls
+ACK_READINGS = False  # reply "ok"/"err" per reading (load tests; the firmware ignores it)
+RAW_SAMPLES = False  # accept "raw:..." sample batches and detect settled weights here (stability.py)
+DETECTOR_SETTINGS = {}  # StabilityDetector overrides from the command line
+DEBOUNCE_QUIET = QUIET_SECONDS  # hold readings until the bottle is quiet this long (0 = off)
+DEBOUNCE_TOLERANCE = TOLERANCE_GRAMS
+PUSH_PORT = 0  # serve stored events to dashboards as SSE on this port (0 = off)
+PUSH_BIND = PUSH_HOST  # local only unless --push-host says otherwise
 
 
-def insert_to_supabase(grams):
-    global previous_weight, previous_subject_id
+# Blocking TCP server loop (one bottle at a time)
+def serve_blocking():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((HOST, PORT))
+        s.listen()
+        print(f"Listening on {HOST}:{PORT}...")
 
-    now = datetime.now()
-    event_date = now.strftime("%m/%d/%y")
-    event_time = now.strftime("%I:%M %p")
+        while True:
+            conn, addr = s.accept()
+            conn.settimeout(SOCKET_TIMEOUT)
+            print(f"Connected by {addr}")
+            with conn:
+                framer = LineFramer()
+                while True:
+                    try:
+                        n = framer.recv_from(conn)
+                    except socket.timeout:
+                        print("Socket timeout, closing connection.")
+                        break
+                    if not n:
+                        print(f"Connection closed by {addr}")
+                        break
 
-    # Get latest subjectId
-    res = supabase.table("subjects").select("subjectId").order("subjectId", desc=True).limit(1).execute()
-    if not res.data:
-        print("No subjects found in database.")
-        return
+                    for line in framer.lines():
+                        now = datetime.now().strftime("%H:%M:%S")
+                        print(f"{now}: {line.decode(errors='replace')}")
+
+                        # grams = parse_grams(line)
+                        # if grams is not None:
+                        #     print(f"Grams: {grams}")
+                        #     insert_to_supabase(grams)
+
+
+# --- asyncio ingest server (many bottles at once) ---
+
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="supabase")
+debounce_totals = Counter()  # received/forwarded/suppressed across closed connections
+presence = None  # PresenceTracker in async mode: online/offline per bottle -> `devices`
+ingest_queue = IngestQueue(workers=DB_WORKERS)  # readings waiting for a database worker
+shard_pool = None  # ShardPool with --shards N: readings are stored by worker processes
+connection_ids = itertools.count(1)
+push_hub = PushHub()  # recent events per subject, streamed to dashboards (--push-port)
 
-    subject_id = res.data[0]["subjectId"]
-    if subject_id != previous_subject_id:
-        print("New subjectId:", subject_id)
-        previous_subject_id = subject_id
 
-    # Get subject details
-    subj = supabase.table("subjects").select(
-        "pillWeight, prescription, dosingWindows, currAdherenceScore"
-    ).eq("subjectId", subject_id).execute()
-    subj_data = subj.data[0]
+def device_id(state):
+    # `devices` key: the handshake id, else the IP. The port changes on every
+    # reconnect, so it would make a new device each time (bottles behind one
+    # NAT address share a row instead)
+    return state.bottle_id or state.addr[0]
 
-    pill_weight = subj_data["pillWeight"]
-    prescription = subj_data["prescription"]  # JSON: should include "pillsPerDose" and "pillCount"
-    dosing_windows = subj_data["dosingWindows"]  # JSON with window labels & times
 
-    pills_per_dose = int(prescription.get("pillsPerDose", 1))
-    pill_count = int(prescription.get("pillCount", 0))
+async def handle_bottle(reader, writer):
+    addr = writer.get_extra_info("peername")
+    state = BottleState(addr)
+    conn_id = next(connection_ids)
+    shards_used = set()
+    detector = None  # created on the first raw sample batch
+    debouncer = Debouncer(DEBOUNCE_QUIET, DEBOUNCE_TOLERANCE) if DEBOUNCE_QUIET > 0 else None
+    loop = asyncio.get_running_loop()
+    metrics.CONNECTIONS.inc()
+    metrics.OPEN_CONNECTIONS.inc()
+    log.info("connected", addr=addr)
 
-    grams_per_pill = pill_weight if pill_weight else grams / max(1, pill_count)
+    def acknowledge(count=1, ack=b"ok\n"):
+        if ACK_READINGS and count:
+            writer.write(ack * count)
 
-    # --- Anomaly detection ---
-    anomaly_id = "0"  # default = no anomaly
+    async def store(grams, count):
+        # Runs on an ingest_queue worker, one reading of this bottle at a time.
+        # Supabase calls are blocking, so they go to the thread pool; `count`
+        # is how many readings were coalesced into this one.
+        try:
+            with metrics.stage("store"):
+                if shard_pool is None:
+                    data = await loop.run_in_executor(db_executor, insert_to_supabase, grams, state)
+                else:
+                    # The subject is decided here, fallback included, and the
+                    # reading goes to the shard that owns it: one subject, one
+                    # process. Resolving can reload routes, so not on the loop.
+                    subject_id = await loop.run_in_executor(db_executor, resolve_subject, state)
+                    if subject_id is None:
+                        data = None
+                    else:
+                        shard = shard_pool.shard_for(subject_id)
+                        shards_used.add(shard)
+                        data = await shard_pool.insert(shard, conn_id, grams, addr, state.bottle_id,
+                                                       subject_id, state.previous_weight)
+                        if data is not None:
+                            state.previous_weight = grams  # carried to whichever shard gets the next one
+            if data is None:  # no subject to store it for
+                acknowledge(count, b"err\n")
+                return
+            if PUSH_PORT:
+                push_hub.publish(data)  # back on the loop: one serialization, every subscriber
+            acknowledge(count)
+        except Exception as e:
+            metrics.ERRORS.inc("insert")
+            log.error("insert_failed", addr=addr, error=e)
+            acknowledge(count, b"err\n")
 
-    # Count pills taken
-    pills_taken = round((previous_weight - grams) / grams_per_pill) if grams_per_pill > 0 else 0
-    if pills_taken != pills_per_dose:
-        anomaly_id = "3"  # wrong count
+    mailbox = ingest_queue.mailbox(store)
 
-    # Timing anomaly check
-    event_dt = datetime.strptime(f"{event_date} {event_time}", "%m/%d/%y %I:%M %p")
-    in_any_window = False
-    WINDOW_MARGIN = timedelta(minutes=30)
+    async def forward(grams):
+        # Queued, so a slow database doesn't stop this socket being read
+        # (unless the queue is saturated and the policy says to pause)
+        await ingest_queue.put(mailbox, grams)
 
-    if dosing_windows:
-        for label, t in dosing_windows.items():
-            sched_time = datetime.strptime(f"{event_date} {t}", "%m/%d/%y %H:%M")
-            if sched_time - WINDOW_MARGIN <= event_dt <= sched_time + WINDOW_MARGIN:
-                in_any_window = True
+    async def release():
+        # Debounced reading went quiet: forward the net change (if any)
+        grams = debouncer.flush()
+        if grams is None:
+            acknowledge()
+        else:
+            await forward(grams)
+
+    last_line = loop.time()
+    try:
+        while True:
+            timeout = SOCKET_TIMEOUT - (loop.time() - last_line)
+            due = debouncer.due_in(loop.time()) if debouncer else None
+            try:
+                raw = await asyncio.wait_for(reader.readline(), timeout if due is None else min(timeout, due))
+            except asyncio.TimeoutError:
+                if due is not None and debouncer.due_in(loop.time()) == 0:
+                    await release()
+                    continue
+                log.info("disconnected", addr=addr, reason="timeout")
+                break
+            except ValueError:
+                # Line longer than the stream limit; the firmware never does this
+                metrics.ERRORS.inc("line_too_long")
+                log.warning("disconnected", addr=addr, reason="line too long")
+                break
+            except ConnectionError:
+                metrics.ERRORS.inc("connection_reset")
+                log.info("disconnected", addr=addr, reason="reset")
+                break
+            if not raw:
+                log.info("disconnected", addr=addr, reason="closed")
                 break
 
-        if not in_any_window:
-            nearest = min(
-                [datetime.strptime(f"{event_date} {t}", "%m/%d/%y %H:%M") for t in dosing_windows.values()],
-                key=lambda x: abs((x - event_dt).total_seconds()),
-            )
-            if event_dt < nearest:
-                anomaly_id = "1"  # too early
+            last_line = loop.time()
+            line = raw.strip()
+            if not line:
+                continue
+            state.lines += 1
+
+            bottle_id = parse_bottle_id(line)
+            if bottle_id is not None:
+                # Handshake: readings from here on go to this bottle's subject
+                state.bottle_id = bottle_id
+                metrics.LINES.inc("handshake")
+                log.info("handshake", addr=addr, bottle=bottle_id, subject=routes.subject_for(bottle_id, reload=False))
+
+            # Any line (readings, "Alive") shows the bottle is up
+            presence.seen(device_id(state))
+            if bottle_id is not None:
+                continue
+
+            with metrics.stage("parse"):
+                samples = parse_samples(line) if RAW_SAMPLES else None
+                if samples is not None:
+                    # Raw mode: only settled weights become readings
+                    if detector is None:
+                        detector = StabilityDetector(**DETECTOR_SETTINGS)
+                    readings = [weight for _, weight in detector.feed(samples)]
+                else:
+                    grams = parse_grams(line)
+                    readings = [] if grams is None else [grams]
+
+            if samples is not None:
+                metrics.LINES.inc("raw")
+                for weight in readings:
+                    log.info("settled", addr=addr, grams=round(weight, 3))
+            elif readings:
+                metrics.LINES.inc("reading")
+                log.debug("reading", addr=addr, grams=readings[0])
             else:
-                anomaly_id = "2"  # too late
-
-    # --- Adherence score ---
-    events_today = supabase.table("events").select("anomalyId").eq("subjectId", subject_id).eq("date", event_date).execute()
-    total_events = len(events_today.data) + 1
-    bad_events = sum(1 for e in events_today.data if e["anomalyId"] != "0") + (1 if anomaly_id != "0" else 0)
-    adherence_score = str(int(100 * (1 - bad_events / total_events))) if total_events > 0 else "100"
-
-    # --- Update subject ---
-    supabase.table("subjects").update({
-        "currAdherenceScore": float(adherence_score),
-        "pillWeight": grams_per_pill
-    }).eq("subjectId", subject_id).execute()
-
-    # --- Save event ---
-    data = {
-        "subjectId": subject_id,
-        "date": event_date,
-        "time": event_time,
-        "grams": str(grams),
-        "anomalyId": anomaly_id,
-        "adherenceScore": adherence_score,
-        "pillCount": pill_count
-    }
-    response = supabase.table("events").insert(data).execute()
-    print("Inserted:", data)
-    print("Response:", response)
-
-    previous_weight = grams
-
-
-# TCP server loop
-with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-    s.bind((HOST, PORT))
-    s.listen()
-    print(f"Listening on {HOST}:{PORT}...")
-
-    while True:
-        conn, addr = s.accept()
-        conn.settimeout(60)
-        print(f"Connected by {addr}")
-        with conn:
-            buffer = ""
-            while True:
-                try:
-                    data = conn.recv(1024)
-                except socket.timeout:
-                    print("Socket timeout, closing connection.")
-                    break
-                if not data:
-                    print(f"Connection closed by {addr}")
-                    break
-
-                buffer += data.decode()
-
-                while "\n" in buffer:
-                    line, buffer = buffer.split("\n", 1)
-                    line = line.strip()
-                    if not line:
-                        continue
-
-                    now = datetime.now().strftime("%H:%M:%S")
-                    print(f"{now}: {line}")
-
-                    # try:
-                    #     grams = float(line)
-                    #     print(f"Grams: {grams}")
-                    #     insert_to_supabase(grams)
-                    # except ValueError:
-                    #     continue
+                metrics.LINES.inc("ping")
+                if not ingest_queue.admit_ping():
+                    continue  # shedding pings while the queue is saturated
+                if log.enabled("debug"):
+                    log.debug("line", addr=addr, line=line.decode(errors="replace"))
+
+            for grams in readings:
+                state.readings += 1
+                if debouncer is None:
+                    await forward(grams)
+                else:
+                    # Held until the bottle goes quiet; an absorbed earlier
+                    # reading is done with, so acknowledge it now
+                    acknowledge(debouncer.add(grams, loop.time()))
+
+        # Don't lose a dose taken right before disconnecting
+        if debouncer is not None and debouncer.held is not None:
+            await release()
+        await mailbox.drained()  # acks go out before the socket closes
+    finally:
+        metrics.OPEN_CONNECTIONS.inc(amount=-1)
+        if detector is not None:
+            log.info("raw_stream", addr=addr, **detector.stats())
+        if debouncer is not None:
+            stats = debouncer.stats()
+            debounce_totals.update(received=stats["received"], forwarded=stats["forwarded"],
+                                   suppressed=stats["suppressed"])
+            log.info("debounce", addr=addr, **stats)
+        if shard_pool is not None:
+            shard_pool.close_connection(conn_id, shards_used)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+def raise_fd_limit():
+    # Each bottle holds a socket open, so lift the soft fd limit to the hard limit
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def on_subjects_changed():
+    print("Refreshing subject cache:", subject_cache.stats())
+    print("Refreshing bottle routes:", routes.stats())
+    print("Devices:", presence.stats())
+    print("Ingest queue:", ingest_queue.stats())
+    if PUSH_PORT:
+        print("Push:", push_hub.stats())
+    print("Debounce totals:", dict(debounce_totals))
+    refresh_subjects()
+    if shard_pool is not None:
+        print("Shards:", shard_pool.stats())
+        shard_pool.broadcast("refresh")
+        shard_pool.broadcast("stats")
+
+
+async def serve_async():
+    raise_fd_limit()
+    server = await asyncio.start_server(
+        handle_bottle, HOST, PORT,
+        backlog=LISTEN_BACKLOG, limit=MAX_LINE_BYTES, reuse_address=True,
+    )
+    ingest_queue.start()
+    metrics.CallbackGauge("dose_queue_depth", "Readings waiting for a database worker", lambda: ingest_queue.depth)
+    metrics.CallbackGauge("dose_devices_online", "Bottles currently online", lambda: presence.online_count)
+    if shard_pool is not None:
+        shard_pool.start(asyncio.get_running_loop())
+    if PUSH_PORT:
+        await push_hub.serve(PUSH_BIND, PUSH_PORT)
+    print(f"Listening on {HOST}:{PORT} (asyncio)...")
+
+    # `kill -HUP <pid>` after editing subjects drops the cached rows
+    if hasattr(signal, "SIGHUP"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, on_subjects_changed)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dose bottle ingest server")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="serve many bottles concurrently with asyncio")
+    parser.add_argument("--ack", action="store_true",
+                        help="acknowledge each reading (used by loadgen.py to measure latency)")
+    parser.add_argument("--raw", action="store_true",
+                        help="accept raw sample batches (raw:v1,v2,...) and detect settled weights server-side")
+    parser.add_argument("--window", type=int, help="raw mode: samples in the rolling stddev")
+    parser.add_argument("--enter-sd", type=float, help="raw mode: grams stddev that starts a movement")
+    parser.add_argument("--exit-sd", type=float, help="raw mode: grams stddev that counts as quiet")
+    parser.add_argument("--settle-ms", type=int, help="raw mode: quiet time before a weight is reported")
+    parser.add_argument("--quiet-period", type=float, default=DEBOUNCE_QUIET,
+                        help="seconds a bottle must be quiet before its reading is stored (0 = every reading)")
+    parser.add_argument("--tolerance", type=float, default=DEBOUNCE_TOLERANCE,
+                        help="grams within which readings are the same weight")
+    parser.add_argument("--queue-high", type=int, default=HIGH_WATERMARK,
+                        help="queued readings at which the ingest queue is saturated")
+    parser.add_argument("--queue-low", type=int, default=LOW_WATERMARK,
+                        help="queued readings at which a saturated queue accepts work again")
+    parser.add_argument("--overload", choices=POLICIES, default=ingest_queue.policy,
+                        help="while saturated: pause reading sockets, drop Alive pings, or coalesce readings")
+    parser.add_argument("--metrics-port", type=int, default=0,
+                        help="serve Prometheus metrics on 127.0.0.1:PORT/metrics (0 = off)")
+    parser.add_argument("--log-level", choices=list(log.LEVELS), default=log.LEVEL,
+                        help="per-event log level (debug logs every line)")
+    parser.add_argument("--log-rate", type=float, default=log.RATE,
+                        help="max log lines per second per message type")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="store readings in N worker processes, sharded by subject (0 = in this process)")
+    parser.add_argument("--offline-after", type=float, default=OFFLINE_AFTER,
+                        help="seconds without a line before a bottle is marked offline")
+    parser.add_argument("--device-retention", type=float, default=RETENTION,
+                        help="seconds offline before a bottle's `devices` row is deleted (0 = keep)")
+    parser.add_argument("--push-port", type=int, default=PUSH_PORT,
+                        help="async: stream stored events as server-sent events on this port (0 = off)")
+    parser.add_argument("--push-host", default=PUSH_HOST,
+                        help="address the push server listens on (patient data: keep it local or behind auth)")
+    parser.add_argument("--push-token", default=os.environ.get("DOSE_PUSH_TOKEN"),
+                        help="require ?token=TOKEN on push requests (default $DOSE_PUSH_TOKEN)")
+    parser.add_argument("--push-origin", help="dashboard origin allowed to read the push server cross-origin")
+    parser.add_argument("--push-ring", type=int, default=RING_SIZE,
+                        help="recent events per subject replayed to new push subscribers")
+    parser.add_argument("--verify-adherence", action="store_true",
+                        help="recount today's events on every reading and report counter drift")
+    parser.add_argument("--batch-size", type=int, default=journal.batch_size,
+                        help="events per bulk insert from the write-behind journal")
+    parser.add_argument("--flush-interval", type=float, default=journal.flush_interval,
+                        help="seconds between journal flushes")
+    parser.add_argument("--retry-max", type=float, default=journal.retry_max,
+                        help="max backoff in seconds after a failed flush")
+    args = parser.parse_args()
+    log.set_level(args.log_level, args.log_rate)
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+    adherence.verify = args.verify_adherence
+    ACK_READINGS = args.ack
+    RAW_SAMPLES = args.raw
+    DEBOUNCE_QUIET = args.quiet_period
+    DEBOUNCE_TOLERANCE = args.tolerance
+    PUSH_PORT = args.push_port
+    PUSH_BIND = args.push_host
+    push_hub.ring_size = args.push_ring
+    push_hub.token, push_hub.origin = args.push_token, args.push_origin
+    if PUSH_PORT and PUSH_BIND not in ("127.0.0.1", "localhost", "::1") and not push_hub.token:
+        parser.error("--push-host other than localhost needs --push-token (the stream is patient data)")
+    DETECTOR_SETTINGS = {name: value for name, value in (
+        ("window", args.window), ("enter_sd", args.enter_sd), ("exit_sd", args.exit_sd),
+        ("settle", args.settle_ms and args.settle_ms * SAMPLE_HZ // 1000),
+    ) if value is not None}
+    try:
+        StabilityDetector(**DETECTOR_SETTINGS)  # bad thresholds fail here, not on the first raw batch
+    except ValueError as e:
+        parser.error(str(e))
+    journal.batch_size = args.batch_size
+    journal.flush_interval = args.flush_interval
+    journal.retry_max = args.retry_max
+    journal.start()
+
+    if args.use_async:
+        # Built here: the timer wheel is sized from offline_after
+        presence = PresenceTracker(storage.upsert_devices, storage.delete_devices,
+                                   offline_after=args.offline_after, retention=args.device_retention)
+        ingest_queue.high, ingest_queue.low, ingest_queue.policy = args.queue_high, args.queue_low, args.overload
+        if args.shards:
+            shard_pool = ShardPool(args.shards, {
+                "verify_adherence": args.verify_adherence, "batch_size": args.batch_size,
+                "flush_interval": args.flush_interval, "retry_max": args.retry_max,
+                "log_level": args.log_level, "log_rate": args.log_rate,
+                "metrics_port": args.metrics_port,
+            })
+            atexit.register(shard_pool.stop)
+            signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # so the shards flush their journals
+        presence.start()
+        atexit.register(presence.close)
+        asyncio.run(serve_async())
+    else:
+        serve_blocking()
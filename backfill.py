@@ -0,0 +1,240 @@
+# Re-score stored events after a subject's prescription, pillWeight or dosing
+# windows change. Recomputes anomalyId/adherenceScore with the same rules as
+# insert_to_supabase (batch_classify.classify_batch) and writes back only the
+# rows whose values changed.
+#
+#   python backfill.py --subject 12
+#   python backfill.py --all --workers 8
+#   python backfill.py --all --resume        (skip subjects already finished)
+#
+# Progress is checkpointed per subject in backfill_checkpoint.db after every
+# update batch, so an interrupted run picks up where it stopped. Running ingest
+# servers cache subjects, so refresh them afterwards (SIGHUP backend.py, or
+# POST /refresh on the harness). archive.py only archives new events, so
+# rebuild the archive too if you keep one.
+#
+# History is replayed in event id order with the bottle weight starting at 0 g,
+# the same as a fresh connection in the live path.
+
+import argparse
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import numpy as np
+
+import storage
+from batch_classify import classify_batch
+from subject_cache import SubjectInfo
+
+PAGE_SIZE = 1000  # events fetched per request
+UPDATE_BATCH = 500  # changed events written per checkpoint
+CHECKPOINT_PATH = "backfill_checkpoint.db"
+
+
+class Checkpoints:
+    # subject_id -> (last event id written, finished?). Safe to share between
+    # worker processes: each opens its own connection and WAL serializes writes.
+    def __init__(self, path=CHECKPOINT_PATH):
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                subject_id INTEGER PRIMARY KEY,
+                last_id INTEGER NOT NULL,
+                done INTEGER NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+
+    def get(self, subject_id):
+        row = self._db.execute("SELECT last_id, done FROM checkpoints WHERE subject_id = ?", (subject_id,)).fetchone()
+        return (row[0], bool(row[1])) if row else (0, False)
+
+    def save(self, subject_id, last_id, done=False):
+        self._db.execute(
+            "INSERT OR REPLACE INTO checkpoints (subject_id, last_id, done, updated_at) VALUES (?, ?, ?, ?)",
+            (subject_id, last_id, int(done), datetime.now().isoformat(timespec="seconds")),
+        )
+
+    def clear(self, subject_ids):
+        self._db.executemany("DELETE FROM checkpoints WHERE subject_id = ?", [(s,) for s in subject_ids])
+
+
+_parsed = {}
+
+
+def parse_timestamp(event_date, event_time):
+    # events store "%m/%d/%y" and "%I:%M %p"; there are only so many distinct
+    # values, so memoize instead of calling strptime per row
+    key = (event_date, event_time)
+    ts = _parsed.get(key)
+    if ts is None:
+        ts = _parsed[key] = np.datetime64(datetime.strptime(f"{event_date} {event_time}", "%m/%d/%y %I:%M %p"), "s")
+    return ts
+
+
+def history_pages(db, subject_id, page_size=PAGE_SIZE):
+    # A subject's events one page at a time, by id (keyset pagination)
+    after_id = 0
+    while True:
+        page = db.events_page(subject_id, after_id, page_size)
+        if page:
+            yield page
+        if len(page) < page_size:
+            return
+        after_id = page[-1]["id"]
+
+
+class Replay:
+    # Scores a subject's history page by page. Between pages it carries what
+    # classify_batch would otherwise only see within one call: the bottle
+    # weight before the page, grams per pill (guessed from the very first
+    # reading when the subject has no pillWeight, as the live path stores it)
+    # and the running anomaly/event counts of the current day.
+    def __init__(self, subject):
+        self.subject = subject
+        self.previous_weight = 0.0
+        self.day = None  # day number (since epoch) the counts below are for
+        self.total = 0
+        self.bad = 0
+
+    def score(self, page):
+        # (anomaly ids, adherence scores) as lists of str, in page order
+        ts = np.array([parse_timestamp(e["date"], e["time"]) for e in page])
+        grams = np.array([float(e["grams"]) for e in page])
+        sid = self.subject.subject_id
+        scored = classify_batch(np.full(len(page), sid), ts, grams, {sid: self.subject},
+                                previous_weight=self.previous_weight)
+        if not self.subject.pill_weight:
+            self.subject.pill_weight = float(scored["grams_per_pill"][0])
+
+        # classify_batch's own adherence restarts with the page; redo it in
+        # its (time) order, continuing the day that was open at the last page
+        order = np.argsort(ts.astype("datetime64[s]").astype(np.int64), kind="stable")
+        day = ts[order].astype("datetime64[D]").astype(np.int64)
+        bad = (scored["anomaly_id"][order] != 0).astype(np.int64)
+        new_day = np.ones(len(page), dtype=bool)
+        new_day[1:] = day[1:] != day[:-1]
+        segment = np.cumsum(new_day) - 1
+        segment_start = np.flatnonzero(new_day)
+        total = np.arange(len(page)) - segment_start[segment] + 1
+        bad_so_far = np.cumsum(bad)
+        bad_count = bad_so_far - (bad_so_far[segment_start] - bad[segment_start])[segment]
+        if day[0] == self.day:
+            total[segment == 0] += self.total
+            bad_count[segment == 0] += self.bad
+        adherence = np.empty(len(page), dtype=np.int64)
+        adherence[order] = np.trunc(100 * (1 - bad_count / total))
+
+        self.previous_weight = float(grams[order[-1]])
+        self.day, self.total, self.bad = int(day[-1]), int(total[-1]), int(bad_count[-1])
+        return scored["anomaly_id"].astype(str).tolist(), adherence.astype(str).tolist()
+
+
+def rescore_subject(subject_id, checkpoint_path=CHECKPOINT_PATH, page_size=PAGE_SIZE,
+                    batch_size=UPDATE_BATCH, dry_run=False):
+    # Returns (subject_id, events scanned, events changed). History is streamed
+    # a page at a time, so memory doesn't grow with the subject's event count;
+    # a resumed run still replays from the start (for the carried state) but
+    # only writes rows after its checkpoint.
+    db = storage.get_storage()
+    checkpoints = Checkpoints(checkpoint_path)
+    resume_after, done = checkpoints.get(subject_id)
+    if done:
+        return subject_id, 0, 0
+
+    row = db.get_subject(subject_id)
+    if row is None:
+        if not dry_run:
+            checkpoints.save(subject_id, 0, done=True)
+        return subject_id, 0, 0
+
+    replay = Replay(SubjectInfo(subject_id, row))
+    scanned = changed = 0
+    pending = []  # (event id, anomalyId, adherenceScore) still to write
+    last_id, last_score = 0, None
+
+    def write(batch):
+        # One update per (anomalyId, adherenceScore) pair, then checkpoint
+        groups = {}
+        for event_id, a, s in batch:
+            groups.setdefault((a, s), []).append(event_id)
+        for (a, s), ids in groups.items():
+            db.update_events(ids, {"anomalyId": a, "adherenceScore": s})
+        checkpoints.save(subject_id, batch[-1][0])
+
+    for page in history_pages(db, subject_id, page_size):
+        anomaly_ids, scores = replay.score(page)
+        for e, a, s in zip(page, anomaly_ids, scores):
+            if e["id"] > resume_after and (str(e["anomalyId"]), str(e["adherenceScore"])) != (a, s):
+                changed += 1
+                if not dry_run:
+                    pending.append((e["id"], a, s))
+        scanned += len(page)
+        last_id, last_score = page[-1]["id"], scores[-1]
+        while len(pending) >= batch_size:
+            write(pending[:batch_size])
+            del pending[:batch_size]
+
+    if dry_run:
+        return subject_id, scanned, changed
+    if pending:
+        write(pending)
+    if last_score is not None:
+        # Latest event's score is what the dashboard shows for the subject
+        db.update_subject(subject_id, {"currAdherenceScore": float(last_score)})
+    checkpoints.save(subject_id, last_id, done=True)
+    return subject_id, scanned, changed
+
+
+def _init_worker():
+    # Each process opens its own database client
+    storage.set_storage(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score stored events for subjects")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--subject", type=int, action="append", help="subjectId (repeatable)")
+    target.add_argument("--all", action="store_true", help="every subject")
+    parser.add_argument("--workers", type=int, default=1, help="parallel worker processes")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--batch-size", type=int, default=UPDATE_BATCH)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--resume", action="store_true", help="continue from existing checkpoints")
+    parser.add_argument("--dry-run", action="store_true", help="count changes without writing")
+    args = parser.parse_args()
+
+    subject_ids = args.subject or storage.get_storage().subject_ids()
+    if not args.resume:
+        Checkpoints(args.checkpoint).clear(subject_ids)
+
+    options = dict(checkpoint_path=args.checkpoint, page_size=args.page_size,
+                   batch_size=args.batch_size, dry_run=args.dry_run)
+    start = time.perf_counter()
+    scanned = changed = 0
+
+    def report(subject_id, n_events, n_changed):
+        nonlocal scanned, changed
+        scanned += n_events
+        changed += n_changed
+        if n_changed:
+            print(f"Subject {subject_id}: {n_changed}/{n_events} events {'would change' if args.dry_run else 'updated'}")
+
+    if args.workers <= 1:
+        for sid in subject_ids:
+            report(*rescore_subject(sid, **options))
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as pool:
+            futures = [pool.submit(rescore_subject, sid, **options) for sid in subject_ids]
+            for future in as_completed(futures):
+                report(*future.result())
+
+    elapsed = time.perf_counter() - start
+    print(f"Re-scored {len(subject_ids)} subjects, {scanned} events, {changed} changed in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# Vectorized version of the anomaly/adherence rules in ingest.insert_to_supabase.
+#
+# classify_batch() scores whole arrays of (subjectId, timestamp, grams) at once:
+# events are ordered per subject by time, pill counts come from np.diff-style
+# shifts inside each subject group, window timing from one np.searchsorted over
+# every subject's windows, and adherence from cumulative sums per (subject, day).
+# The live path calls it with a batch of one, so both share the same rules.
+
+import numpy as np
+from dosing_windows import MINUTES_PER_DAY, WINDOW_MARGIN
+
+# Spacing between subjects in the combined window array; anything > 1 day + margins works
+SUBJECT_STRIDE = 4 * MINUTES_PER_DAY
+
+
+def _subject_table(keys, subjects):
+    # Per-subject parameters as arrays indexed by rank (position in `keys`)
+    n = len(keys)
+    pill_weight = np.zeros(n)
+    pills_per_dose = np.zeros(n, dtype=np.int64)
+    pill_count = np.zeros(n, dtype=np.int64)
+    win_start = np.zeros(n, dtype=np.int64)
+    win_end = np.zeros(n, dtype=np.int64)
+    win_minutes, win_order = [], []
+
+    for rank, subject_id in enumerate(keys.tolist()):
+        subject = subjects[subject_id]
+        pill_weight[rank] = subject.pill_weight or 0.0
+        pills_per_dose[rank] = subject.pills_per_dose
+        pill_count[rank] = subject.pill_count
+        index = subject.window_index
+        win_start[rank] = len(win_minutes)
+        win_minutes.extend(rank * SUBJECT_STRIDE + m for m in index.minutes)
+        win_order.extend(index.order)
+        win_end[rank] = len(win_minutes)
+
+    windows = (np.array(win_minutes, dtype=np.int64), np.array(win_order, dtype=np.int64), win_start, win_end)
+    return pill_weight, pills_per_dose, pill_count, windows
+
+
+def _timing(rank, minute, windows, margin):
+    # 0 in window, 1 too early, 2 too late (same rules as DosingWindowIndex.classify)
+    win_minutes, win_order, win_start, win_end = windows
+    start, end = win_start[rank], win_end[rank]
+    has_windows = end > start
+    timing = np.zeros(len(rank), dtype=np.int8)
+    if not has_windows.any():
+        return timing
+
+    key = rank * SUBJECT_STRIDE + minute
+    i = np.searchsorted(win_minutes, key, side="left")
+    # Previous and next window, wrapping past midnight to yesterday's last /
+    # tomorrow's first; distances are taken mod one day
+    last_i = len(win_minutes) - 1
+    before_i = np.clip(np.where(i > start, i - 1, end - 1), 0, last_i)
+    after_i = np.clip(np.where(i < end, i, start), 0, last_i)
+    before = (key - win_minutes[before_i]) % MINUTES_PER_DAY
+    after = (win_minutes[after_i] - key) % MINUTES_PER_DAY
+    in_window = ~has_windows | (after <= margin) | (before <= margin)
+
+    late = (before < after) | ((before == after) & (win_order[before_i] <= win_order[after_i]))
+    timing[~in_window] = np.where(late[~in_window], 2, 1)
+    return timing
+
+
+def classify_batch(subject_ids, timestamps, grams, subjects, previous_weight=0.0, margin=WINDOW_MARGIN):
+    """Score events in bulk.
+
+    subject_ids, timestamps and grams are equal-length arrays; timestamps are
+    local wall-clock datetime64 (or anything NumPy converts to it). subjects
+    maps subjectId -> SubjectInfo. previous_weight is the bottle weight before
+    each subject's first event (a number, or a dict keyed by subjectId).
+
+    Returns a dict of arrays in input order: anomaly_id (int8), pills_taken,
+    grams_per_pill and adherence (running per subject per day, as stored in
+    events.adherenceScore).
+    """
+    subject_ids = np.asarray(subject_ids)
+    ts = np.asarray(timestamps).astype("datetime64[s]").astype(np.int64)
+    grams = np.asarray(grams, dtype=np.float64)
+    n = len(subject_ids)
+
+    keys, rank = np.unique(subject_ids, return_inverse=True)
+    rank = rank.reshape(-1)
+    pill_weight, pills_per_dose, pill_count, windows = _subject_table(keys, subjects)
+
+    # Sort by subject, then time (lexsort is stable, so ties keep input order)
+    order = np.lexsort((ts, rank))
+    rank, ts, g = rank[order], ts[order], grams[order]
+    new_subject = np.ones(n, dtype=bool)
+    new_subject[1:] = rank[1:] != rank[:-1]
+    group = np.cumsum(new_subject) - 1
+    group_start = np.flatnonzero(new_subject)
+
+    # Previous reading: the one before it for the same subject
+    prev = np.empty(n)
+    prev[1:] = g[:-1]
+    if isinstance(previous_weight, dict):
+        prev[group_start] = [previous_weight.get(k, 0.0) for k in keys[rank[group_start]].tolist()]
+    else:
+        prev[group_start] = previous_weight
+
+    # Grams per pill: subject's pillWeight, else the first reading / pillCount
+    # (the live path stores that guess as pillWeight after the first event)
+    fallback = g[group_start] / np.maximum(1, pill_count[rank[group_start]])
+    known = pill_weight[rank] > 0
+    grams_per_pill = np.where(known, pill_weight[rank], fallback[group])
+
+    # Pill count anomaly (np.round and round() both round half to even)
+    positive = grams_per_pill > 0
+    ratio = np.divide(prev - g, grams_per_pill, out=np.zeros(n), where=positive)
+    pills_taken = np.where(positive, np.round(ratio), 0).astype(np.int64)
+    anomaly = np.where(pills_taken != pills_per_dose[rank], 3, 0).astype(np.int8)
+
+    # Timing anomaly overrides the count anomaly, as in the live path
+    minute = (ts // 60) % MINUTES_PER_DAY
+    timing = _timing(rank, minute, windows, margin)
+    anomaly = np.where(timing != 0, timing, anomaly).astype(np.int8)
+
+    # Running adherence per (subject, day)
+    day = ts // 86400
+    new_day = new_subject.copy()
+    new_day[1:] |= day[1:] != day[:-1]
+    segment = np.cumsum(new_day) - 1
+    segment_start = np.flatnonzero(new_day)
+    total = np.arange(n) - segment_start[segment] + 1
+    bad = (anomaly != 0).astype(np.int64)
+    bad_so_far = np.cumsum(bad)
+    bad_count = bad_so_far - (bad_so_far[segment_start] - bad[segment_start])[segment]
+    adherence = np.trunc(100 * (1 - bad_count / total)).astype(np.int64)
+
+    result = {}
+    for name, values in (("anomaly_id", anomaly), ("pills_taken", pills_taken),
+                         ("grams_per_pill", grams_per_pill), ("adherence", adherence)):
+        out = np.empty_like(values)
+        out[order] = values
+        result[name] = out
+    return result
@@ -0,0 +1,47 @@
+# Benchmark of the vectorized anomaly/adherence scoring.
+#
+#   python bench_classify.py --subjects 1000 --events 2000000
+
+import argparse
+import time
+
+import numpy as np
+
+from batch_classify import classify_batch
+from subject_cache import SubjectInfo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark classify_batch")
+    parser.add_argument("--subjects", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=2_000_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    subjects = {}
+    for sid in range(args.subjects):
+        doses = int(rng.integers(1, 5))
+        windows = {f"window_{i + 1}": f"{6 + i * 16 // max(1, doses - 1):02d}:00" for i in range(doses)}
+        subjects[sid] = SubjectInfo(sid, {
+            "pillWeight": round(float(rng.uniform(0.25, 1.0)), 3),
+            "prescription": {"pillsPerDose": int(rng.integers(1, 4)), "pillCount": 90},
+            "dosingWindows": windows,
+        })
+
+    subject_ids = rng.integers(0, args.subjects, args.events)
+    timestamps = np.datetime64("2025-01-01") + rng.integers(0, 365 * 86400, args.events).astype("timedelta64[s]")
+    grams = rng.uniform(0, 60, args.events)
+
+    start = time.perf_counter()
+    result = classify_batch(subject_ids, timestamps, grams, subjects)
+    elapsed = time.perf_counter() - start
+
+    counts = np.bincount(result["anomaly_id"], minlength=4)
+    print(f"{args.events:,} events / {args.subjects:,} subjects in {elapsed:.2f}s "
+          f"({args.events / elapsed:,.0f} events/s)")
+    print("anomalies by id:", dict(enumerate(counts.tolist())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# Microbenchmark: line framing under burst input (a reconnecting bottle
+# flushing a backlog). Compares the old str buffer (`buffer += data.decode()`
+# then `split("\n", 1)` per line) with framing.LineFramer.
+#
+#   python bench_framing.py --lines 200000
+
+import argparse
+import socket
+import threading
+import time
+
+from framing import LineFramer, parse_grams
+
+
+def make_burst(n_lines):
+    lines = []
+    for i in range(n_lines):
+        lines.append("Alive" if i % 10 == 0 else f"{100 - (i % 1000) * 0.013:.3f}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+def old_framing(data, chunk):
+    buffer, count = "", 0
+    for i in range(0, len(data), chunk):
+        buffer += data[i:i + chunk].decode()
+        while "\n" in buffer:
+            line, buffer = buffer.split("\n", 1)
+            line = line.strip()
+            if line:
+                count += 1
+                try:
+                    float(line)
+                except ValueError:
+                    pass
+    return count
+
+
+def new_framing(data, chunk):
+    framer, count = LineFramer(), 0
+    for i in range(0, len(data), chunk):
+        for line in framer.feed(data[i:i + chunk]):
+            count += 1
+            parse_grams(line)
+    return count
+
+
+def new_framing_socket(data):
+    # Same, but through a real socket with recv_into
+    a, b = socket.socketpair()
+    sender = threading.Thread(target=lambda: (a.sendall(data), a.close()))
+    sender.start()
+    framer, count = LineFramer(), 0
+    while framer.recv_from(b):
+        for line in framer.lines():
+            count += 1
+            parse_grams(line)
+    sender.join()
+    b.close()
+    return count
+
+
+def timed(label, fn, n_lines):
+    start = time.perf_counter()
+    count = fn()
+    elapsed = time.perf_counter() - start
+    assert count == n_lines, (label, count)
+    print(f"{label:<28} {elapsed * 1000:8.1f} ms  {n_lines / elapsed:>12,.0f} lines/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bottle line framing")
+    parser.add_argument("--lines", type=int, default=200_000)
+    args = parser.parse_args()
+
+    data = make_burst(args.lines)
+    print(f"{args.lines:,} lines, {len(data):,} bytes")
+    for chunk in (1024, 64 * 1024):
+        timed(f"str split, {chunk}B chunks", lambda: old_framing(data, chunk), args.lines)
+        timed(f"LineFramer, {chunk}B chunks", lambda: new_framing(data, chunk), args.lines)
+    timed("LineFramer, socket recv_into", lambda: new_framing_socket(data), args.lines)
+
+
+if __name__ == "__main__":
+    main()
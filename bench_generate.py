@@ -0,0 +1,395 @@
+# Vectorized woz.generate vs the original per-row implementation.
+#
+#   python bench_generate.py                         (checks + timing at 100 subjects)
+#   python bench_generate.py --subjects 100000 --days 365 --skip-legacy
+#   python bench_generate.py --check                 (checks only; exit status 1 if any fails)
+#
+# Checks, on small inputs:
+#   - simulate_bottles reproduces the old iterrows bottle pass exactly when both
+#     get the same events and noise (woz events, plus random tiny bottles that
+#     refill all the time);
+#   - over several seeds, every summary statistic of the new generator matches
+#     the old one within 4 standard errors (the random streams differ, so rows
+#     can't match one-to-one).
+#
+# Failed checks are reported and make the exit status 1 (with or without
+# --check), so CI can run `python bench_generate.py --check`.
+
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import date, timedelta, time as dtime
+
+import numpy as np
+import pandas as pd
+
+import woz
+from woz import (NUM_SUBJECTS, first_names, last_names, race_choices, race_probs, doses_choices, doses_probs,
+                 pills_per_dose_choices, pills_probs, male_height_mean_cm, male_height_sd_cm, male_weight_mean_kg,
+                 male_weight_sd_kg, female_height_mean_cm, female_height_sd_cm, female_weight_mean_kg,
+                 female_weight_sd_kg)
+
+TODAY = date(2025, 9, 27)
+
+
+# --- Original implementation ---
+
+# Map WOZ anomaly labels to numeric id + adherence + dose multiplier
+# 0 = on time/normal, 1 = extra, 2 = partial, 3 = missed
+def anomaly_props(label, pills_per_dose):
+    if label == "missed":   # no change
+        return 3, 0.0, 0.0
+    if label == "partial":  # ~half dose
+        return 2, 0.8, max(0.5, pills_per_dose * 0.5)
+    if label == "extra":    # one extra pill
+        return 1, 0.9, pills_per_dose + 1
+    return 0, 1.0, pills_per_dose  # normal
+
+
+def legacy_bottles(ev, noise=None):
+    # The original iterrows pass; noise=None draws it per row like before
+    pill_counts = []
+    bottle_grams = []
+    anom_ids = []
+    adherences = []
+
+    state = {}  # per-subject state: pills_left, capacity, prev_grams
+
+    for i, row in ev.iterrows():
+        sid = row["subject_id"]
+        if sid not in state:
+            state[sid] = {
+                "pills_left": float(row["pill_count"]),
+                "capacity":   float(row["pill_count"]),
+                "prev_grams": float(row["pill_count"]) * float(row["grams_per_pill"]),
+            }
+
+        pills_left = state[sid]["pills_left"]
+        cap        = state[sid]["capacity"]
+        gpp        = float(row["grams_per_pill"])
+
+        an_id, adh, dose_pills = anomaly_props(row["anomaly_id"], float(row["pills_per_dose"]))
+
+        # Refill if not enough pills for the intended dose
+        if pills_left < dose_pills and an_id != 3:  # don't refill for a missed dose; allow bottle to sit
+            pills_left = cap
+
+        # Apply dose (missed => 0)
+        pills_left = max(0.0, pills_left - dose_pills)
+
+        # Bottle reading after the event
+        base_grams = pills_left * gpp
+        noisy = base_grams * (float(np.random.normal(1.0, 0.003)) if noise is None else noise[i])  # tiny noise
+        # Enforce monotonic non-increasing unless we refilled this step
+        prev = state[sid]["prev_grams"]
+        refilled = base_grams > prev  # this only happens when we refilled above
+        grams_read = noisy if refilled else min(noisy, prev)
+
+        # Save state & outputs
+        state[sid]["pills_left"] = pills_left
+        state[sid]["prev_grams"] = grams_read
+
+        pill_counts.append(int(round(pills_left)))
+        bottle_grams.append(round(grams_read, 3))
+        anom_ids.append(an_id)
+        adherences.append(adh)
+
+    return pill_counts, bottle_grams, anom_ids, adherences
+
+
+def legacy_events(num_subjects=NUM_SUBJECTS, seed=42, today=None):
+    # First half of the old woz.generate: per-row draws, events sorted for the bottle pass
+    random.seed(seed)
+    np.random.seed(seed)
+
+    # Date range for events (last 180 days)
+    today = today or date.today()
+    start_date = today - timedelta(days=180)
+    days_range = (today - start_date).days
+
+    subjects_rows = []
+    events_rows = []
+
+    for sid in range(num_subjects):
+        sex = random.choice(["M", "F"])
+        first_name = random.choice(first_names)
+        last_name = random.choice(last_names)
+        # age: truncated normal between 18 and 85
+        age = int(np.clip(np.random.normal(45, 18), 18, 85))
+        race = np.random.choice(race_choices, p=race_probs)
+
+        if sex == "M":
+            height = float(np.clip(np.random.normal(male_height_mean_cm, male_height_sd_cm), 150, 200))
+            weight = float(np.clip(np.random.normal(male_weight_mean_kg, male_weight_sd_kg), 50, 160))
+        else:
+            height = float(np.clip(np.random.normal(female_height_mean_cm, female_height_sd_cm), 140, 190))
+            weight = float(np.clip(np.random.normal(female_weight_mean_kg, female_weight_sd_kg), 40, 140))
+
+        pill_count = int(random.randint(30, 180))
+        doses_per_day = int(np.random.choice(doses_choices, p=doses_probs))
+        pills_per_dose = int(np.random.choice(pills_per_dose_choices, p=pills_probs))
+
+        # grams per pill between 0.25 and 1.0 g (typical small pill mass in grams for demo purposes)
+        grams_per_pill = round(float(np.round(np.random.uniform(0.25, 1.0), 3)), 3)
+
+        # Create dosing windows as JSON object: evenly spaced times between 06:00 and 22:00
+        earliest = 6 * 60  # minutes after midnight
+        latest = 22 * 60
+        if doses_per_day == 1:
+            scheduled_minutes = [11 * 60]  # around 11:00
+        else:
+            interval = (latest - earliest) / (doses_per_day - 1)
+            scheduled_minutes = [int(earliest + i * interval) for i in range(doses_per_day)]
+        dosing_windows = {}
+        for i, mins in enumerate(scheduled_minutes):
+            hh = mins // 60
+            mm = mins % 60
+            dosing_windows[f"window_{i+1}"] = f"{hh:02d}:{mm:02d}"
+
+        subjects_rows.append({
+            "subject_id": sid,
+            "first_name": first_name,
+            "last_name": last_name,
+            "age": age,
+            "race": race,
+            "sex": sex,
+            "weight": round(weight,2),
+            "height": round(height,2),
+            "pill_count": pill_count,
+            "doses_per_day": doses_per_day,
+            "pills_per_dose": pills_per_dose,
+            "dosing_windows": json.dumps(dosing_windows),
+            "grams_per_pill": grams_per_pill,
+            "num_anomalies": 0,
+            "adherence_score": 1
+        })
+
+        # Create events for this subject: 80-120 events
+        n_events = random.randint(80, 120)
+        for _ in range(n_events):
+            # random day in range
+            day_offset = random.randint(0, days_range)
+            event_date = start_date + timedelta(days=day_offset)
+
+            # choose one scheduled window and add jitter (normal with sd=20 minutes)
+            scheduled = random.choice(scheduled_minutes)
+            jitter = int(np.clip(np.random.normal(0, 20), -60, 60))
+            event_minutes = scheduled + jitter
+            # clamp to 0..1439
+            event_minutes = int(np.clip(event_minutes, 0, 23*60+59))
+            hh = event_minutes // 60
+            mm = event_minutes % 60
+            event_time = dtime(hh, mm, random.choice([0,0,0,30]))  # occasionally :30 seconds
+
+            # Determine pills taken: mostly equals pills_per_dose, small chance of missed/extra/partial
+            r = random.random()
+            if r < 0.01:
+                pills_taken = 0.0
+                anomaly = "missed"
+            elif r < 0.03:
+                pills_taken = pills_per_dose + 1
+                anomaly = "extra"
+            elif r < 0.035:
+                pills_taken = max(0.5, pills_per_dose * 0.5)
+                anomaly = "partial"
+            else:
+                pills_taken = pills_per_dose
+                anomaly = None
+
+            # grams measured with small measurement noise
+            grams = round(pills_taken * grams_per_pill * float(np.random.normal(1.0, 0.02)), 3)
+            if grams < 0:
+                grams = 0.0
+
+            events_rows.append({
+                "subject_id": sid,
+                "event_date": event_date.isoformat(),
+                "event_time": event_time.strftime("%H:%M:%S"),
+                "grams": grams,
+                "anomaly_id": anomaly if anomaly is not None else ""
+            })
+
+    # Build DataFrames
+    subjects_df = pd.DataFrame(subjects_rows)
+    events_df = pd.DataFrame(events_rows)
+
+    # --- Make grams a monotonic bottle reading (+pillCount/adherence/anomalyId) ---
+
+    # Join subject info needed for simulation
+    ev = events_df.merge(
+        subjects_df[["subject_id", "pill_count", "pills_per_dose", "grams_per_pill"]],
+        on="subject_id", how="left"
+    )
+
+    # Build a timestamp and sort
+    ev["ts"] = pd.to_datetime(ev["event_date"] + " " + ev["event_time"])
+    ev = ev.sort_values(["subject_id", "ts"]).reset_index(drop=True)
+    return subjects_df, ev
+
+
+def legacy_generate(num_subjects=NUM_SUBJECTS, seed=42, today=None):
+    # woz.generate before vectorizing
+    subjects_df, ev = legacy_events(num_subjects, seed, today)
+    pill_counts, bottle_grams, anom_ids, adherences = legacy_bottles(ev)
+
+    # Write back to a schema your app expects
+    ev["pillCount"] = pill_counts
+    ev["grams"] = bottle_grams
+    ev["anomalyId"] = anom_ids
+    ev["adherenceScore"] = adherences
+
+    # Finalize columns / names
+    events_df_fixed = (
+        ev[["subject_id", "event_date", "event_time", "grams", "anomalyId", "adherenceScore", "pillCount"]]
+        .rename(columns={"subject_id":"subjectId", "event_date":"date", "event_time":"time"})
+    )
+
+    # From here on, use the fixed events
+    events_df = events_df_fixed.copy()
+
+    # Update num_anomalies per subject from fixed events (anomalyId != 0)
+    anomaly_counts = (
+        events_df.loc[events_df["anomalyId"] != 0]
+                 .groupby("subjectId").size()
+    )
+    subjects_df["num_anomalies"] = (
+        subjects_df["subject_id"].map(anomaly_counts).fillna(0).astype(int)
+    )
+
+    return subjects_df, events_df
+
+
+# --- Checks ---
+
+def run_new_bottles(ev, noise):
+    # woz.simulate_bottles on the legacy pass's input (ev sorted by subject, ts)
+    subjects = ev.drop_duplicates("subject_id")
+    counts = ev.groupby("subject_id", sort=False).size().to_numpy()
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    dose = np.array([anomaly_props(a, float(p))[2] for a, p in zip(ev["anomaly_id"], ev["pills_per_dose"])])
+    return woz.simulate_bottles(starts, counts, subjects["pill_count"].to_numpy(float),
+                                subjects["grams_per_pill"].to_numpy(float), dose, noise)
+
+
+def check_bottles(ev, noise, label):
+    # True if both bottle passes agree
+    pill_counts, bottle_grams, _, _ = legacy_bottles(ev, noise)
+    pills_left, grams_read = run_new_bottles(ev, noise)
+    if not np.array_equal(np.round(pills_left).astype(int), pill_counts):
+        print(f"FAIL bottle pass: {label}: pill counts differ")
+        return False
+    diff = np.abs(np.round(grams_read, 3) - np.array(bottle_grams))
+    if diff.max(initial=0) >= 1.5e-3:  # round() vs np.round on exact halves
+        print(f"FAIL bottle pass: {label}: grams differ by up to {diff.max():.4f}")
+        return False
+    print(f"bottle pass identical: {label} ({len(ev)} events)")
+    return True
+
+
+def random_bottles(rng, n_subjects):
+    # Tiny capacities, big doses and lots of missed doses: refills everywhere,
+    # including doses larger than the whole bottle
+    rows = []
+    for sid in range(n_subjects):
+        cap, gpp, ppd = int(rng.integers(1, 8)), float(rng.uniform(0.25, 1.0)), int(rng.integers(1, 4))
+        for _ in range(int(rng.integers(0, 40))):
+            label = rng.choice(["", "", "missed", "partial", "extra"])
+            rows.append((sid, cap, ppd, gpp, label))
+    return pd.DataFrame(rows, columns=["subject_id", "pill_count", "pills_per_dose", "grams_per_pill", "anomaly_id"])
+
+
+def summary_samples(subjects_df, events_df):
+    # name -> sample (roughly independent values) whose mean is compared between implementations
+    minutes = events_df["time"].str.slice(0, 2).astype(int) * 60 + events_df["time"].str.slice(3, 5).astype(int)
+    days = (pd.to_datetime(events_df["date"]) - pd.Timestamp(TODAY)).dt.days
+    samples = {col: subjects_df[col].to_numpy(float) for col in
+               ["age", "height", "weight", "pill_count", "doses_per_day", "pills_per_dose", "grams_per_pill",
+                "num_anomalies"]}
+    samples["male"] = (subjects_df["sex"] == "M").to_numpy(float)
+    samples["events per subject"] = events_df.groupby("subjectId").size().to_numpy(float)
+    for anomaly_id in (1, 2, 3):
+        samples[f"anomalyId == {anomaly_id}"] = (events_df["anomalyId"] == anomaly_id).to_numpy(float)
+    samples["adherenceScore"] = events_df["adherenceScore"].to_numpy(float)
+    # These depend mostly on the subject (bottle size, schedule), so compare
+    # per-subject means; per-event samples would understate the error
+    per_subject = events_df.assign(minute=minutes).groupby("subjectId")
+    samples["mean pillCount"] = per_subject["pillCount"].mean().to_numpy(float)
+    samples["mean grams"] = per_subject["grams"].mean().to_numpy(float)
+    samples["mean minute of day"] = per_subject["minute"].mean().to_numpy(float)
+    samples["day offset"] = days.to_numpy(float)
+    samples[":30 seconds"] = events_df["time"].str.endswith(":30").to_numpy(float)
+    return samples
+
+
+def check_statistics(num_subjects, seeds):
+    # True if every statistic is within 4 standard errors
+    old, new = {}, {}
+    for seed in seeds:
+        for target, gen in ((old, legacy_generate), (new, woz.generate)):
+            for name, sample in summary_samples(*gen(num_subjects, seed=seed, today=TODAY)).items():
+                target.setdefault(name, []).append(sample)
+
+    print(f"{'statistic':<22} {'old':>10} {'new':>10} {'z':>6}")
+    worst = 0.0
+    for name in old:
+        a, b = np.concatenate(old[name]), np.concatenate(new[name])
+        se = np.sqrt(a.var() / len(a) + b.var() / len(b))
+        z = abs(a.mean() - b.mean()) / se if se else 0.0
+        worst = max(worst, z)
+        print(f"{name:<22} {a.mean():10.4f} {b.mean():10.4f} {z:6.2f}")
+    if worst >= 4:
+        print(f"FAIL statistics diverge (max z = {worst:.2f})")
+        return False
+    return True
+
+
+def run_checks(num_subjects, seeds):
+    # True if every check passed (all of them run either way)
+    ok = True
+    rng = np.random.default_rng(0)
+    for seed in range(3):
+        # Same events + same noise through both bottle passes
+        _, ev = legacy_events(num_subjects, seed, TODAY)
+        ok &= check_bottles(ev, rng.normal(1.0, 0.003, len(ev)), f"woz events, seed {seed}")
+        ev = random_bottles(rng, 200)
+        ok &= check_bottles(ev, rng.normal(1.0, 0.003, len(ev)), f"random tiny bottles, seed {seed}")
+    ok &= check_statistics(num_subjects, range(seeds))
+    return ok
+
+
+def timed(label, fn):
+    start = time.perf_counter()
+    subjects_df, events_df = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34} {elapsed:8.2f}s  {len(events_df):>12,} events  {len(events_df) / elapsed:>12,.0f} events/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and benchmark the vectorized woz generator")
+    parser.add_argument("--subjects", type=int, default=NUM_SUBJECTS, help="subjects for the timing run")
+    parser.add_argument("--days", type=int, default=woz.DAYS)
+    parser.add_argument("--check-subjects", type=int, default=100)
+    parser.add_argument("--seeds", type=int, default=5, help="seeds pooled for the statistics check")
+    parser.add_argument("--check", action="store_true", help="run the checks only; exit status 1 if any fails")
+    parser.add_argument("--skip-check", action="store_true")
+    parser.add_argument("--skip-legacy", action="store_true", help="don't time the old implementation")
+    args = parser.parse_args()
+
+    if args.check and args.skip_check:
+        parser.error("--check and --skip-check can't be combined")
+
+    ok = True
+    if not args.skip_check:
+        ok = run_checks(args.check_subjects, args.seeds)
+    if not args.check:
+        if not args.skip_legacy:
+            timed(f"old, {args.subjects:,} subjects", lambda: legacy_generate(args.subjects, today=TODAY))
+        timed(f"new, {args.subjects:,} subjects x {args.days} days", lambda: woz.generate(args.subjects, today=TODAY, days=args.days))
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
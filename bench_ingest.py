@@ -0,0 +1,67 @@
+# Offline benchmark of the ingest pipeline (insert_to_supabase -> journal -> SQLite).
+#
+#   python bench_ingest.py --subjects 100 --events 20000
+#
+# Runs entirely against a local SQLiteStorage, so no Supabase project is needed.
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+import storage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingest pipeline offline")
+    parser.add_argument("--subjects", type=int, default=100)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--db", default=":memory:", help="SQLite file for the events/subjects tables")
+    args = parser.parse_args()
+
+    # Journal goes in a scratch dir so runs don't replay into each other
+    workdir = tempfile.mkdtemp(prefix="dose-bench-")
+    db_path = args.db if args.db == ":memory:" else os.path.abspath(args.db)
+    os.chdir(workdir)
+
+    db = storage.SQLiteStorage(db_path)
+    for sid in range(1, args.subjects + 1):
+        db.add_subject({
+            "subjectId": sid,
+            "pillWeight": 0.5,
+            "prescription": {"pillsPerDose": 2, "pillCount": 90},
+            "dosingWindows": {"morning": "08:00", "evening": "20:00"},
+            "currAdherenceScore": 100,
+        })
+    storage.set_storage(db)
+
+    import ingest
+
+    bottles = [ingest.BottleState(("bench", i)) for i in range(args.subjects)]
+    for b in bottles:
+        b.previous_weight = 45.0
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(args.events):
+            b = random.choice(bottles)
+            ingest.insert_to_supabase(max(0.0, b.previous_weight - 1.0), b)
+    queued = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        ingest.writer.flush()
+    flushed = time.perf_counter() - start
+
+    print(f"{args.events} events in {queued:.2f}s ({args.events / queued:,.0f} events/s queued)")
+    print(f"final flush: {flushed:.2f}s")
+    print("subject cache:", ingest.subject_cache.stats())
+    print("adherence:", ingest.adherence.stats())
+    print("journal:", ingest.writer.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# Benchmark of the server-side stability detector (stability.py) on
+# synthetic raw streams from waveforms.py.
+#
+#   python bench_stability.py --bottles 20 --hours 4 --batch 50
+#
+# Accuracy: every ground-truth interaction should produce a detection within
+# TOLERANCE grams of its true final weight, before the next interaction
+# starts; detections matching no interaction are false positives. The
+# firmware rule (5-sample stddev < 0.1 g, no hysteresis) runs through the
+# same detector for comparison.
+#
+# Throughput: all bottles are fed round-robin in --batch sized chunks, the
+# way the server sees them, with and without parsing the raw: lines.
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import waveforms
+from stability import RAW_PREFIX, SAMPLE_HZ, StabilityDetector, parse_samples
+
+TOLERANCE = 0.3  # grams; drift alone moves a bottle ~0.1-0.2 g over hours
+
+FIRMWARE = dict(window=5, enter_sd=0.1, exit_sd=0.1, settle=1, min_change=0.0, off_scale=float("-inf"))
+
+
+def make_streams(num_bottles, hours, seed):
+    # Streams start at 06:00 so the window covers dosing hours
+    start = datetime.combine(datetime.now().date() - timedelta(days=1), datetime.min.time()) + timedelta(hours=6)
+    events, full, grams_per_pill = waveforms.bottle_events(num_bottles, seed, start, hours)
+    n_samples = int(hours * 3600 * SAMPLE_HZ)
+    streams, labels = [], []
+    for b in range(num_bottles):
+        signal, rows = waveforms.synthesize_bottle(b, *events[b], full[b], grams_per_pill[b], n_samples, seed)
+        streams.append(signal)
+        labels.extend(rows)
+    return streams, np.array(labels, dtype=waveforms.EVENT_DTYPE)
+
+
+def detect(stream, batch, settings):
+    detector = StabilityDetector(**settings)
+    found = []
+    for i in range(0, len(stream), batch):
+        found += detector.feed(stream[i:i + batch])
+    return found
+
+
+def score(streams, labels, batch, settings):
+    hits = false_pos = 0
+    latencies = []
+    for b, stream in enumerate(streams):
+        found = detect(stream, batch, settings)
+        truth = labels[labels["bottle"] == b]
+        ends = np.append(truth["start"][1:], len(stream))
+        matched = set()
+        for row, end in zip(truth, ends):
+            window = [(i, w) for i, w in found if row["start"] <= i < end]
+            matched.update(i for i, _ in window)
+            good = [i for i, w in window if abs(w - row["after"]) <= TOLERANCE]
+            if good:
+                hits += 1
+                latencies.append((good[0] - row["settled"]) * 1000 / SAMPLE_HZ)
+        false_pos += sum(1 for i, _ in found if i not in matched)
+    return hits, false_pos, np.median(latencies) if latencies else float("nan")
+
+
+def throughput(streams, batch, settings, with_parse):
+    detectors = [StabilityDetector(**settings) for _ in streams]
+    n = len(streams[0])
+    chunks = range(0, n, batch)
+    if with_parse:
+        lines = [[RAW_PREFIX + ",".join(f"{v:.3f}" for v in s[i:i + batch]).encode() for i in chunks]
+                 for s in streams]
+    start = time.perf_counter()
+    for c, i in enumerate(chunks):
+        for b, detector in enumerate(detectors):
+            detector.feed(parse_samples(lines[b][c]) if with_parse else streams[b][i:i + batch])
+    return len(streams) * n / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the raw-stream stability detector")
+    parser.add_argument("--bottles", type=int, default=20)
+    parser.add_argument("--hours", type=float, default=4)
+    parser.add_argument("--batch", type=int, default=50, help="samples per raw: line")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--minutes", type=float, default=10, help="stream length for the throughput runs")
+    args = parser.parse_args()
+
+    streams, labels = make_streams(args.bottles, args.hours, args.seed)
+    total = sum(len(s) for s in streams)
+    print(f"{args.bottles} bottles x {args.hours:g} h = {total:,} samples, {len(labels)} interactions")
+
+    print(f"{'detector':<10} {'found':>7} {'missed':>7} {'false +':>8} {'median latency':>15}")
+    for name, settings in (("server", {}), ("firmware", FIRMWARE)):
+        hits, false_pos, latency = score(streams, labels, args.batch, settings)
+        print(f"{name:<10} {hits:>7} {len(labels) - hits:>7} {false_pos:>8} {latency:>12.0f} ms")
+
+    short = [s[:int(args.minutes * 60 * SAMPLE_HZ)] for s in streams]
+    for label, with_parse in (("detect only", False), ("parse + detect", True)):
+        rate = throughput(short, args.batch, {}, with_parse)
+        print(f"{label + ':':<16}{rate:>12,.0f} samples/s = {rate / SAMPLE_HZ:>8,.0f} bottles at {SAMPLE_HZ} Hz "
+              f"(batch {args.batch})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,10 @@
 'use client'
 
-import React, { useEffect, useMemo, useState } from 'react'
+import React, { useEffect, useState } from 'react'
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card'
 import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer } from 'recharts'
 import { supabase } from './SupabaseClient'
 
-type SubjectRow = {
-  subjectId: number | string
-  firstName: string | null
-  lastName: string | null
-  currAdherenceScore: number | null // 0..1 in DB
-}
-
 type SubjectForChart = {
   subjectId: string
   firstName: string
@@ -19,29 +12,49 @@ type SubjectForChart = {
   adherence: number // 0..100
 }
 
-// 20% buckets
-const createHistogramData = (subjects: SubjectForChart[]) => {
-  const buckets = [
-    { range: '0-20%',   min: 0,  max: 20,  count: 0, subjects: [] as SubjectForChart[] },
-    { range: '21-40%',  min: 21, max: 40,  count: 0, subjects: [] as SubjectForChart[] },
-    { range: '41-60%',  min: 41, max: 60,  count: 0, subjects: [] as SubjectForChart[] },
-    { range: '61-80%',  min: 61, max: 80,  count: 0, subjects: [] as SubjectForChart[] },
-    { range: '81-100%', min: 81, max: 100, count: 0, subjects: [] as SubjectForChart[] },
-  ]
-
-  for (const s of subjects) {
-    const b = buckets.find(b => s.adherence >= b.min && s.adherence <= b.max)
-    if (b) { b.count++; b.subjects.push(s) }
-  }
+// Rows kept up to date by rollups.py (one per histogram range, one for the cohort)
+type HistogramBucket = {
+  range: string
+  count: number
+  percentage: number
+  subjects: SubjectForChart[] // lowest adherence first, capped
+}
 
-  return buckets.map(b => ({
-    range: b.range,
-    count: b.count,
-    percentage: subjects.length ? Math.round((b.count / subjects.length) * 100) : 0,
-    subjects: b.subjects,
-  }))
+type CohortSummary = {
+  total: number
+  average: number
+  high: number      // >= 80%
+  low: number       // < 60%
+  excellent: number // >= 90%
 }
 
+type RollupRow = {
+  key: string
+  kind: 'histogram' | 'cohort'
+  period: string
+  data: any
+}
+
+// 20% buckets
+const RANGES = ['0-20%', '21-40%', '41-60%', '61-80%', '81-100%']
+
+const emptyHistogram = (): HistogramBucket[] =>
+  RANGES.map(range => ({ range, count: 0, percentage: 0, subjects: [] }))
+
+const emptyCohort: CohortSummary = { total: 0, average: 0, high: 0, low: 0, excellent: 0 }
+
+const toBucket = (row: RollupRow): HistogramBucket => ({
+  range: row.period,
+  count: row.data.count ?? 0,
+  percentage: row.data.percentage ?? 0,
+  subjects: (row.data.subjects ?? []).map((s: any) => ({
+    subjectId: String(s.subjectId),
+    firstName: s.firstName ?? '',
+    lastName: s.lastName ?? '',
+    adherence: s.adherence ?? 0,
+  })),
+})
+
 // Custom tooltip
 const CustomTooltip = ({ active, payload, label }: any) => {
   if (active && payload?.length) {
@@ -67,59 +80,57 @@ const CustomTooltip = ({ active, payload, label }: any) => {
 
 
 export default function AggregateView() {
-  const [subjects, setSubjects] = useState<SubjectForChart[]>([])
+  const [histogramData, setHistogramData] = useState<HistogramBucket[]>(emptyHistogram)
+  const [cohort, setCohort] = useState<CohortSummary>(emptyCohort)
   const [loading, setLoading] = useState(true)
 
-  // Fetch subjects
+  // Precomputed aggregates (rollups.py); only changed rows are pushed
   useEffect(() => {
     let mounted = true
 
-    const fetchSubjects = async () => {
+    const applyRow = (row: RollupRow) => {
+      if (row.kind === 'cohort') {
+        setCohort({ ...emptyCohort, ...row.data })
+      } else if (row.kind === 'histogram') {
+        const bucket = toBucket(row)
+        setHistogramData(prev => prev.map(b => (b.range === bucket.range ? bucket : b)))
+      }
+    }
+
+    const fetchRollups = async () => {
       setLoading(true)
       const { data, error } = await supabase
-        .from('subjects')
-        .select('subjectId, firstName, lastName, currAdherenceScore')
+        .from('rollups')
+        .select('key, kind, period, data')
+        .in('kind', ['histogram', 'cohort'])
 
       if (error) {
-        console.error('subjects fetch error:', error)
-        if (mounted) { setSubjects([]); setLoading(false) }
+        console.error('rollups fetch error:', error)
+        if (mounted) setLoading(false)
         return
       }
 
-      const mapped: SubjectForChart[] = (data as SubjectRow[]).map(r => ({
-        subjectId: String(r.subjectId),
-        firstName: r.firstName ?? '',
-        lastName:  r.lastName ?? '',
-        adherence: Math.max(0, Math.min(100, Math.round((r.currAdherenceScore ?? 0) * 100))),
-      }))
-
-      if (mounted) { setSubjects(mapped); setLoading(false) }
+      if (mounted) { (data as RollupRow[]).forEach(applyRow); setLoading(false) }
     }
 
-    fetchSubjects()
+    fetchRollups()
 
-    // Live updates (optional but nice)
-    const ch = supabase.channel('subjects-aggregate')
-      .on('postgres_changes', { event: '*', schema: 'public', table: 'subjects' }, fetchSubjects)
+    // Live updates: the changed rows themselves, no refetch
+    const onChange = (payload: any) => { if (mounted && payload.new) applyRow(payload.new as RollupRow) }
+    const ch = supabase.channel('rollups-aggregate')
+      .on('postgres_changes', { event: '*', schema: 'public', table: 'rollups', filter: 'kind=eq.histogram' }, onChange)
+      .on('postgres_changes', { event: '*', schema: 'public', table: 'rollups', filter: 'kind=eq.cohort' }, onChange)
       .subscribe()
 
     return () => { mounted = false; supabase.removeChannel(ch) }
   }, [])
 
   // Derived data
-  const histogramData = useMemo(() => createHistogramData(subjects), [subjects])
-  const totalSubjects = subjects.length
-  const averageAdherence = useMemo(
-    () => (totalSubjects ? Math.round(subjects.reduce((s, x) => s + x.adherence, 0) / totalSubjects) : 0),
-    [subjects, totalSubjects]
-  )
-  const highAdherence = useMemo(() => subjects.filter(s => s.adherence >= 80).length, [subjects])
-  const lowAdherence  = useMemo(() => subjects.filter(s => s.adherence < 60).length, [subjects])
-
-  const excellentAdherence = useMemo(
-    () => subjects.filter(s => s.adherence >= 90).length,
-    [subjects]
-  )
+  const totalSubjects = cohort.total
+  const averageAdherence = cohort.average
+  const highAdherence = cohort.high
+  const lowAdherence  = cohort.low
+  const excellentAdherence = cohort.excellent
 
   return (
     <div className="min-h-screen bg-gray-900 p-6">
@@ -18,6 +18,7 @@ interface SubjectData {
   race: string
   weight: string
   height: string
+  bottleId: string // must match the bottle firmware's bottleId (sent as "id:<bottleId>")
   prescription: {
     dosesPerDay: number
     pillsPerDose: number
@@ -41,6 +42,7 @@ export default function NewSubjectForm({ isOpen, onClose, onSubmit }: NewSubject
     race: '',
     weight: '',
     height: '',
+    bottleId: '',
     prescription: {
       dosesPerDay: 1,
       pillsPerDose: 1,
@@ -161,6 +163,7 @@ export default function NewSubjectForm({ isOpen, onClose, onSubmit }: NewSubject
     race: '',
     weight: '',
     height: '',
+    bottleId: '',
     prescription: {
       dosesPerDay: 1,
       pillsPerDose: 1,
@@ -275,6 +278,16 @@ export default function NewSubjectForm({ isOpen, onClose, onSubmit }: NewSubject
                   />
                   {errors.height && <p className="text-red-500 text-xs mt-1">{errors.height}</p>}
                 </div>
+                <div>
+                  <label className="block text-sm font-medium mb-1">Bottle ID</label>
+                  <input
+                    type="text"
+                    value={formData.bottleId}
+                    onChange={(e) => handleInputChange('bottleId', e.target.value)}
+                    className="w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500"
+                    placeholder="e.g., BOTTLE123"
+                  />
+                </div>
               </div>
             </div>
 
@@ -12,6 +12,11 @@ import type { Subject } from './SubjectDropdown'
 import AggregateView from './AggregateView'
 import { supabase } from './SupabaseClient'
 
+// backend.py --push-port origin, e.g. http://localhost:5006 (unset = Supabase realtime),
+// and its --push-token if it has one
+const PUSH_URL = process.env.NEXT_PUBLIC_PUSH_URL
+const PUSH_TOKEN = process.env.NEXT_PUBLIC_PUSH_TOKEN
+
 
 
 // Dummy data
@@ -303,21 +308,23 @@ export default function SubjectView() {
       };
     };
 
-    const channel = supabase
+    const upsertEvent = (row: any) => {
+      const normalized = normalize(row); // your normalize that does NOT set doseSize
+      setEvents(prev => {
+        const k = getKey(normalized);
+        if (!k) return prev;
+        const i = prev.findIndex(e => getKey(e) === k);
+        const next = i >= 0 ? prev.map((e, idx) => (idx === i ? normalized : e))
+                            : [normalized, ...prev];
+        return recomputeDoseSizes(next);
+      });
+    };
+
+    // Backfill re-scores (UPDATE) always come from Supabase; new events come
+    // straight from the ingest backend when it is configured (backend.py
+    // --push-port), otherwise from Supabase INSERTs
+    let channel = supabase
       .channel(`events:subject:${sidNum}`)
-      .on('postgres_changes', { event: 'INSERT', schema: 'public', table: 'events', filter: `subjectId=eq.${sidNum}` },
-        ({ new: row }) => {
-          const normalized = normalize(row); // your normalize that does NOT set doseSize
-          setEvents(prev => {
-            const k = getKey(normalized);
-            if (!k) return prev;
-            const i = prev.findIndex(e => getKey(e) === k);
-            const next = i >= 0 ? prev.map((e, idx) => (idx === i ? normalized : e))
-                                : [normalized, ...prev];
-            return recomputeDoseSizes(next);
-          });
-        }
-      )
       .on('postgres_changes', { event: 'UPDATE', schema: 'public', table: 'events', filter: `subjectId=eq.${sidNum}` },
         ({ new: row }) => {
           const normalized = normalize(row);
@@ -329,9 +336,21 @@ export default function SubjectView() {
           });
         }
       )
-      .subscribe();
+    let source: EventSource | null = null;
+    if (PUSH_URL) {
+      const token = PUSH_TOKEN ? `&token=${encodeURIComponent(PUSH_TOKEN)}` : '';
+      source = new EventSource(`${PUSH_URL}/events?subject=${sidNum}${token}`);
+      source.addEventListener('dose', (e) => upsertEvent(JSON.parse((e as MessageEvent).data).event));
+      // Backend restarted since our last event: reload rather than trust the gap
+      source.addEventListener('reset', () => fetchEvents(sidNum));
+    } else {
+      channel = channel.on('postgres_changes', { event: 'INSERT', schema: 'public', table: 'events', filter: `subjectId=eq.${sidNum}` },
+        ({ new: row }) => upsertEvent(row)
+      )
+    }
+    channel.subscribe();
 
-    return () => { supabase.removeChannel(channel); };
+    return () => { source?.close(); supabase.removeChannel(channel); };
   }, [selectedSubject?.subjectId]);
 
 
@@ -354,9 +373,10 @@ export default function SubjectView() {
       race: newSubjectData.race,
       weight: newSubjectData.weight,       // number or string, match DB
       height: newSubjectData.height,       // number or string, match DB
+      bottleId: newSubjectData.bottleId?.trim() || null, // routes this bottle's readings here
       prescription: newSubjectData.prescription,        // or JSON.stringify(...)
       dosingWindows: newSubjectData.dosingWindows,      // or JSON.stringify(...)
-      currAdherenceScore: newSubjectData.currAdherenceScore ?? 1.0,
+      currAdherenceScore: newSubjectData.currAdherenceScore ?? 100, // percent, like ingest.py writes
       pillWeight: newSubjectData.pillWeight ?? 0.0
     }
 
@@ -715,7 +735,7 @@ export default function SubjectView() {
                 
                 {/* Circular Adherence Gauge - No Card Wrapper */}
               <div className="flex items-left  ">
-                <CircularGauge percentage={selectedSubject.currAdherenceScore * 100} />
+                <CircularGauge percentage={Math.max(0, Math.min(100, Number(selectedSubject.currAdherenceScore) || 0))} />
               </div>
                 
               
@@ -0,0 +1,80 @@
+# Per-bottle debounce/coalesce stage between parsing and insert_to_supabase.
+#
+# The firmware sends a weight every time the scale settles, so putting the
+# bottle down, picking it up again and setting it back down is several
+# readings for one dose, each a DB round trip and, with the previous weight
+# moving underneath it, possibly a bogus "wrong count" anomaly. Instead a
+# reading is held until the bottle has been quiet for QUIET_SECONDS:
+#
+#   - readings within TOLERANCE_GRAMS of the held one are merged into it
+#     (running mean), anything else replaces it (the bottle moved again);
+#   - once quiet, the held weight is forwarded if it differs from the last
+#     forwarded weight by more than TOLERANCE_GRAMS, otherwise it is dropped
+#     (picked up and put back without taking anything).
+#
+# Only the net change reaches the database, as one event.
+
+QUIET_SECONDS = 2.0
+TOLERANCE_GRAMS = 0.1
+
+
+class Debouncer:
+    def __init__(self, quiet=QUIET_SECONDS, tolerance=TOLERANCE_GRAMS):
+        self.quiet = quiet
+        self.tolerance = tolerance
+        self.held = None  # weight waiting for the bottle to go quiet
+        self.held_count = 0  # readings merged into it
+        self.last_at = 0.0
+        self.forwarded_weight = None
+
+        self.received = 0
+        self.forwarded = 0
+        self.merged = 0  # within tolerance of the held reading
+        self.superseded = 0  # replaced by a different reading before going quiet
+        self.unchanged = 0  # went quiet at the last forwarded weight
+
+    def add(self, grams, now):
+        # Hold a reading; returns how many held readings it absorbed (0 or 1)
+        self.received += 1
+        self.last_at = now
+        if self.held is None:
+            self.held, self.held_count = grams, 1
+            return 0
+        if abs(grams - self.held) <= self.tolerance:
+            self.held_count += 1
+            self.held += (grams - self.held) / self.held_count
+            self.merged += 1
+        else:
+            self.held, self.held_count = grams, 1
+            self.superseded += 1
+        return 1
+
+    def due_in(self, now):
+        # Seconds until the held reading goes quiet (None if nothing is held)
+        if self.held is None:
+            return None
+        return max(0.0, self.last_at + self.quiet - now)
+
+    def flush(self):
+        # Release the held reading (once due_in() hits 0, or when the bottle
+        # disconnects): the weight to forward, or None if nothing changed
+        if self.held is None:
+            return None
+        grams, self.held, self.held_count = self.held, None, 0
+        if self.forwarded_weight is not None and abs(grams - self.forwarded_weight) <= self.tolerance:
+            self.unchanged += 1
+            return None
+        self.forwarded_weight = grams
+        self.forwarded += 1
+        return grams
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "forwarded": self.forwarded,
+            "suppressed": self.merged + self.superseded + self.unchanged,
+            "merged": self.merged,
+            "superseded": self.superseded,
+            "unchanged": self.unchanged,
+            "holding": self.held is not None,
+        }
@@ -0,0 +1,60 @@
+from bisect import bisect_left
+
+WINDOW_MARGIN = 30  # minutes either side of a scheduled dose
+MINUTES_PER_DAY = 24 * 60
+
+
+def to_minutes(hhmm):
+    # "08:30" -> 510
+    hh, mm = hhmm.split(":")
+    hh, mm = int(hh), int(mm)
+    if not (0 <= hh < 24 and 0 <= mm < 60):
+        raise ValueError(f"Bad dosing window time: {hhmm!r}")
+    return hh * 60 + mm
+
+
+class DosingWindowIndex:
+    # A subject's dosingWindows ({"morning": "08:00", ...}) compiled once into
+    # a sorted list of minute-of-day values, so classifying an event is a
+    # bisect plus a couple of comparisons instead of parsing every window.
+    def __init__(self, dosing_windows, margin=WINDOW_MARGIN):
+        first_seen = {}
+        for order, t in enumerate((dosing_windows or {}).values()):
+            first_seen.setdefault(to_minutes(t), order)
+        self.minutes = sorted(first_seen)
+        self.order = [first_seen[m] for m in self.minutes]  # position in the JSON, breaks nearest-window ties
+        self.margin = margin
+
+    def __bool__(self):
+        return bool(self.minutes)
+
+    def in_window(self, minute):
+        # Within `margin` of any scheduled time; a window near midnight covers
+        # the other side of it (23:50 +30 min reaches 00:20)
+        minutes = self.minutes
+        i = bisect_left(minutes, minute)
+        if i < len(minutes) and minutes[i] - minute <= self.margin:
+            return True
+        if i > 0 and minute - minutes[i - 1] <= self.margin:
+            return True
+        return (minutes[0] + MINUTES_PER_DAY - minute <= self.margin
+                or minute - (minutes[-1] - MINUTES_PER_DAY) <= self.margin)
+
+    def classify(self, minute):
+        # "0" in a window, "1" too early, "2" too late
+        if not self.minutes or self.in_window(minute):
+            return "0"
+
+        # The nearer of the previous and next scheduled times decides early vs
+        # late, looking across midnight: before the first window of the day
+        # the previous one is yesterday's last, after the last window the
+        # next one is tomorrow's first. On an exact tie the window listed
+        # first in dosingWindows wins (late for a single window, as before).
+        minutes = self.minutes
+        i = bisect_left(minutes, minute)
+        prev, nxt = (i - 1) % len(minutes), i % len(minutes)
+        before = (minute - minutes[prev]) % MINUTES_PER_DAY
+        after = (minutes[nxt] - minute) % MINUTES_PER_DAY
+        if before < after or (before == after and self.order[prev] <= self.order[nxt]):
+            return "2"
+        return "1"
@@ -0,0 +1,95 @@
+# Newline framing for the bottle protocol, done on bytes.
+#
+# Data is received straight into a fixed bytearray (recv_into on a memoryview),
+# complete lines are located with rfind(b"\n") offsets and copied out once, so
+# a burst of many lines costs O(bytes) instead of re-copying the rest of the
+# buffer for every line. Nothing is decoded until a line is complete, so a
+# multibyte character split across two recv calls can't break anything.
+
+MAX_LINE_BYTES = 4096  # firmware lines are a few bytes ("Alive", "12.345")
+ID_PREFIX = b"id:"  # handshake, sent once after connecting: "id:BOTTLE123"
+BUFFER_BYTES = 64 * 1024
+
+
+class LineFramer:
+    def __init__(self, max_line=MAX_LINE_BYTES, size=BUFFER_BYTES):
+        assert size > max_line
+        self.max_line = max_line
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0  # first unread byte
+        self.end = 0  # one past the last received byte
+        self.discarding = False  # inside an over-long line, skip to the next newline
+        self.overflows = 0
+
+    def _make_room(self):
+        # Slide the unread tail to the front once the free space runs low
+        if len(self.buf) - self.end < self.max_line and self.start:
+            pending = self.end - self.start
+            self.buf[:pending] = self.view[self.start:self.end]
+            self.start, self.end = 0, pending
+
+    def recv_from(self, sock):
+        # One recv_into; returns bytes read (0 = peer closed)
+        self._make_room()
+        n = sock.recv_into(self.view[self.end:])
+        self.end += n
+        return n
+
+    def feed(self, data):
+        # Same as recv_from for bytes that came from somewhere else
+        data = memoryview(data)
+        lines = []
+        while len(data):
+            self._make_room()
+            n = min(len(data), len(self.buf) - self.end)
+            self.buf[self.end:self.end + n] = data[:n]
+            self.end += n
+            data = data[n:]
+            lines += self.lines()
+        return lines
+
+    def lines(self):
+        # Complete lines received so far (bytes, whitespace stripped, empty
+        # lines skipped). Everything up to the last newline is copied out once
+        # and split in C, so there is no per-line Python scanning.
+        last = self.buf.rfind(b"\n", self.start, self.end)
+        if last < 0:
+            if self.end - self.start > self.max_line:
+                # No newline within max_line bytes: drop what we have and skip
+                # the rest of that line when its newline finally shows up
+                if not self.discarding:
+                    self.overflows += 1
+                self.discarding = True
+                self.start = self.end = 0
+            return []
+
+        parts = bytes(self.view[self.start:last]).split(b"\n")
+        self.start = last + 1
+        if self.start == self.end:
+            self.start = self.end = 0
+        if self.discarding:
+            parts = parts[1:]  # tail of the over-long line
+            self.discarding = False
+
+        max_line = self.max_line
+        lines = [p.strip() for p in parts if len(p) <= max_line]
+        self.overflows += len(parts) - len(lines)
+        return [line for line in lines if line]
+
+
+def parse_grams(line):
+    # A weight reading straight from bytes (float() accepts them); None for
+    # "Alive" pings or anything else that isn't a number
+    try:
+        return float(line)
+    except ValueError:
+        return None
+
+
+def parse_bottle_id(line):
+    # Bottle ID from an "id:<bottleId>" handshake line; None for anything else
+    if not line.startswith(ID_PREFIX):
+        return None
+    bottle_id = line[len(ID_PREFIX):].strip().decode(errors="replace")
+    return bottle_id or None
@@ -0,0 +1,228 @@
+# Shared event pipeline used by backend.py (bottle TCP server) and simulateData.py
+# (Wizard-of-Oz web form): turns a bottle reading into an `events` row.
+
+import atexit
+from datetime import datetime
+import log
+import metrics
+from adherence import AdherenceTracker
+from batch_classify import classify_batch
+from routing import BottleRoutes
+from storage import get_storage
+from subject_cache import SubjectCache
+from write_behind import WriteBehindQueue
+
+# Database setup (Supabase or local SQLite, see storage.py)
+storage = get_storage()
+
+
+class BottleState:
+    # Per-connection state. Each bottle tracks its own last weight so
+    # concurrent connections don't clobber each other's pill counts.
+    def __init__(self, addr=None, bottle_id=None):
+        self.addr = addr
+        self.bottle_id = bottle_id  # from the "id:" handshake; None for old firmware
+        self.previous_weight = 0.0
+        self.previous_subject_id = -1
+        self.lines = 0
+        self.readings = 0
+
+
+# Used by callers that don't track a connection (single-bottle mode)
+default_state = BottleState()
+
+# Event timestamps come from here unless the caller passes `now`
+clock = datetime.now
+
+
+# --- Subject cache ---
+
+subject_cache = SubjectCache(storage.get_subject, storage.latest_subject_id)
+
+
+# --- Bottle -> subject routing ---
+
+routes = BottleRoutes(storage.bottle_routes)
+routes.load()
+
+
+# --- Write-behind journal ---
+
+writer = WriteBehindQueue(storage.insert_events, storage.update_subject)
+atexit.register(writer.close)
+metrics.CallbackGauge("dose_journal_pending", "Events journaled but not yet in the database", writer.pending)
+if writer.pending():
+    print(f"Replaying {writer.pending()} journaled events from {writer.path}")
+    writer.start()
+
+
+# --- Daily adherence counters ---
+
+def load_day_anomalies(subject_id, event_date):
+    # Journaled events haven't reached the table yet but still count for today
+    return writer.day_anomalies(storage.day_anomalies, subject_id, event_date)
+
+
+adherence = AdherenceTracker(load_day_anomalies)
+
+
+def refresh_subjects(subject_id=None):
+    # Call after a subject row is edited outside this process (dashboard, SQL,
+    # backfill.py); today's adherence counters are re-read from `events` too
+    subject_cache.invalidate(subject_id)
+    adherence.forget(subject_id)
+    routes.load()  # a bottle may have been (re)assigned
+
+
+def resolve_subject(state):
+    # subjectId a reading from this connection belongs to, or None. Bottles
+    # that never sent the handshake (old firmware, the WOZ form) or whose id
+    # no subject has been given yet fall back to the latest subjectId, as
+    # before routing existed. May query (route reload on a miss, latest
+    # subject), so keep it off the event loop.
+    subject_id = None
+    if state.bottle_id is not None:
+        subject_id = routes.subject_for(state.bottle_id)
+        if subject_id is None:
+            metrics.ERRORS.inc("unassigned_bottle")
+            log.warning("unassigned_bottle", bottle=state.bottle_id, addr=state.addr)
+    if subject_id is None:
+        subject_id = subject_cache.latest_subject_id()
+    if subject_id is None:
+        metrics.ERRORS.inc("unrouted")
+        log.warning("unrouted", bottle=state.bottle_id, addr=state.addr)
+    return subject_id
+
+
+def insert_to_supabase(grams, state=None, now=None, subject_id=None):
+    # `now` and `subject_id` let callers replay readings at a chosen time for
+    # a chosen subject (scenarios.py); live callers leave both to the clock
+    # and the routing below
+    state = state or default_state
+
+    now = now or clock()
+    event_date = now.strftime("%m/%d/%y")
+    event_time = now.strftime("%I:%M %p")
+
+    # Route to the bottle's subject (resolve_subject)
+    if subject_id is None:
+        with metrics.stage("route"):
+            subject_id = resolve_subject(state)
+        if subject_id is None:
+            return
+
+    if subject_id != state.previous_subject_id:
+        log.info("subject", subject=subject_id, bottle=state.bottle_id, addr=state.addr)
+        state.previous_subject_id = subject_id
+
+    # Get subject details (prescription/windows come back already parsed)
+    with metrics.stage("subject"):
+        subject = subject_cache.get(subject_id)
+    if subject is None:
+        metrics.ERRORS.inc("unknown_subject")
+        log.warning("unknown_subject", subject=subject_id)
+        return
+
+    pill_count = subject.pill_count
+
+    # --- Anomaly detection ---
+    # Same vectorized rules used to score history, run as a batch of one:
+    # "3" wrong pill count, "1" too early, "2" too late (timing wins), else "0"
+    with metrics.stage("classify"):
+        scored = classify_batch([subject_id], [now], [grams], {subject_id: subject},
+                                previous_weight=state.previous_weight)
+    anomaly_id = str(int(scored["anomaly_id"][0]))
+    grams_per_pill = float(scored["grams_per_pill"][0])
+
+    # --- Adherence score ---
+    # Counters are warmed from `events` once per subject/day, then kept in memory
+    with metrics.stage("adherence"):
+        adherence_score = adherence.record(subject_id, event_date, anomaly_id)
+
+    # --- Save event ---
+    data = {
+        "subjectId": subject_id,
+        "date": event_date,
+        "time": event_time,
+        "grams": str(grams),
+        "anomalyId": anomaly_id,
+        "adherenceScore": adherence_score,
+        "pillCount": pill_count
+    }
+    subject_fields = {
+        "currAdherenceScore": float(adherence_score),
+        "pillWeight": grams_per_pill
+    }
+    # Journaled locally; the writer thread batches it into `events`/`subjects`
+    with metrics.stage("journal"):
+        writer.append(data, subject_fields)
+    subject_cache.update(subject_id, pill_weight=grams_per_pill, adherence_score=float(adherence_score))
+    metrics.EVENTS.inc()
+    metrics.ANOMALIES.inc(anomaly_id)
+    log.info("queued", subject=subject_id, grams=grams, anomaly=anomaly_id, score=adherence_score)
+
+    state.previous_weight = grams
+    return data
+
+
+def insert_batch(subject_ids, timestamps, grams, states):
+    # Bulk insert_to_supabase for readings whose subject and time are already
+    # known (the WOZ harness's POST /events:batch). The same rules score the
+    # whole batch in one classify_batch call; adherence counters are then
+    # advanced event by event in time order per subject, and everything is
+    # journaled in one transaction. `states` maps subjectId -> BottleState
+    # (missing ones are created), so each subject's previous weight carries
+    # over between batches. Returns one event dict per input, or None where
+    # the subject doesn't exist.
+    n = len(subject_ids)
+    results = [None] * n
+    with metrics.stage("subject"):
+        subjects = {sid: subject_cache.get(sid) for sid in set(subject_ids)}
+    known = [i for i in range(n) if subjects[subject_ids[i]] is not None]
+    for sid in [sid for sid, subject in subjects.items() if subject is None]:
+        metrics.ERRORS.inc("unknown_subject")
+        log.warning("unknown_subject", subject=sid)
+    if not known:
+        return results
+
+    ids = [subject_ids[i] for i in known]
+    times = [timestamps[i] for i in known]
+    weights = [grams[i] for i in known]
+    for sid in set(ids):
+        states.setdefault(sid, BottleState(("batch", sid)))
+    with metrics.stage("classify"):
+        scored = classify_batch(ids, times, weights, {sid: subjects[sid] for sid in set(ids)},
+                                previous_weight={sid: states[sid].previous_weight for sid in set(ids)})
+
+    # Subject/time order as classify_batch saw them (whole seconds, ties keep input order)
+    order = sorted(range(len(ids)), key=lambda j: (ids[j], times[j].replace(microsecond=0)))
+    entries = []
+    with metrics.stage("adherence"):
+        for j in order:
+            sid, ts = ids[j], times[j]
+            event_date = ts.strftime("%m/%d/%y")
+            anomaly_id = str(int(scored["anomaly_id"][j]))
+            grams_per_pill = float(scored["grams_per_pill"][j])
+            adherence_score = adherence.record(sid, event_date, anomaly_id)
+            data = {
+                "subjectId": sid,
+                "date": event_date,
+                "time": ts.strftime("%I:%M %p"),
+                "grams": str(weights[j]),
+                "anomalyId": anomaly_id,
+                "adherenceScore": adherence_score,
+                "pillCount": subjects[sid].pill_count
+            }
+            entries.append((data, {"currAdherenceScore": float(adherence_score), "pillWeight": grams_per_pill}))
+            results[known[j]] = data
+            states[sid].previous_weight = weights[j]
+            metrics.ANOMALIES.inc(anomaly_id)
+
+    with metrics.stage("journal"):
+        writer.append_many(entries)
+    for data, fields in entries:  # last one per subject wins
+        subject_cache.update(data["subjectId"], pill_weight=fields["pillWeight"],
+                             adherence_score=fields["currAdherenceScore"])
+    metrics.EVENTS.inc(amount=len(entries))
+    log.info("queued_batch", events=len(entries), subjects=len(set(ids)))
+    return results
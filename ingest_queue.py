@@ -0,0 +1,158 @@
+# Bounded queue between the asyncio connection handlers and the database
+# workers (backend.py --async).
+#
+# Handlers used to await each insert themselves, so a slow database showed
+# up as every socket going quiet, and nothing limited how much work could be
+# outstanding. Now a handler puts readings into its bottle's mailbox and goes
+# back to reading; a fixed pool of worker tasks drains the mailboxes. A
+# mailbox is on the ready queue at most once and its readings are handled
+# one at a time, so each bottle's readings are still stored in order.
+#
+# Once `depth` (queued, not yet started) reaches the high watermark the
+# queue is saturated until it drains to the low watermark. What a handler
+# does while it is saturated depends on the policy:
+#
+#   pause       put() waits, so the handler stops reading its socket and TCP
+#               flow control pushes back on the bottle
+#   drop-alive  "Alive" pings are discarded without being logged (presence
+#               is still noted), readings wait as with pause
+#   coalesce    a reading replaces its bottle's queued one (the newer weight
+#               carries the net change), waiting only if none is queued
+
+import asyncio
+import time
+from collections import deque
+import log
+
+HIGH_WATERMARK = 1000  # queued readings before the queue counts as saturated
+LOW_WATERMARK = 500  # ...until it drains back to this
+POLICIES = ("pause", "drop-alive", "coalesce")
+WAIT_SAMPLES = 10000  # recent queue waits kept for percentiles
+
+
+class Mailbox:
+    # One bottle's queued readings: [payload, readings merged into it, enqueued at]
+    def __init__(self, handler):
+        self.handler = handler  # async handler(payload, count)
+        self.items = deque()
+        self.scheduled = False  # on the ready queue or being worked on
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    async def drained(self):
+        # Wait until everything put into this mailbox has been handled
+        await self.idle.wait()
+
+
+class IngestQueue:
+    def __init__(self, high=HIGH_WATERMARK, low=LOW_WATERMARK, policy="pause", workers=32):
+        assert 0 <= low < high
+        assert policy in POLICIES
+        self.high = high
+        self.low = low
+        self.policy = policy
+        self.workers = workers
+
+        self._ready = asyncio.Queue()  # mailboxes with work
+        self._resume = asyncio.Event()  # set while not saturated
+        self._resume.set()
+        self._tasks = []
+        self.depth = 0
+
+        self.max_depth = 0
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.dropped_pings = 0
+        self.pauses = 0  # put() calls that had to wait
+        self.paused_seconds = 0.0
+        self.saturations = 0
+        self.waits = deque(maxlen=WAIT_SAMPLES)  # seconds from put() to handling
+
+    def mailbox(self, handler):
+        return Mailbox(handler)
+
+    @property
+    def saturated(self):
+        return not self._resume.is_set()
+
+    def start(self):
+        # Call from inside the running event loop
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def admit_ping(self):
+        # False if an "Alive" ping should be shed right now
+        if self.policy == "drop-alive" and self.saturated:
+            self.dropped_pings += 1
+            return False
+        return True
+
+    async def put(self, box, payload):
+        if self.saturated:
+            if self.policy == "coalesce" and box.items:
+                item = box.items[-1]
+                item[0] = payload
+                item[1] += 1
+                self.coalesced += 1
+                return
+            self.pauses += 1
+            began = time.perf_counter()
+            while self.saturated:  # woken waiters may have filled it up again
+                await self._resume.wait()
+            self.paused_seconds += time.perf_counter() - began
+
+        box.items.append([payload, 1, time.perf_counter()])
+        box.idle.clear()
+        self.enqueued += 1
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        if self.depth >= self.high and not self.saturated:
+            self.saturations += 1
+            self._resume.clear()
+        if not box.scheduled:
+            box.scheduled = True
+            self._ready.put_nowait(box)
+
+    async def _work(self):
+        while True:
+            box = await self._ready.get()
+            payload, count, enqueued = box.items.popleft()
+            self.depth -= 1
+            if self.depth <= self.low:
+                self._resume.set()
+            self.waits.append(time.perf_counter() - enqueued)
+            try:
+                await box.handler(payload, count)
+            except Exception as e:
+                self.failed += 1
+                log.error("queued_reading_failed", error=e)
+            self.processed += count
+            if box.items:
+                self._ready.put_nowait(box)
+            else:
+                box.scheduled = False
+                box.idle.set()
+
+    def stats(self):
+        waits = sorted(self.waits)
+        pct = lambda p: round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 2) if waits else None
+        return {
+            "policy": self.policy,
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "high": self.high,
+            "low": self.low,
+            "saturated": self.saturated,
+            "saturations": self.saturations,
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "dropped_pings": self.dropped_pings,
+            "pauses": self.pauses,
+            "paused_seconds": round(self.paused_seconds, 3),
+            "wait_p50_ms": pct(0.50),
+            "wait_p99_ms": pct(0.99),
+        }
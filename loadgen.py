@@ -0,0 +1,206 @@
+# Load generator: replays woz.py's simulated bottles against the ingest server.
+#
+# Every simulated subject becomes one TCP client speaking the firmware protocol
+# (a weight line per dose plus "Alive" every 5 s). Event times are compressed
+# by --speed, so --speed 86400 plays a day of doses per second.
+#
+#   python backend.py --async --ack --quiet-period 0     (in another shell)
+#   python loadgen.py --bottles 1000 --speed 86400 --ramp 10
+#
+# Latency is measured from sending a reading to the server's "ok" for it, so
+# start the server with --ack; without it only throughput/connection errors
+# are reported. Compressed replays send doses seconds apart, so turn the
+# debounce quiet period off too, or most readings are coalesced and the
+# rest wait out the quiet period.
+
+import argparse
+import asyncio
+import statistics
+import time
+from collections import deque
+
+import pandas as pd
+
+import woz
+
+HOST = "127.0.0.1"
+PORT = 5005
+PING_INTERVAL = 5.0  # seconds, same as the firmware
+CONNECT_TIMEOUT = 10.0
+DRAIN_TIMEOUT = 10.0  # wait this long for outstanding acks at the end
+
+
+class LoadStats:
+    def __init__(self):
+        self.connected = 0
+        self.connect_failures = 0
+        self.dropped = 0  # connections lost before the bottle finished its stream
+        self.sent = 0
+        self.pings = 0
+        self.acked = 0
+        self.errors = 0  # "err" acks
+        self.unacked = 0
+        self.latencies = []  # seconds, send -> ack
+
+
+def build_streams(num_subjects, seed=42):
+    # {subjectId: [(seconds since the first simulated event, grams), ...]}
+    _, events = woz.generate(num_subjects=num_subjects, seed=seed)
+    ts = pd.to_datetime(events["date"] + " " + events["time"])
+    events = events.assign(offset=(ts - ts.min()).dt.total_seconds()).sort_values(["subjectId", "offset"])
+    return {
+        int(sid): list(zip(group["offset"].tolist(), group["grams"].tolist()))
+        for sid, group in events.groupby("subjectId")
+    }
+
+
+async def read_acks(reader, pending, stats):
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        if not pending:
+            continue
+        sent_at = pending.popleft()
+        if line.strip() == b"ok":
+            stats.acked += 1
+            stats.latencies.append(loop.time() - sent_at)
+        else:
+            stats.errors += 1
+
+
+async def ping(writer, stats, interval):
+    while True:
+        await asyncio.sleep(interval)
+        writer.write(b"Alive\n")
+        stats.pings += 1
+
+
+async def run_bottle(events, connect_at, replay_at, args, stats):
+    loop = asyncio.get_running_loop()
+    await asyncio.sleep(max(0.0, connect_at - loop.time()))
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(args.host, args.port), CONNECT_TIMEOUT)
+    except (OSError, asyncio.TimeoutError):
+        stats.connect_failures += 1
+        return
+    stats.connected += 1
+
+    pending = deque()
+    acks = asyncio.create_task(read_acks(reader, pending, stats))
+    pings = asyncio.create_task(ping(writer, stats, args.ping_interval))
+    try:
+        for offset, grams in events:
+            delay = replay_at + offset / args.speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            pending.append(loop.time())
+            writer.write(f"{grams:.3f}\n".encode())
+            await writer.drain()
+            stats.sent += 1
+
+        # Give the server a moment to acknowledge what's still in flight
+        deadline = loop.time() + args.drain_timeout
+        while pending and not acks.done() and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+    except (ConnectionError, OSError):
+        stats.dropped += 1
+    finally:
+        stats.unacked += len(pending)
+        pings.cancel()
+        acks.cancel()
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+async def report_progress(stats, started, interval=5.0):
+    last_sent, last_time = 0, started
+    while True:
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        rate = (stats.sent - last_sent) / (now - last_time)
+        print(f"[{now - started:6.1f}s] conns={stats.connected} sent={stats.sent} "
+              f"acked={stats.acked} rate={rate:,.0f}/s failures={stats.connect_failures + stats.dropped}")
+        last_sent, last_time = stats.sent, now
+
+
+def percentile_ms(latencies, q):
+    if not latencies:
+        return float("nan")
+    if len(latencies) == 1:
+        return latencies[0] * 1000
+    return statistics.quantiles(latencies, n=100, method="inclusive")[q - 1] * 1000
+
+
+async def run(args):
+    streams = build_streams(args.bottles, args.seed)
+    if args.limit:
+        streams = {sid: events[:args.limit] for sid, events in streams.items()}
+    total = sum(len(e) for e in streams.values())
+    print(f"Replaying {total} readings from {len(streams)} bottles against {args.host}:{args.port} "
+          f"(speed x{args.speed:g}, ramp {args.ramp:g}s)")
+
+    loop = asyncio.get_running_loop()
+    stats = LoadStats()
+    begin = loop.time()
+    replay_at = begin + args.ramp  # everyone is connected before the replay clock starts
+    step = args.ramp / max(1, len(streams))
+
+    started = time.perf_counter()
+    progress = asyncio.create_task(report_progress(stats, started))
+    await asyncio.gather(*(
+        run_bottle(events, begin + i * step, replay_at, args, stats)
+        for i, events in enumerate(streams.values())
+    ))
+    progress.cancel()
+    elapsed = time.perf_counter() - started
+
+    replay_time = max(1e-9, elapsed - args.ramp)
+    print()
+    print(f"Duration:        {elapsed:.1f}s (replay {replay_time:.1f}s after {args.ramp:g}s ramp)")
+    print(f"Connections:     {stats.connected} ok, {stats.connect_failures} failed, {stats.dropped} dropped")
+    print(f"Readings:        {stats.sent} sent, {stats.acked} acked, {stats.errors} errors, {stats.unacked} unacked")
+    print(f"Pings:           {stats.pings}")
+    print(f"Throughput:      {stats.sent / replay_time:,.0f} readings/s sent, {stats.acked / replay_time:,.0f} acked/s")
+    if stats.latencies:
+        print(f"Latency (ms):    p50={percentile_ms(stats.latencies, 50):.1f} "
+              f"p95={percentile_ms(stats.latencies, 95):.1f} p99={percentile_ms(stats.latencies, 99):.1f} "
+              f"max={max(stats.latencies) * 1000:.1f}")
+    else:
+        print("Latency:         no acks received (start backend.py with --ack)")
+
+
+def raise_fd_limit():
+    # One socket per simulated bottle
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay simulated bottles against the ingest server")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--bottles", type=int, default=woz.NUM_SUBJECTS, help="concurrent bottles (one per subject)")
+    parser.add_argument("--speed", type=float, default=86400.0, help="time compression factor")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds to open all connections")
+    parser.add_argument("--limit", type=int, default=0, help="max readings per bottle (0 = all)")
+    parser.add_argument("--ping-interval", type=float, default=PING_INTERVAL)
+    parser.add_argument("--drain-timeout", type=float, default=DRAIN_TIMEOUT)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    raise_fd_limit()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
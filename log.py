@@ -0,0 +1,84 @@
+# Level-controlled, rate-limited structured logging for per-event messages.
+#
+#   log.info("queued", subject=3, grams=15.0, anomaly="1")
+#   -> 2026-10-17T00:31:02 info queued subject=3 grams=15.0 anomaly=1
+#
+# Lines below LEVEL are dropped before anything is formatted. Each event
+# name has a token bucket (RATE lines per second, BURST deep), so a flood
+# of one message can't drown the rest or slow the ingest path down; the
+# next line of that event that gets through carries suppressed=N. Startup
+# banners and stats dumps stay plain print().
+
+import threading
+import time
+from datetime import datetime
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+LEVEL = "info"
+RATE = 10.0  # lines per second per event name
+BURST = 20
+
+_threshold = LEVELS[LEVEL]
+_buckets = {}  # event -> [tokens, last refill, suppressed]
+_lock = threading.Lock()
+suppressed_total = 0
+
+
+def set_level(name, rate=None):
+    global _threshold, RATE
+    _threshold = LEVELS[name]
+    if rate is not None:
+        RATE = rate
+
+
+def enabled(level):
+    return LEVELS[level] >= _threshold
+
+
+def _format(value):
+    if isinstance(value, tuple):
+        value = ":".join(map(str, value))  # socket addresses
+    text = str(value)
+    if not text or any(c in text for c in ' ="'):
+        return '"' + text.replace('"', '\\"') + '"'
+    return text
+
+
+def _emit(level, event, fields):
+    global suppressed_total
+    if LEVELS[level] < _threshold:
+        return
+    now = time.monotonic()
+    with _lock:
+        bucket = _buckets.get(event)
+        if bucket is None:
+            bucket = _buckets[event] = [BURST, now, 0]
+        bucket[0] = min(BURST, bucket[0] + (now - bucket[1]) * RATE)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            suppressed_total += 1
+            return
+        bucket[0] -= 1
+        suppressed, bucket[2] = bucket[2], 0
+    parts = [datetime.now().isoformat(timespec="seconds"), level, event]
+    parts.extend(f"{key}={_format(value)}" for key, value in fields.items())
+    if suppressed:
+        parts.append(f"suppressed={suppressed}")
+    print(" ".join(parts))
+
+
+def debug(event, **fields):
+    _emit("debug", event, fields)
+
+
+def info(event, **fields):
+    _emit("info", event, fields)
+
+
+def warning(event, **fields):
+    _emit("warning", event, fields)
+
+
+def error(event, **fields):
+    _emit("error", event, fields)
@@ -0,0 +1,175 @@
+# Counters and latency histograms for the ingest pipeline, served as
+# Prometheus text (backend.py --metrics-port 9105, then GET /metrics).
+#
+# Everything is in-process and cheap enough for the hot path: a counter is
+# a dict update under a lock, a histogram observation is a bisect into
+# fixed buckets. Stage timings use the monotonic perf_counter:
+#
+#   with metrics.stage("classify"):
+#       ...
+#
+# Gauges that already live elsewhere (queue depth, devices online) are
+# registered as callbacks and read when scraped.
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_HOST = "127.0.0.1"  # local only; put a proxy in front to scrape remotely
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+
+_registry = []
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.values = {}  # label values -> number
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self.values.items())
+        return [f"{self.name}{_labels(self.label_names, key)} {value}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self._lock:
+            self.values[labels] = value
+
+
+class CallbackGauge:
+    # Read from `read()` at scrape time
+    kind = "gauge"
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+        _registry.append(self)
+
+    def samples(self):
+        try:
+            return [f"{self.name} {self.read()}"]
+        except Exception:
+            return []
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = buckets
+        self.series = {}  # label values -> [count per bucket (+Inf last), sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - began, *labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total, n) for key, (counts, total, n) in self.series.items()]
+        lines = []
+        for key, counts, total, n in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {n}")
+        return lines
+
+
+def render():
+    # Every registered metric in the Prometheus text exposition format
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+# --- Pipeline metrics ---
+
+STAGE_SECONDS = Histogram("dose_stage_seconds", "Time spent in each ingest stage", ("stage",))
+EVENTS = Counter("dose_events_total", "Events computed and journaled")
+ANOMALIES = Counter("dose_anomalies_total", "Events by anomalyId", ("anomaly",))
+LINES = Counter("dose_lines_total", "Lines received from bottles by kind", ("kind",))
+CONNECTIONS = Counter("dose_connections_total", "Bottle connections accepted")
+OPEN_CONNECTIONS = Gauge("dose_connections_open", "Bottle connections currently open")
+ERRORS = Counter("dose_errors_total", "Errors by kind", ("kind",))
+
+
+def stage(name):
+    # with stage("classify"): ... -> dose_stage_seconds{stage="classify"}
+    return STAGE_SECONDS.time(name)
+
+
+# --- HTTP endpoint ---
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would drown the log
+
+
+def serve(port, host=METRICS_HOST):
+    # Serve /metrics from a daemon thread; returns the server
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return server
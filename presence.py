@@ -0,0 +1,219 @@
+# Device presence from "Alive" pings (and any other line a bottle sends).
+#
+# Bottles ping every 5 s; one that has been silent for OFFLINE_AFTER seconds
+# is marked offline, instead of waiting for the 60 s socket timeout. Pings
+# only update a last-seen time in a dict. Expiry uses a hashed timer wheel:
+# one slot per RESOLUTION seconds, enough slots to cover OFFLINE_AFTER, and
+# each device filed in the slot of its deadline. Every tick only the devices
+# in the due slot are looked at; one that has pinged since it was filed is
+# re-filed at its new deadline. A device therefore costs O(1) per
+# OFFLINE_AFTER period however often it pings, and a tick costs O(devices
+# due), not O(fleet).
+#
+# A device that goes offline is re-filed at last seen + RETENTION; if it is
+# still silent then, it is forgotten (dropped from memory and its `devices`
+# row deleted), so one-off or renamed devices don't accumulate. A ping
+# before that moves it back to its OFFLINE_AFTER deadline.
+#
+# Online/offline transitions are collected per device (a flap between two
+# flushes collapses to the latest state) and written to the `devices` table
+# as one batched upsert every FLUSH_INTERVAL, evictions as one delete. Fleet
+# counts are kept up to date on every transition, so fleet() is O(1).
+
+import threading
+import time
+from datetime import datetime
+import log
+
+OFFLINE_AFTER = 15.0  # seconds without a line (3 missed pings)
+RESOLUTION = 1.0  # seconds per wheel slot
+FLUSH_INTERVAL = 2.0  # seconds between `devices` upserts
+RETENTION = 24 * 3600.0  # seconds offline before a device is forgotten (0 = never)
+
+
+class PresenceTracker:
+    def __init__(self, upsert_devices, delete_devices=None, offline_after=OFFLINE_AFTER, retention=RETENTION,
+                 resolution=RESOLUTION, flush_interval=FLUSH_INTERVAL, clock=time.monotonic):
+        self.upsert_devices = upsert_devices
+        self.delete_devices = delete_devices  # (deviceIds) -> None; None keeps evicted rows in the table
+        self.offline_after = offline_after
+        self.retention = retention
+        self.resolution = resolution
+        self.flush_interval = flush_interval
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._slots = [{} for _ in range(int(offline_after / resolution) + 2)]  # device -> tick filed for
+        self._filed = {}  # device -> tick it is filed for (deadlines past one turn wait in their slot)
+        self._tick = self._tick_of(clock())  # next tick to process
+        self._last_seen = {}  # device -> monotonic time of its last line
+        self._seen_at = {}  # device -> wall-clock time of its last line (for the table)
+        self._online = {}  # device -> bool
+        self._pending = {}  # device -> row waiting for the next upsert
+        self._evicting = set()  # forgotten devices whose rows are still to be deleted
+
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.pings = 0
+        self.online_count = 0
+        self.went_online = 0
+        self.went_offline = 0
+        self.evicted = 0
+        self.upserts = 0
+        self.upserted_rows = 0
+        self.failures = 0
+
+    def _tick_of(self, t):
+        return int(t / self.resolution)
+
+    def _file(self, device, deadline):
+        tick = self._tick_of(deadline) + 1  # rounded up: never expire early
+        self._slots[tick % len(self._slots)][device] = tick
+        self._filed[device] = tick
+
+    def _unfile(self, device):
+        tick = self._filed.pop(device, None)
+        if tick is not None:
+            self._slots[tick % len(self._slots)].pop(device, None)
+
+    def _evict(self, device):
+        del self._last_seen[device], self._seen_at[device], self._online[device]
+        self._pending.pop(device, None)
+        self._evicting.add(device)
+        self.evicted += 1
+        log.info("device_forgotten", device=device)
+
+    def _transition(self, device, online):
+        self._online[device] = online
+        self.online_count += 1 if online else -1
+        self._pending[device] = {
+            "deviceId": device,
+            "online": online,
+            "lastSeen": self._seen_at[device].isoformat(timespec="seconds"),
+        }
+        if online:
+            self.went_online += 1
+        else:
+            self.went_offline += 1
+        log.info("device", device=device, online=online)
+
+    def seen(self, device, now=None):
+        # Record a line from `device`; O(1)
+        now = self.clock() if now is None else now
+        with self._lock:
+            self.pings += 1
+            self._last_seen[device] = now
+            self._seen_at[device] = datetime.now()
+            if not self._online.get(device, False):
+                self._evicting.discard(device)
+                self._transition(device, True)
+                self._unfile(device)  # drop its retention deadline
+            if device not in self._filed:
+                self._file(device, now + self.offline_after)
+
+    def expire(self, now=None):
+        # Process wheel slots up to `now`; returns the devices that went offline
+        now = self.clock() if now is None else now
+        offline = []
+        with self._lock:
+            current = self._tick_of(now)
+            # After a long stall every slot is due once; no need to go round twice
+            for tick in range(max(self._tick, current - len(self._slots) + 1), current + 1):
+                slot = self._slots[tick % len(self._slots)]
+                for device in [d for d, filed_for in slot.items() if filed_for <= current]:
+                    del slot[device]
+                    del self._filed[device]
+                    if not self._online[device]:
+                        self._evict(device)  # filed at its retention deadline and still silent
+                        continue
+                    deadline = self._last_seen[device] + self.offline_after
+                    if deadline <= now:
+                        self._transition(device, False)
+                        offline.append(device)
+                        if self.retention:
+                            self._file(device, self._last_seen[device] + self.retention)
+                    else:
+                        self._file(device, deadline)
+            self._tick = current + 1
+        return offline
+
+    def flush(self):
+        # Write pending transitions as one upsert and evictions as one delete;
+        # returns the rows written. On failure the rows go back to pending
+        # unless newer ones replaced them (or the device came back).
+        with self._lock:
+            rows, self._pending = list(self._pending.values()), {}
+            evicted, self._evicting = sorted(self._evicting), set()
+        if self.delete_devices is None:
+            evicted = []
+        if not rows and not evicted:
+            return 0
+        try:
+            if rows:
+                self.upsert_devices(rows)
+            if evicted:
+                self.delete_devices(evicted)
+        except Exception:
+            with self._lock:
+                self.failures += 1
+                for row in rows:
+                    self._pending.setdefault(row["deviceId"], row)
+                self._evicting.update(d for d in evicted if d not in self._online)
+            raise
+        if rows:
+            self.upserts += 1
+            self.upserted_rows += len(rows)
+        return len(rows) + len(evicted)
+
+    def _run(self):
+        next_flush = self.clock() + self.flush_interval
+        while not self._stop.wait(self.resolution):
+            self.expire()
+            if self.clock() >= next_flush:
+                next_flush = self.clock() + self.flush_interval
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Device upsert failed ({e}); retrying in {self.flush_interval:.0f}s")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="presence", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Final device upsert failed: {e}")
+
+    # --- Fleet status (in memory, no query) ---
+
+    def is_online(self, device):
+        return self._online.get(device, False)
+
+    def last_seen(self, device):
+        # Wall-clock time of the device's last line, or None if never seen
+        return self._seen_at.get(device)
+
+    def fleet(self):
+        known = len(self._online)
+        return {"devices": known, "online": self.online_count, "offline": known - self.online_count}
+
+    def stats(self):
+        return {
+            **self.fleet(),
+            "pings": self.pings,
+            "went_online": self.went_online,
+            "went_offline": self.went_offline,
+            "evicted": self.evicted,
+            "filed": len(self._filed),
+            "pending": len(self._pending),
+            "upserts": self.upserts,
+            "upserted_rows": self.upserted_rows,
+            "failures": self.failures,
+        }
@@ -0,0 +1,271 @@
+# Server-sent events from the ingest backend, so dashboards don't re-query
+# the database for fresh events (backend.py --async --push-port 5006).
+#
+#   GET /events?subject=12                  one subject
+#   GET /events?subject=12&subject=14       a cohort (or subject=12,14)
+#   GET /events                             every subject
+#   GET /stats?subject=12                   current stats as JSON
+#
+# These are patient events, so the server listens on PUSH_HOST (127.0.0.1)
+# unless told otherwise, and sends no CORS header unless an origin is
+# configured (--push-origin https://dashboard.example). With a token
+# (--push-token, or DOSE_PUSH_TOKEN) every request must carry ?token=...;
+# EventSource can't set headers, so it goes in the query string.
+#
+# Every stored event is published once: it is serialized to a single SSE
+# frame (the event row plus its subject's running stats), kept in that
+# subject's ring of the last RING_SIZE frames, and the same bytes are
+# written to every subscriber of that subject. A new subscriber first gets
+# the ring (or, reconnecting with Last-Event-ID, only the frames it missed);
+# after that only new events. A subscriber whose socket buffer passes
+# MAX_BUFFERED is disconnected rather than buffered without bound; its
+# EventSource reconnects and catches up from the ring.
+#
+# Frames look like:
+#
+#   id: 18b2f6c1a40-1042
+#   event: dose
+#   data: {"event": {...events row...}, "stats": {"events": 3, "anomalies": {...}, ...}}
+#
+# Ids are <epoch>-<seq>, the epoch being this process's start time, so a
+# client reconnecting after a backend restart is recognised: it gets an
+# "event: reset" frame (drop what you have and reload) and then the ring.
+#
+# Runs on the backend's event loop; publish() must be called from it.
+
+import asyncio
+import hmac
+import json
+import time
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+import log
+import metrics
+
+RING_SIZE = 200  # recent events kept per subject (SubjectView loads 200)
+ALL_RING = 1000  # recent events kept for subscribers to every subject
+MAX_BUFFERED = 256 * 1024  # bytes queued to one subscriber before it is dropped
+HEARTBEAT = 15.0  # seconds between keep-alive comments
+RETRY_MS = 2000  # EventSource reconnect delay
+MAX_REQUEST_LINE = 8192
+PUSH_HOST = "127.0.0.1"  # local only; put an authenticating proxy in front to expose it
+
+HEADERS = ("HTTP/1.1 200 OK\r\n"
+           "Content-Type: text/event-stream\r\n"
+           "Cache-Control: no-cache\r\n"
+           "Connection: keep-alive\r\n")
+PING = b": ping\n\n"
+RESET = b"event: reset\ndata: {}\n\n"
+
+
+class Subscriber:
+    def __init__(self, writer, subjects):
+        self.writer = writer
+        self.subjects = subjects  # set of subjectIds, or None for everyone
+
+    def send(self, frame):
+        # False once the subscriber is gone or too far behind
+        if self.writer.is_closing():
+            return False
+        if self.writer.transport.get_write_buffer_size() > MAX_BUFFERED:
+            self.writer.close()
+            return False
+        self.writer.write(frame)
+        return True
+
+
+class PushHub:
+    def __init__(self, ring_size=RING_SIZE, token=None, origin=None):
+        self.ring_size = ring_size
+        self.token = token  # required as ?token= when set
+        self.origin = origin  # Access-Control-Allow-Origin, or None for same-origin only
+        self.epoch = format(int(time.time() * 1000), "x")
+        self._seq = 0
+        self._rings = {}  # subjectId -> deque of (seq, frame)
+        self._all = deque(maxlen=ALL_RING)
+        self._stats = {}  # subjectId -> running stats dict
+        self._by_subject = {}  # subjectId -> set of Subscriber
+        self._everyone = set()  # subscribers to every subject
+        self._subscribers = set()
+
+        self.published = 0
+        self.sent = 0
+        self.dropped = 0
+
+    # --- Publishing ---
+
+    def publish(self, data):
+        # One stored event (the dict insert_to_supabase returns)
+        if data is None:
+            return
+        subject_id = data["subjectId"]
+        stats = self._stats.get(subject_id)
+        if stats is None:
+            stats = self._stats[subject_id] = {"subjectId": subject_id, "events": 0,
+                                               "anomalies": {"0": 0, "1": 0, "2": 0, "3": 0}}
+        stats["events"] += 1
+        stats["anomalies"][data["anomalyId"]] = stats["anomalies"].get(data["anomalyId"], 0) + 1
+        stats["adherenceScore"] = data["adherenceScore"]
+        stats["pillCount"] = data["pillCount"]
+        stats["lastDate"], stats["lastTime"] = data["date"], data["time"]
+
+        self._seq += 1
+        body = json.dumps({"event": data, "stats": stats}, separators=(",", ":"))
+        frame = f"id: {self.epoch}-{self._seq}\nevent: dose\ndata: {body}\n\n".encode()
+        ring = self._rings.get(subject_id)
+        if ring is None:
+            ring = self._rings[subject_id] = deque(maxlen=self.ring_size)
+        ring.append((self._seq, frame))
+        self._all.append((self._seq, frame))
+        self.published += 1
+
+        for group in (self._by_subject.get(subject_id), self._everyone):
+            for subscriber in list(group or ()):
+                if subscriber.send(frame):
+                    self.sent += 1
+                else:
+                    self._drop(subscriber)
+
+    # --- Subscribers ---
+
+    def backlog(self, subjects, after=0):
+        # Ring frames newer than `after` for these subjects (None = everyone), in order
+        if subjects is None:
+            return [frame for seq, frame in self._all if seq > after]
+        frames = [(seq, frame) for s in subjects for seq, frame in self._rings.get(s, ()) if seq > after]
+        return [frame for _, frame in sorted(frames, key=lambda f: f[0])]
+
+    def subscribe(self, subscriber):
+        self._subscribers.add(subscriber)
+        if subscriber.subjects is None:
+            self._everyone.add(subscriber)
+        else:
+            for s in subscriber.subjects:
+                self._by_subject.setdefault(s, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber):
+        # True if it was still subscribed
+        if subscriber not in self._subscribers:
+            return False
+        self._subscribers.discard(subscriber)
+        if subscriber.subjects is None:
+            self._everyone.discard(subscriber)
+        else:
+            for s in subscriber.subjects:
+                group = self._by_subject.get(s)
+                if group is not None:
+                    group.discard(subscriber)
+                    if not group:
+                        del self._by_subject[s]
+        return True
+
+    def _drop(self, subscriber):
+        # Gone or too slow
+        if self.unsubscribe(subscriber):
+            self.dropped += 1
+
+    def subscribers(self):
+        return len(self._subscribers)
+
+    def stats(self):
+        return {
+            "subjects": len(self._rings),
+            "subscribers": self.subscribers(),
+            "published": self.published,
+            "sent": self.sent,
+            "dropped": self.dropped,
+        }
+
+    def subject_stats(self, subjects):
+        return [self._stats[s] for s in subjects if s in self._stats]
+
+    # --- HTTP ---
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT)
+            for subscriber in list(self._subscribers):
+                if not subscriber.send(PING):
+                    self._drop(subscriber)
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            method, target, *_ = request.decode("latin-1").split() or ("", "")
+        except (ValueError, ConnectionError):
+            writer.close()
+            return
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        if self.token and not hmac.compare_digest(query.get("token", [""])[0].encode(), self.token.encode()):
+            await self._respond(writer, 401, {"error": "token required"})
+            return
+        try:
+            subjects = {int(s) for value in query.get("subject", []) for s in value.split(",") if s} or None
+        except ValueError:
+            await self._respond(writer, 400, {"error": "subject must be integers"})
+            return
+        last_id = headers.get("last-event-id") or query.get("lastEventId", [""])[0]
+        epoch, _, seq = last_id.rpartition("-")
+        after = int(seq) if epoch == self.epoch and seq.isdigit() else None  # None: unknown or older process
+
+        if method != "GET":
+            await self._respond(writer, 405, {"error": "GET only"})
+        elif url.path == "/stats":
+            await self._respond(writer, 200, {"hub": self.stats(),
+                                              "subjects": self.subject_stats(subjects or self._stats)})
+        elif url.path == "/events":
+            await self._stream(reader, writer, subjects, after, last_id)
+        else:
+            await self._respond(writer, 404, {"error": "not found"})
+
+    def _cors(self):
+        return f"Access-Control-Allow-Origin: {self.origin}\r\nVary: Origin\r\n" if self.origin else ""
+
+    async def _respond(self, writer, status, body):
+        payload = json.dumps(body).encode()
+        reason = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+                  405: "Method Not Allowed"}[status]
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(payload)}\r\n{self._cors()}"
+                     f"Connection: close\r\n\r\n".encode() + payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def _stream(self, reader, writer, subjects, after, last_id):
+        # `after` is None for a new client or one whose id is from an earlier
+        # process; the latter is told to reset before getting the ring
+        subscriber = Subscriber(writer, subjects)
+        writer.write(f"{HEADERS}{self._cors()}\r\nretry: {RETRY_MS}\n\n".encode())
+        if after is None and last_id:
+            writer.write(RESET)
+        writer.writelines(self.backlog(subjects, after or 0))
+        self.subscribe(subscriber)
+        log.info("push_subscribed", subjects=",".join(map(str, sorted(subjects))) if subjects else "all",
+                 after=last_id or None, subscribers=self.subscribers())
+        try:
+            while await reader.read(1024):  # clients don't send anything; wait for the close
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self.unsubscribe(subscriber)
+            writer.close()
+
+    async def serve(self, host=PUSH_HOST, port=5006):
+        # Start the SSE server on the running loop; returns the server
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_REQUEST_LINE, reuse_address=True)
+        asyncio.get_running_loop().create_task(self._heartbeat())
+        metrics.CallbackGauge("dose_push_subscribers", "SSE subscribers connected", self.subscribers)
+        print(f"Push (SSE) on http://{host}:{port}/events")
+        return server
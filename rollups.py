@@ -0,0 +1,349 @@
+# Precomputed adherence aggregates for the dashboard, kept in `rollups`.
+#
+# AggregateView used to refetch every subject row on any change to
+# `subjects`, and every reading changes currAdherenceScore, so each reading
+# anywhere meant a full-table read on every open dashboard. This service
+# follows `events` by id instead and keeps, with O(1) work per event:
+#
+#   day:<subjectId>:<YYYY-MM-DD>    events, count per anomalyId, adherence that day
+#   week:<subjectId>:<YYYY-MM-DD>   the same for the week starting that Monday
+#   histogram:<range>               subjects per adherence range (the buckets
+#                                   AggregateView's createHistogramData builds)
+#   cohort:all                      total / average / high / low / excellent counts
+#   meta:tail                       last event id folded in, to resume from
+#
+# Only rows whose numbers changed are upserted, once per POLL_INTERVAL, so
+# the dashboard subscribes to `rollups` and reads 6 small rows.
+#
+#   python rollups.py                  # follow events, publish every 2 s
+#   python rollups.py --once           # catch up, publish, exit
+#   python rollups.py --rebuild        # recount from the first event
+#
+# Supabase table: supabase/migrations/20261017000300_rollups.sql (also adds
+# it to the realtime publication the dashboard listens on). SQLite creates
+# it itself.
+#
+# A subject's adherence is the adherenceScore of its newest event, which is
+# what ingest.py writes to currAdherenceScore. Subjects are re-read every
+# SUBJECT_REFRESH seconds, so new, renamed and deleted subjects and scores
+# rewritten by backfill.py reach the histogram too.
+#
+# Both adherenceScore and currAdherenceScore are whole percents, 0-100
+# (ingest.py, backfill.py, and the dashboard when it creates a subject).
+
+import argparse
+import time
+from datetime import date, datetime, timedelta
+import log
+import metrics
+from adherence import adherence_score
+from storage import get_storage
+
+POLL_INTERVAL = 2.0  # seconds between tail reads / publishes
+PAGE_SIZE = 1000  # events per events_after request
+OVERLAP = 200  # ids re-read behind the tail, for inserts that commit out of id order
+KEEP_DAYS = 35  # day/week buckets older than this are dropped from memory (re-read if touched)
+CATCHUP_PAGES = 100  # pages folded in between publishes while catching up
+SUBJECT_REFRESH = 60.0  # seconds between re-reads of subject names/scores
+HISTOGRAM_MEMBERS = 50  # subjects listed per histogram row (the dashboard tooltip)
+
+HISTOGRAM_RANGES = ("0-20%", "21-40%", "41-60%", "61-80%", "81-100%")
+ANOMALY_IDS = ("0", "1", "2", "3")
+
+
+def bucket_of(adherence):
+    # Index into HISTOGRAM_RANGES for a whole percent (0-20, 21-40, ...)
+    return min(4, max(0, (adherence - 1) // 20))
+
+
+def percent(score):
+    # adherenceScore / currAdherenceScore (0-100, str or number) -> whole percent
+    if score is None:
+        return 0
+    return max(0, min(100, int(float(score) + 0.5)))
+
+
+_periods = {}
+
+
+def periods(event_date):
+    # "%m/%d/%y" -> (ISO day, ISO Monday of that week); memoized
+    result = _periods.get(event_date)
+    if result is None:
+        day = datetime.strptime(event_date, "%m/%d/%y").date()
+        result = _periods[event_date] = (day.isoformat(), (day - timedelta(days=day.weekday())).isoformat())
+    return result
+
+
+class Rollups:
+    # In-memory aggregates plus the set of keys changed since the last publish
+    def __init__(self, keep_days=KEEP_DAYS, load_rows=None, stored_before=None):
+        self.keep_days = keep_days
+        self.load_rows = load_rows  # keys -> rows, for buckets not in memory but in the table
+        self.stored_before = stored_before  # periods before this may be in the table from an earlier run
+
+        self._buckets = {}  # key -> [subjectId, kind, period, events, n0, n1, n2, n3]
+        self._scores = {}  # subjectId -> whole percent
+        self._names = {}  # subjectId -> (firstName, lastName)
+        self._members = [set() for _ in HISTOGRAM_RANGES]  # subjectIds per range
+        self._cohort = {"sum": 0, "high": 0, "low": 0, "excellent": 0}
+        self._dirty = set()  # bucket keys
+        self._evicted = set()  # published bucket keys dropped from memory
+        self._dirty_ranges = set()
+        self._cohort_dirty = False
+        self.kept_since = (date.today() - timedelta(days=keep_days)).isoformat()
+
+        self.events = 0
+        self.reloads = 0
+        self.published = 0
+
+    # --- Restoring ---
+
+    def load(self, rows):
+        # Published day/week rows back into buckets (startup, or an evicted bucket)
+        for row in rows:
+            counts = row["data"]["anomalies"]
+            self._buckets[row["key"]] = [row["subjectId"], row["kind"], row["period"], row["data"]["events"],
+                                         *(counts.get(a, 0) for a in ANOMALY_IDS)]
+
+    # --- Updating ---
+
+    def _bucket(self, kind, subject_id, period):
+        key = f"{kind}:{subject_id}:{period}"
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            stored = key in self._evicted or (self.stored_before is not None and period < self.stored_before)
+            if stored and self.load_rows is not None:
+                self.reloads += 1
+                self._evicted.discard(key)
+                self.load(self.load_rows([key]))
+                bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [subject_id, kind, period, 0, 0, 0, 0, 0]
+        self._dirty.add(key)
+        return bucket
+
+    def set_subject(self, subject_id, adherence, name=None):
+        # Move one subject between histogram ranges; O(1)
+        old = self._scores.get(subject_id)
+        if name is not None and self._names.get(subject_id) != name:
+            self._names[subject_id] = name
+            if old is not None:
+                self._dirty_ranges.add(bucket_of(old))  # the range lists names
+        if old == adherence:
+            return
+        cohort = self._cohort
+        if old is None:
+            self._dirty_ranges.update(range(len(HISTOGRAM_RANGES)))  # every percentage moves with the total
+        else:
+            self._members[bucket_of(old)].discard(subject_id)
+            self._dirty_ranges.add(bucket_of(old))
+            cohort["sum"] -= old
+            cohort["high"] -= old >= 80
+            cohort["low"] -= old < 60
+            cohort["excellent"] -= old >= 90
+        self._scores[subject_id] = adherence
+        self._members[bucket_of(adherence)].add(subject_id)
+        self._dirty_ranges.add(bucket_of(adherence))
+        cohort["sum"] += adherence
+        cohort["high"] += adherence >= 80
+        cohort["low"] += adherence < 60
+        cohort["excellent"] += adherence >= 90
+        self._cohort_dirty = True
+
+    def remove_subject(self, subject_id):
+        # A deleted subject leaves the histogram and cohort
+        old = self._scores.pop(subject_id, None)
+        self._names.pop(subject_id, None)
+        if old is None:
+            return
+        self._members[bucket_of(old)].discard(subject_id)
+        self._dirty_ranges.update(range(len(HISTOGRAM_RANGES)))  # the total changed
+        cohort = self._cohort
+        cohort["sum"] -= old
+        cohort["high"] -= old >= 80
+        cohort["low"] -= old < 60
+        cohort["excellent"] -= old >= 90
+        self._cohort_dirty = True
+
+    def subject_ids(self):
+        return set(self._scores)
+
+    def score(self, subject_id):
+        return self._scores.get(subject_id)
+
+    def record(self, event):
+        # Fold one `events` row in; O(1)
+        subject_id = event["subjectId"]
+        anomaly = 1 + ANOMALY_IDS.index(str(event["anomalyId"]))
+        for kind, period in zip(("day", "week"), periods(event["date"])):
+            bucket = self._bucket(kind, subject_id, period)
+            bucket[3] += 1
+            bucket[3 + anomaly] += 1
+        self.set_subject(subject_id, percent(event["adherenceScore"]))
+        self.events += 1
+
+    def evict(self):
+        # Drop published buckets that have aged out of the kept window
+        self.kept_since = (date.today() - timedelta(days=self.keep_days)).isoformat()
+        old = [key for key, b in self._buckets.items() if b[2] < self.kept_since and key not in self._dirty]
+        for key in old:
+            del self._buckets[key]
+        self._evicted.update(old)
+        return len(old)
+
+    # --- Publishing ---
+
+    def changed_rows(self):
+        # Rows for everything changed since the last call
+        now = datetime.now().isoformat(timespec="seconds")
+        rows = []
+        for key in self._dirty:
+            subject_id, kind, period, events, *counts = self._buckets[key]
+            rows.append({"key": key, "kind": kind, "subjectId": subject_id, "period": period, "updatedAt": now, "data": {
+                "events": events,
+                "anomalies": dict(zip(ANOMALY_IDS, counts)),
+                "adherence": int(adherence_score(events, events - counts[0])),
+            }})
+        total = len(self._scores)
+        for i in sorted(self._dirty_ranges):
+            members = sorted(self._members[i], key=lambda s: (self._scores[s], s))[:HISTOGRAM_MEMBERS]
+            rows.append({"key": f"histogram:{HISTOGRAM_RANGES[i]}", "kind": "histogram", "subjectId": None,
+                         "period": HISTOGRAM_RANGES[i], "updatedAt": now, "data": {
+                "count": len(self._members[i]),
+                "percentage": int(len(self._members[i]) * 100 / total + 0.5) if total else 0,
+                "subjects": [{"subjectId": s, "firstName": self._names.get(s, ("", ""))[0],
+                              "lastName": self._names.get(s, ("", ""))[1], "adherence": self._scores[s]}
+                             for s in members],
+            }})
+        if self._cohort_dirty:
+            cohort = self._cohort
+            rows.append({"key": "cohort:all", "kind": "cohort", "subjectId": None, "period": "all",
+                         "updatedAt": now, "data": {
+                "total": total,
+                "average": int(cohort["sum"] / total + 0.5) if total else 0,
+                "high": cohort["high"],
+                "low": cohort["low"],
+                "excellent": cohort["excellent"],
+            }})
+        self._dirty.clear()
+        self._dirty_ranges.clear()
+        self._cohort_dirty = False
+        self.published += len(rows)
+        return rows
+
+    def stats(self):
+        return {
+            "events": self.events,
+            "subjects": len(self._scores),
+            "buckets": len(self._buckets),
+            "reloads": self.reloads,
+            "published": self.published,
+        }
+
+
+class RollupService:
+    # Follows `events` by id and publishes changed rollups
+    def __init__(self, db=None, rebuild=False):
+        self.db = db or get_storage()
+        self.rollups = Rollups(load_rows=self.db.get_rollups)
+        self.caught_up = False
+        self.tail = 0
+        self._recent = set()  # ids within OVERLAP of the tail, already folded in
+        self._floor = 0  # ids up to here were folded in by a previous run
+        self._from_events = set()  # subjects whose score came from an event since the last refresh
+        self._next_refresh = 0.0
+        if not rebuild:
+            meta = self.db.get_rollups(["meta:tail"])
+            if meta:  # resume; older buckets are re-read from the table when touched
+                self.tail = self._floor = meta[0]["data"]["lastEventId"]
+                self.rollups.stored_before = self.rollups.kept_since
+                self.rollups.load(self.db.recent_rollups(self.rollups.kept_since))
+        self.refresh_subjects()
+
+    def refresh_subjects(self):
+        # Re-read every subject's name and currAdherenceScore. A subject with
+        # an event folded in since the last refresh keeps that event's score:
+        # the journal may not have written it to `subjects` yet.
+        rows = self.db.subject_scores()
+        for row in rows:
+            name = (row["firstName"] or "", row["lastName"] or "")
+            if row["subjectId"] in self._from_events:
+                self.rollups.set_subject(row["subjectId"], self.rollups.score(row["subjectId"]), name)
+            else:
+                self.rollups.set_subject(row["subjectId"], percent(row["currAdherenceScore"]), name)
+        for subject_id in self.rollups.subject_ids() - {row["subjectId"] for row in rows}:
+            self.rollups.remove_subject(subject_id)
+        self._from_events.clear()
+        self._next_refresh = time.monotonic() + SUBJECT_REFRESH
+
+    def poll(self, max_pages=CATCHUP_PAGES):
+        # Fold in events past the tail, up to max_pages pages; returns how
+        # many were new and sets caught_up once a short page comes back
+        folded = 0
+        after = max(0, self.tail - OVERLAP)
+        for _ in range(max_pages):
+            page = self.db.events_after(after, PAGE_SIZE)
+            for event in page:
+                if event["id"] <= self._floor or event["id"] in self._recent:
+                    continue
+                self.rollups.record(event)
+                self._from_events.add(event["subjectId"])
+                self._recent.add(event["id"])
+                folded += 1
+            if page:
+                after = page[-1]["id"]
+                self.tail = max(self.tail, after)
+            self.caught_up = len(page) < PAGE_SIZE
+            if self.caught_up:
+                break
+        self._recent = {i for i in self._recent if i > self.tail - OVERLAP}
+        return folded
+
+    def publish(self):
+        rows = self.rollups.changed_rows()
+        if not rows:
+            return 0
+        rows.append({"key": "meta:tail", "kind": "meta", "subjectId": None, "period": None,
+                     "updatedAt": rows[0]["updatedAt"], "data": {"lastEventId": self.tail}})
+        with metrics.stage("rollup_publish"):
+            self.db.upsert_rollups(rows)
+        return len(rows)
+
+    def run(self, interval=POLL_INTERVAL, once=False):
+        while True:
+            began = time.perf_counter()
+            if time.monotonic() >= self._next_refresh:
+                self.refresh_subjects()
+            folded = self.poll()
+            published = self.publish()
+            if folded or published:
+                log.info("rollups", events=folded, rows=published, tail=self.tail,
+                         ms=round((time.perf_counter() - began) * 1000, 1))
+            self.rollups.evict()
+            if self.caught_up and once:
+                return
+            if self.caught_up:
+                time.sleep(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the dashboard's adherence rollups up to date")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="seconds between publishes")
+    parser.add_argument("--once", action="store_true", help="catch up, publish and exit")
+    parser.add_argument("--rebuild", action="store_true", help="recount every event instead of resuming")
+    parser.add_argument("--log-level", default=log.LEVEL, choices=log.LEVELS)
+    args = parser.parse_args()
+
+    log.set_level(args.log_level)
+    service = RollupService(rebuild=args.rebuild)
+    print(f"Rollups from event {service.tail}: {service.rollups.stats()}")
+    try:
+        service.run(args.interval, once=args.once)
+    except KeyboardInterrupt:
+        service.publish()
+    print("Rollups:", service.rollups.stats())
+
+
+if __name__ == "__main__":
+    main()
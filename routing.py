@@ -0,0 +1,63 @@
+# Bottle -> subject routing for the ingest server.
+#
+# Each bottle says which one it is right after connecting ("id:BOTTLE123",
+# see framing.parse_bottle_id), and subjects carry the bottle they were
+# given in `subjects.bottleId`. The whole mapping is small, so it is loaded
+# into a dict at startup and reloaded when subjects change (SIGHUP, the
+# harness's POST /refresh); routing a reading is then a dict lookup with no
+# query. A reload builds a new dict and swaps it in whole, so threads
+# routing readings never see a half-built table. A bottle that isn't in
+# the table also triggers a reload, at most every MISS_RELOAD seconds, so a
+# bottle assigned on the dashboard is picked up without a SIGHUP.
+
+import threading
+import time
+
+MISS_RELOAD = 30.0  # seconds between reloads caused by unknown bottles
+
+
+class BottleRoutes:
+    def __init__(self, load_routes, miss_reload=MISS_RELOAD):
+        self._load_routes = load_routes  # () -> {bottleId: subjectId}
+        self.miss_reload = miss_reload
+        self._routes = {}
+        self._lock = threading.Lock()  # one reload at a time
+        self._next_miss_reload = 0.0
+
+        self.loads = 0
+        self.lookups = 0
+        self.misses = 0
+
+    def load(self):
+        # (Re)load the table; on failure the previous one stays in use
+        with self._lock:
+            try:
+                routes = {str(bottle_id): subject_id for bottle_id, subject_id in self._load_routes().items()}
+            except Exception as e:
+                print("Could not load bottle routes:", e)
+                return False
+            self._routes = routes
+            self.loads += 1
+        return True
+
+    def subject_for(self, bottle_id, reload=True):
+        # subjectId for a bottle, or None if no subject has it. reload=False
+        # for callers that mustn't block on a query (the event loop)
+        self.lookups += 1
+        subject_id = self._routes.get(bottle_id)
+        if subject_id is None:
+            self.misses += 1
+            now = time.monotonic()
+            if reload and now >= self._next_miss_reload:
+                self._next_miss_reload = now + self.miss_reload
+                if self.load():
+                    subject_id = self._routes.get(bottle_id)
+        return subject_id
+
+    def stats(self):
+        return {
+            "bottles": len(self._routes),
+            "loads": self.loads,
+            "lookups": self.lookups,
+            "misses": self.misses,
+        }
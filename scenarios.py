@@ -0,0 +1,173 @@
+# Scripted Wizard-of-Oz scenarios replayed through the live insert path.
+#
+# Anomalies depend on the wall clock (too early "1", too late "2") and on the
+# previous weight (wrong count "3"), so hand-typed sessions in the harness
+# can't be repeated. A scenario file describes subjects and a timeline of
+# readings at virtual times, with the anomalyId/adherenceScore each one
+# should get:
+#
+#   {
+#     "name": "late morning dose",
+#     "start": "2025-01-06T00:00",
+#     "subjects": {"a": {"pillWeight": 0.5, "pillCount": 30, "pillsPerDose": 1,
+#                        "dosingWindows": {"morning": "08:00", "evening": "20:00"},
+#                        "initialGrams": 15.0}},
+#     "steps": [
+#       {"at": "09:10", "subject": "a", "grams": 14.5, "expect": {"anomalyId": "2", "adherenceScore": "0"}}
+#     ]
+#   }
+#
+# "at" is an offset from start ("H:MM[:SS]", hours may pass 24) or an
+# absolute ISO time. A file holds one scenario or a list of them.
+#
+#   python scenarios.py scenarios/*.json                      # regression run, exit 1 on a mismatch
+#   python scenarios.py scenarios/*.json --repeat 200 --workers 8   # throughput
+#   python scenarios.py scenarios/basic.json --speed 60       # real time x60
+#
+# Everything runs against a throwaway SQLite database and journal, with
+# fresh subjects for every run, so runs never see each other's events.
+# Each run has its own VirtualClock and passes its time into
+# insert_to_supabase(now=...), so any number of runs can share the pipeline.
+
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+
+class VirtualClock:
+    # Scenario time. With speed 0 advance_to() jumps straight there; with
+    # speed N it sleeps so virtual time runs N times faster than real time.
+    def __init__(self, start, speed=0.0):
+        self.start = start
+        self.speed = speed
+        self.current = start
+        self._real_start = time.monotonic()
+
+    def now(self):
+        return self.current
+
+    def advance_to(self, when):
+        if when < self.current:
+            raise ValueError(f"Timeline goes backwards: {when} < {self.current}")
+        if self.speed > 0:
+            due = self._real_start + (when - self.start).total_seconds() / self.speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.current = when
+
+
+def parse_at(at, start):
+    # "H:MM[:SS]" offset from start, or an absolute ISO time
+    if "T" in at or "-" in at:
+        return datetime.fromisoformat(at)
+    parts = [int(p) for p in at.split(":")]
+    hours, minutes, seconds = (parts + [0, 0])[:3]
+    return start + timedelta(hours=hours, minutes=minutes, seconds=seconds)
+
+
+def load_scenarios(paths):
+    scenarios = []
+    for path in paths:
+        with open(path) as f:
+            loaded = json.load(f)
+        for i, scenario in enumerate(loaded if isinstance(loaded, list) else [loaded]):
+            scenario.setdefault("name", f"{os.path.basename(path)}#{i}")
+            scenarios.append(scenario)
+    return scenarios
+
+
+class Harness:
+    # The ingest pipeline on a scratch database. ingest.py reads its storage
+    # and journal path when first imported, so this must come first.
+    def __init__(self, workdir):
+        os.environ["DOSE_JOURNAL_PATH"] = os.path.join(workdir, "journal.db")
+        import log
+        import storage
+        self.db = storage.SQLiteStorage(os.path.join(workdir, "dose.db"))
+        storage.set_storage(self.db)
+        log.set_level("warning")
+        import ingest
+        self.ingest = ingest
+        self._lock = threading.Lock()
+
+    def add_subject(self, spec):
+        row = {
+            "firstName": "Scenario",
+            "lastName": "Subject",
+            "pillWeight": spec.get("pillWeight"),
+            "prescription": {"pillCount": spec.get("pillCount", 0), "pillsPerDose": spec.get("pillsPerDose", 1)},
+            "dosingWindows": spec.get("dosingWindows", {}),
+            "currAdherenceScore": 100,
+        }
+        with self._lock:
+            return self.db.add_subject(row)
+
+    def run(self, scenario, speed=0.0):
+        # Returns (steps, [mismatch messages])
+        start = datetime.fromisoformat(scenario["start"])
+        clock = VirtualClock(start, speed)
+        subjects, states = {}, {}
+        for name, spec in scenario["subjects"].items():
+            subjects[name] = self.add_subject(spec)
+            states[name] = self.ingest.BottleState(("scenario", name))
+            states[name].previous_weight = float(spec.get("initialGrams", 0.0))
+
+        mismatches = []
+        for i, step in enumerate(scenario["steps"]):
+            clock.advance_to(parse_at(step["at"], start))
+            name = step["subject"]
+            data = self.ingest.insert_to_supabase(float(step["grams"]), states[name],
+                                                  now=clock.now(), subject_id=subjects[name])
+            for key, want in step.get("expect", {}).items():
+                got = None if data is None else data.get(key)
+                if str(got) != str(want):
+                    mismatches.append(f"step {i} ({step['at']} {name} {step['grams']}g): "
+                                      f"{key} expected {want}, got {got}")
+        return len(scenario["steps"]), mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay scripted WOZ scenarios through the insert pipeline")
+    parser.add_argument("files", nargs="+", help="scenario JSON files")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="virtual seconds per real second (0 = as fast as possible, 1 = real time)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs of each scenario")
+    parser.add_argument("--workers", type=int, default=1, help="scenario runs in parallel")
+    parser.add_argument("--verbose", action="store_true", help="print every run, not just failures")
+    args = parser.parse_args()
+
+    scenarios = load_scenarios(args.files)
+    runs = [s for s in scenarios for _ in range(args.repeat)]
+    with tempfile.TemporaryDirectory() as workdir:
+        harness = Harness(workdir)
+        began = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            results = list(pool.map(lambda s: harness.run(s, args.speed), runs))
+        elapsed = time.perf_counter() - began
+        harness.ingest.writer.close()
+
+    failed = 0
+    for scenario, (steps, mismatches) in zip(runs, results):
+        if mismatches:
+            failed += 1
+            print(f"FAIL {scenario['name']}")
+            for message in mismatches:
+                print(f"     {message}")
+        elif args.verbose:
+            print(f"ok   {scenario['name']} ({steps} steps)")
+
+    total_steps = sum(steps for steps, _ in results)
+    print(f"{len(runs) - failed}/{len(runs)} runs passed ({len(scenarios)} scenarios x {args.repeat}), "
+          f"{total_steps} readings in {elapsed:.2f}s ({total_steps / elapsed:,.0f} readings/s, "
+          f"{args.workers} workers)")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
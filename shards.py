@@ -0,0 +1,185 @@
+# Subject-sharded ingest workers for backend.py --async --shards N.
+#
+# insert_to_supabase keeps state that has to see a subject's events in
+# order (previous weight, today's adherence counters, cached subject rows),
+# and with everything in one process the scoring and journaling share one
+# core. In sharded mode the backend process only accepts connections and
+# parses lines (framing, raw-mode detection, debounce, presence); each
+# reading's subject is resolved there (ingest.resolve_subject, latest-subject
+# fallback included) and the reading is sent to worker process subject % N,
+# which owns those subjects' caches and adherence counters and writes its
+# own journal (ingest_journal.shardK.db). A subject always lands on the same
+# worker and a worker handles its inbox in order, so per-subject ordering
+# holds. The connection's previous weight travels with each reading, so a
+# bottle that is reassigned mid-connection keeps it on its new shard.
+#
+# Workers are spawned (not forked), so none of them inherits the parent's
+# database connections or journal; the journal path reaches them through
+# DOSE_JOURNAL_PATH, since spawning re-imports backend.py (and with it
+# ingest.py) before worker_main runs. Keep N the same between restarts: a
+# worker only replays its own journal file.
+
+import multiprocessing
+import os
+import queue
+import threading
+import zlib
+
+WORKER_JOURNAL = "ingest_journal.shard{}.db"
+PARENT_CHECK = 1.0  # seconds between checks that the backend process is still there
+
+
+def shard_of(key, num_shards):
+    # Stable across processes and restarts (unlike hash() on str)
+    if isinstance(key, int):
+        return key % num_shards
+    return zlib.crc32(str(key).encode()) % num_shards
+
+
+def worker_main(shard, inbox, outbox, settings):
+    # Runs in the worker process: handle messages until told to stop.
+    # Each worker serves its own metrics on metrics_port + 1 + shard.
+    import ingest
+    import log
+    import metrics
+
+    log.set_level(settings.get("log_level", log.LEVEL), settings.get("log_rate"))
+    if settings.get("metrics_port"):
+        metrics.serve(settings["metrics_port"] + 1 + shard)
+
+    ingest.adherence.verify = settings.get("verify_adherence", False)
+    for name in ("batch_size", "flush_interval", "retry_max"):
+        if name in settings:
+            setattr(ingest.writer, name, settings[name])
+    ingest.writer.start()
+
+    states = {}  # connection -> BottleState; previous weight is per connection
+    parent = multiprocessing.parent_process()
+    try:
+        while True:
+            try:
+                message = inbox.get(timeout=PARENT_CHECK)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():
+                    break  # backend was killed; flush the journal and go
+                continue
+            if message is None:
+                break
+            kind = message[0]
+            if kind == "insert":
+                _, seq, conn, grams, addr, bottle_id, subject_id, previous_weight = message
+                state = states.get(conn)
+                if state is None:
+                    state = states[conn] = ingest.BottleState(addr, bottle_id)
+                state.bottle_id = bottle_id
+                state.previous_weight = previous_weight
+                try:
+                    data = ingest.insert_to_supabase(grams, state, subject_id=subject_id)
+                    outbox.put((seq, None, data))
+                except Exception as e:
+                    outbox.put((seq, str(e) or type(e).__name__, None))
+            elif kind == "close":
+                states.pop(message[1], None)
+            elif kind == "refresh":
+                ingest.refresh_subjects()
+            elif kind == "stats":
+                print(f"Shard {shard}:", {"connections": len(states), "subjects": ingest.subject_cache.stats(),
+                                          "journal": ingest.writer.stats()})
+    finally:
+        ingest.writer.close()
+
+
+class ShardPool:
+    # Parent side: one inbox per worker, one shared outbox of (seq, error,
+    # event) results, read by a thread that completes the waiting futures on the loop
+    def __init__(self, num_shards, settings=None):
+        assert num_shards >= 1
+        self.num_shards = num_shards
+        self.settings = settings or {}
+        self._ctx = multiprocessing.get_context("spawn")
+        self._inboxes = []
+        self._workers = []
+        self._outbox = None
+        self._futures = {}  # seq -> future
+        self._seq = 0
+        self._loop = None
+        self._reader = None
+
+        self.sent = [0] * num_shards
+        self.failed = 0
+
+    def start(self, loop):
+        self._loop = loop
+        self._outbox = self._ctx.Queue()
+        journal = os.environ.get("DOSE_JOURNAL_PATH")
+        for shard in range(self.num_shards):
+            inbox = self._ctx.Queue()
+            worker = self._ctx.Process(target=worker_main, args=(shard, inbox, self._outbox, self.settings),
+                                       name=f"ingest-shard-{shard}", daemon=True)
+            os.environ["DOSE_JOURNAL_PATH"] = WORKER_JOURNAL.format(shard)
+            worker.start()
+            self._inboxes.append(inbox)
+            self._workers.append(worker)
+        if journal is None:
+            del os.environ["DOSE_JOURNAL_PATH"]
+        else:
+            os.environ["DOSE_JOURNAL_PATH"] = journal
+        self._reader = threading.Thread(target=self._read_results, name="shard-results", daemon=True)
+        self._reader.start()
+        print(f"Started {self.num_shards} ingest shards")
+
+    def _read_results(self):
+        while True:
+            result = self._outbox.get()
+            if result is None:
+                return
+            self._loop.call_soon_threadsafe(self._complete, *result)
+
+    def _complete(self, seq, error, data):
+        future = self._futures.pop(seq, None)
+        if future is None or future.done():
+            return
+        if error is None:
+            future.set_result(data)
+        else:
+            self.failed += 1
+            future.set_exception(RuntimeError(error))
+
+    def shard_for(self, key):
+        return shard_of(key, self.num_shards)
+
+    async def insert(self, shard, conn, grams, addr, bottle_id, subject_id, previous_weight):
+        # Store one reading for `subject_id` on `shard`; returns the event dict
+        # (None if it wasn't stored) and raises if the worker's insert failed
+        self._seq += 1
+        future = self._loop.create_future()
+        self._futures[self._seq] = future
+        self._inboxes[shard].put(("insert", self._seq, conn, grams, addr, bottle_id, subject_id, previous_weight))
+        self.sent[shard] += 1
+        return await future
+
+    def close_connection(self, conn, shards):
+        for shard in shards:
+            self._inboxes[shard].put(("close", conn))
+
+    def broadcast(self, kind):
+        # "refresh" (subjects changed) or "stats" (each worker prints its own)
+        for inbox in self._inboxes:
+            inbox.put((kind,))
+
+    def stop(self):
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for worker in self._workers:
+            worker.join()
+        if self._outbox is not None:
+            self._outbox.put(None)
+
+    def stats(self):
+        return {
+            "shards": self.num_shards,
+            "alive": sum(w.is_alive() for w in self._workers),
+            "sent": list(self.sent),
+            "in_flight": len(self._futures),
+            "failed": self.failed,
+        }
@@ -1,116 +1,27 @@
-from datetime import datetime, timedelta
-from supabase import create_client, Client
-from config import SUPABASE_URL, SUPABASE_KEY
-
-# Supabase setup
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+import math
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from ingest import insert_batch, insert_to_supabase, refresh_subjects, subject_cache
 
 # Global state
-previous_weight = 0.0
-previous_subject_id = -1
 gramsPerPill = -1
 
+# Batch API settings (POST /events:batch)
+BATCH_MAX_ITEMS = 10000  # readings per request
+BATCH_CHUNK = 1000  # readings scored and journaled together
+JOBS_KEPT = 1000  # finished jobs remembered for GET /jobs/<id>
+JOB_TTL = 3600  # seconds a finished job stays pollable
+JOBS_QUEUED = 50  # jobs waiting for the worker before POSTs get 503
+
 # Server setup
 HOST = "0.0.0.0"
 PORT = 5005
 
 
-def insert_to_supabase(grams):
-    global previous_weight, previous_subject_id
-
-    now = datetime.now()
-    event_date = now.strftime("%m/%d/%y")
-    event_time = now.strftime("%I:%M %p")
-
-    # Get latest subjectId
-    res = supabase.table("subjects").select("subjectId").order("subjectId", desc=True).limit(1).execute()
-    if not res.data:
-        print("No subjects found in database.")
-        return
-
-    subject_id = res.data[0]["subjectId"]
-    if subject_id != previous_subject_id:
-        print("New subjectId:", subject_id)
-        previous_subject_id = subject_id
-
-    # Get subject details
-    subj = supabase.table("subjects").select(
-        "pillWeight, prescription, dosingWindows, currAdherenceScore"
-    ).eq("subjectId", subject_id).execute()
-    subj_data = subj.data[0]
-
-    pill_weight = subj_data["pillWeight"]
-    prescription = subj_data["prescription"]  # JSON: should include "pillsPerDose" and "pillCount"
-    dosing_windows = subj_data["dosingWindows"]  # JSON with window labels & times
-
-    pills_per_dose = int(prescription.get("pillsPerDose", 1))
-    pill_count = int(prescription.get("pillCount", 0))
-
-    grams_per_pill = pill_weight if pill_weight else grams / max(1, pill_count)
-    gramsPerPill = grams_per_pill  # Update global reference value
-
-    # --- Anomaly detection ---
-    anomaly_id = "0"  # default = no anomaly
-
-    # Count pills taken
-    pills_taken = round((previous_weight - grams) / grams_per_pill) if grams_per_pill > 0 else 0
-    if pills_taken != pills_per_dose:
-        anomaly_id = "3"  # wrong count
-
-    # Timing anomaly check
-    event_dt = datetime.strptime(f"{event_date} {event_time}", "%m/%d/%y %I:%M %p")
-    in_any_window = False
-    WINDOW_MARGIN = timedelta(minutes=30)
-
-    if dosing_windows:
-        for label, t in dosing_windows.items():
-            sched_time = datetime.strptime(f"{event_date} {t}", "%m/%d/%y %H:%M")
-            if sched_time - WINDOW_MARGIN <= event_dt <= sched_time + WINDOW_MARGIN:
-                in_any_window = True
-                break
-
-        if not in_any_window:
-            nearest = min(
-                [datetime.strptime(f"{event_date} {t}", "%m/%d/%y %H:%M") for t in dosing_windows.values()],
-                key=lambda x: abs((x - event_dt).total_seconds()),
-            )
-            if event_dt < nearest:
-                anomaly_id = "1"  # too early
-            else:
-                anomaly_id = "2"  # too late
-
-    # --- Adherence score ---
-    events_today = supabase.table("events").select("anomalyId").eq("subjectId", subject_id).eq("date", event_date).execute()
-    total_events = len(events_today.data) + 1
-    bad_events = sum(1 for e in events_today.data if e["anomalyId"] != "0") + (1 if anomaly_id != "0" else 0)
-    adherence_score = str(int(100 * (1 - bad_events / total_events))) if total_events > 0 else "100"
-
-    # --- Update subject ---
-    supabase.table("subjects").update({
-        "currAdherenceScore": float(adherence_score),
-        "pillWeight": grams_per_pill
-    }).eq("subjectId", subject_id).execute()
-
-    # --- Save event ---
-    data = {
-        "subjectId": subject_id,
-        "date": event_date,
-        "time": event_time,
-        "grams": str(grams),
-        "anomalyId": anomaly_id,
-        "adherenceScore": adherence_score,
-        "pillCount": pill_count
-    }
-    response = supabase.table("events").insert(data).execute()
-    print("Inserted:", data)
-    print("Response:", response)
-
-    previous_weight = grams
-
-
-
-
-
 from flask import Flask, request, render_template_string, redirect, url_for
 
 app = Flask(__name__)
@@ -192,8 +103,189 @@ def submit():
     grams = float(request.form["grams"])
     print(f"[Web Input] Grams: {grams}")
     insert_to_supabase(grams)
+
+    # Update global reference value (subject row is cached, so this is free)
+    global gramsPerPill
+    subject_id = subject_cache.latest_subject_id()
+    subject = subject_cache.get(subject_id) if subject_id is not None else None
+    if subject is not None and subject.pill_weight:
+        gramsPerPill = subject.pill_weight
+
     # Redirect back to the main page after submission
     return redirect(url_for("index"))
 
+@app.route("/refresh", methods=["POST"])
+def refresh():
+    # Hook for when subjects are edited elsewhere; optional ?subjectId=N
+    subject_id = request.args.get("subjectId", type=int)
+    refresh_subjects(subject_id)
+    return {"refreshed": subject_id if subject_id is not None else "all"}
+
+@app.route("/cache", methods=["GET"])
+def cache_stats():
+    return subject_cache.stats()
+
+
+# --- Batch API for scripted WOZ sessions ---
+#
+#   POST /events:batch  [{"subjectId": 3, "timestamp": "2025-09-27T08:05:00", "grams": 41.2}, ...]
+#   -> 202 {"jobId": ..., "accepted": n, "invalid": [...]}
+#   GET /jobs/<jobId>   status plus one result per item, in request order
+#
+# Items are validated up front and the valid ones are queued for a single
+# background worker, which scores and journals them in chunks with the same
+# rules as /submit (ingest.insert_batch). One worker keeps each subject's
+# readings in order across jobs. timestamp is ISO 8601 local time or epoch
+# milliseconds. At most JOBS_QUEUED jobs wait for the worker (more get 503
+# with Retry-After), and finished jobs are forgotten after JOB_TTL seconds
+# or once more than JOBS_KEPT are remembered.
+
+jobs = OrderedDict()  # jobId -> job dict
+jobs_lock = threading.Lock()
+job_queue = queue.Queue(maxsize=JOBS_QUEUED)
+job_expiry = {}  # jobId -> monotonic time a finished job is forgotten
+batch_states = {}  # subjectId -> BottleState, previous weight across jobs
+
+
+def parse_item(item):
+    # (subjectId, datetime, grams) from one request item; raises ValueError
+    if not isinstance(item, dict):
+        raise ValueError("item must be an object")
+    subject_id, timestamp, grams = item.get("subjectId"), item.get("timestamp"), item.get("grams")
+    if isinstance(subject_id, bool) or not isinstance(subject_id, int):
+        raise ValueError("subjectId must be an integer")
+    if isinstance(grams, bool) or not isinstance(grams, (int, float)) or not math.isfinite(grams):
+        raise ValueError("grams must be a number")
+    if isinstance(timestamp, str):
+        ts = datetime.fromisoformat(timestamp)
+        if ts.tzinfo is not None:
+            ts = ts.astimezone().replace(tzinfo=None)  # dosing windows are local wall-clock times
+    elif isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        ts = datetime.fromtimestamp(timestamp / 1000)
+    else:
+        raise ValueError("timestamp must be an ISO 8601 string or epoch milliseconds")
+    return subject_id, ts, float(grams)
+
+
+def run_job(job):
+    # Results and counters are updated under jobs_lock, a chunk at a time, so
+    # job_status always sees processed == stored + failed for what it returns
+    items = job["items"]
+    for start in range(0, len(items), BATCH_CHUNK):
+        chunk = items[start:start + BATCH_CHUNK]
+        indexes, ids, times, weights = zip(*chunk)
+        try:
+            stored = insert_batch(list(ids), list(times), list(weights), batch_states)
+        except Exception as e:
+            stored, error = [None] * len(chunk), str(e)
+        else:
+            error = "unknown subjectId"
+        with jobs_lock:
+            for index, data in zip(indexes, stored):
+                if data is None:
+                    job["results"][index] = {"status": "error", "error": error}
+                    job["failed"] += 1
+                else:
+                    job["results"][index] = {"status": "ok", "anomalyId": data["anomalyId"],
+                                             "adherenceScore": data["adherenceScore"]}
+                    job["stored"] += 1
+            job["processed"] = start + len(chunk)
+
+
+def forget_jobs():
+    # Under jobs_lock: drop finished jobs past JOB_TTL, then the oldest
+    # finished ones beyond JOBS_KEPT; queued and running ones stay pollable
+    now = time.monotonic()
+    while job_expiry:
+        job_id, expires = next(iter(job_expiry.items()))  # finish order, so soonest first
+        if expires > now:
+            break
+        del job_expiry[job_id]
+        jobs.pop(job_id, None)
+    excess = len(jobs) - JOBS_KEPT
+    if excess > 0:
+        for job_id in [jid for jid in job_expiry if jid in jobs][:excess]:
+            del job_expiry[job_id]
+            del jobs[job_id]
+
+
+def batch_worker():
+    # Every key a job will have exists from the start (events_batch), and
+    # status changes happen under jobs_lock, so job_status never sees the
+    # dict change shape
+    while True:
+        job = job_queue.get()
+        with jobs_lock:
+            job["status"] = "running"
+            job["started"] = datetime.now().isoformat(timespec="milliseconds")
+        status, error = "done", None
+        try:
+            run_job(job)
+        except Exception as e:
+            status, error = "failed", str(e)
+        with jobs_lock:
+            job["status"], job["error"] = status, error
+            job["finished"] = datetime.now().isoformat(timespec="milliseconds")
+            job["items"] = None
+            job_expiry[job["jobId"]] = time.monotonic() + JOB_TTL
+
+
+threading.Thread(target=batch_worker, name="batch-worker", daemon=True).start()
+
+
+@app.route("/events:batch", methods=["POST"])
+def events_batch():
+    items = request.get_json(silent=True)
+    if isinstance(items, dict):
+        items = items.get("events")
+    if not isinstance(items, list):
+        return {"error": "expected a JSON array of {subjectId, timestamp, grams}"}, 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return {"error": f"at most {BATCH_MAX_ITEMS} items per request"}, 413
+
+    results = [None] * len(items)
+    valid, invalid = [], []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, *parse_item(item)))
+        except (ValueError, TypeError) as e:
+            results[index] = {"status": "invalid", "error": str(e)}
+            invalid.append({"index": index, "error": str(e)})
+    if not valid:
+        return {"error": "no valid items", "invalid": invalid}, 400
+
+    job_id = uuid.uuid4().hex
+    job = {
+        "jobId": job_id, "status": "queued", "received": len(items), "accepted": len(valid),
+        "processed": 0, "stored": 0, "failed": 0, "results": results, "items": valid,
+        "created": datetime.now().isoformat(timespec="milliseconds"),
+        "started": None, "finished": None, "error": None,
+    }
+    with jobs_lock:
+        try:
+            job_queue.put_nowait(job)
+        except queue.Full:
+            return {"error": f"{JOBS_QUEUED} jobs already queued; retry later"}, 503, {"Retry-After": "5"}
+        jobs[job_id] = job
+        forget_jobs()
+    body = {"jobId": job_id, "status": job["status"], "accepted": len(valid), "invalid": invalid}
+    return body, 202, {"Location": url_for("job_status", job_id=job_id)}
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    # ?results=0 leaves out the per-item results (for polling)
+    with jobs_lock:
+        forget_jobs()
+        job = jobs.get(job_id)
+        if job is None:
+            return {"error": "unknown job"}, 404
+        body = {key: value for key, value in job.items() if key != "items"}
+        if request.args.get("results") == "0":
+            del body["results"]
+        else:
+            body["results"] = list(body["results"])  # the worker keeps filling it in
+    return body
+
 if __name__ == "__main__":
     app.run(port=5000)
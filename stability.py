@@ -0,0 +1,172 @@
+# Server-side stability detection for bottles that stream raw samples.
+#
+# The firmware reports a weight when the stddev of its last 5 samples drops
+# below a fixed 0.1 g, so every shake is a new reading and changing the rule
+# means reflashing. In raw mode bottles send batches of 100 Hz samples as
+#
+#   raw:12.301,12.299,12.304,...
+#
+# and the server finds the settled weights itself. Per connection the
+# detector keeps a preallocated ring buffer of the last WINDOW samples and
+# running sums over it, so each batch costs O(batch + WINDOW) NumPy work:
+# rolling mean/stddev for every sample come from cumulative sums of
+# (incoming - outgoing) samples. States:
+#
+#   settled --(sd > ENTER_SD, or mean moved MIN_CHANGE)--> moving
+#   moving --(sd < EXIT_SD for SETTLE_SAMPLES)--> settled
+#
+# ENTER_SD > EXIT_SD gives hysteresis: noise between the two thresholds
+# doesn't flip the state, and the mean check catches pills slid out gently
+# enough to stay under ENTER_SD. While settled the weight follows the mean,
+# so slow drift never looks like a dose. On each moving -> settled
+# transition the window mean is the new weight. It is emitted unless it is
+# within MIN_CHANGE of the previous weight (a knock or wobble), or below
+# OFF_SCALE_GRAMS (the bottle is in someone's hand, not on the scale).
+
+import math
+import numpy as np
+
+SAMPLE_HZ = 100
+WINDOW = 25  # samples in the rolling mean/stddev (0.25 s)
+ENTER_SD = 0.5  # grams; above this the bottle is moving
+EXIT_SD = 0.1  # grams; below this (for SETTLE_SAMPLES) it has settled
+SETTLE_SAMPLES = 50  # 0.5 s of quiet before a weight counts
+MIN_CHANGE = 0.1  # grams; smaller moves are not a new weight
+OFF_SCALE_GRAMS = 0.5  # settled below this = bottle lifted off
+
+RAW_PREFIX = b"raw:"
+
+
+def parse_samples(line):
+    # Samples from a "raw:v1,v2,..." line (bytes); None if it isn't one or is
+    # malformed. nan/inf parse as floats but would poison the running sums
+    # for good, so they make the line malformed too.
+    if not line.startswith(RAW_PREFIX):
+        return None
+    try:
+        samples = np.array(line[len(RAW_PREFIX):].split(b","), dtype=np.float64)
+    except ValueError:
+        return None
+    return samples if np.isfinite(samples).all() else None
+
+
+class StabilityDetector:
+    def __init__(self, window=WINDOW, enter_sd=ENTER_SD, exit_sd=EXIT_SD, settle=SETTLE_SAMPLES,
+                 min_change=MIN_CHANGE, off_scale=OFF_SCALE_GRAMS):
+        if int(window) != window or window < 2:
+            raise ValueError(f"window must be a whole number of samples >= 2, got {window!r}")
+        if not (math.isfinite(enter_sd) and math.isfinite(exit_sd) and enter_sd >= exit_sd > 0):
+            raise ValueError(f"need enter_sd >= exit_sd > 0, got enter_sd={enter_sd!r} exit_sd={exit_sd!r}")
+        if settle < 1:
+            raise ValueError(f"settle must be at least 1 sample, got {settle!r}")
+        self.window = window
+        self.enter_sd = enter_sd
+        self.exit_sd = exit_sd
+        self.settle = settle
+        self.min_change = min_change
+        self.off_scale = off_scale
+
+        self.ring = np.zeros(window)  # last `window` samples; ring[pos] is the oldest
+        self.pos = 0
+        self.primed = False
+        self.moving = False
+        self.lifted = False  # settled off the scale
+        self.quiet_run = 0  # consecutive samples with sd < exit_sd
+        self.moving_since = 0  # sample number where the current movement started
+        self.weight = None  # settled weight on the scale
+
+        self.samples = 0
+        self.transitions = 0  # moving -> settled
+        self.emitted = 0
+
+    def feed(self, samples):
+        # Push a batch of samples; returns [(sample number, weight), ...] for
+        # each new settled weight in the batch
+        x = np.asarray(samples, dtype=np.float64)
+        k = len(x)
+        if not k:
+            return []
+        w = self.window
+        if not self.primed:
+            # Start as if the first sample had been there for a whole window
+            self.ring[:] = x[0]
+            self.weight = float(x[0])
+            self.lifted = self.weight < self.off_scale
+            self.primed = True
+
+        # Samples leaving the window as each new one enters
+        outgoing = self.ring.take(np.arange(self.pos, self.pos + min(k, w)), mode="wrap")
+        if k > w:
+            outgoing = np.concatenate([outgoing, x[:k - w]])
+
+        # Rolling sums relative to a reference near the data, so the
+        # variance doesn't lose precision to large absolute weights
+        ref = self.ring[self.pos - 1]
+        ring = self.ring - ref
+        s1 = ring.sum() + np.cumsum((x - ref) - (outgoing - ref))
+        s2 = (ring * ring).sum() + np.cumsum((x - ref) ** 2 - (outgoing - ref) ** 2)
+        mean = s1 / w
+        sd = np.sqrt(np.maximum(s2 / w - mean * mean, 0.0))
+        mean += ref
+
+        # Keep the newest `window` samples in the ring
+        tail = x[-w:]
+        self.ring.put(np.arange(self.pos + k - len(tail), self.pos + k), tail, mode="wrap")
+        self.pos = (self.pos + k) % w
+
+        # Length of the quiet run ending at each sample (carried across batches)
+        quiet = sd < self.exit_sd
+        idx = np.arange(k)
+        last_loud = np.maximum.accumulate(np.where(quiet, -1, idx))
+        run = np.where(last_loud < 0, idx + 1 + self.quiet_run, idx - last_loud)
+        self.quiet_run = int(run[-1])
+
+        events = []
+        i = 0
+        while i < k:
+            if not self.moving:
+                loud = sd[i:] > self.enter_sd
+                if self.lifted:
+                    loud |= mean[i:] >= self.off_scale
+                elif self.min_change > 0:
+                    loud |= np.abs(mean[i:] - self.weight) >= self.min_change
+                loud = np.flatnonzero(loud)
+                if not len(loud):
+                    # Still settled: follow slow drift
+                    if not self.lifted:
+                        self.weight = float(mean[-1])
+                    break
+                self.moving = True
+                i += int(loud[0])
+                self.moving_since = self.samples + i
+            else:
+                # Quiet for `settle` samples, all of them after the movement
+                # started (a gentle slide can start it with sd already low)
+                since = self.samples + idx[i:] - self.moving_since
+                settled = np.flatnonzero((run[i:] >= self.settle) & (since >= self.settle))
+                if not len(settled):
+                    break
+                self.moving = False
+                i += int(settled[0])
+                self.transitions += 1
+                weight = float(mean[i])
+                self.lifted = weight < self.off_scale
+                if not self.lifted:
+                    if abs(weight - self.weight) >= self.min_change:
+                        events.append((self.samples + i, weight))
+                        self.emitted += 1
+                    self.weight = weight
+            i += 1
+
+        self.samples += k
+        return events
+
+    def stats(self):
+        return {
+            "samples": self.samples,
+            "moving": self.moving,
+            "lifted": self.lifted,
+            "weight": self.weight,
+            "transitions": self.transitions,
+            "emitted": self.emitted,
+        }
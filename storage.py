@@ -0,0 +1,312 @@
+# Storage backends for the ingest pipeline.
+#
+# Both implement exactly what ingest.py needs from the database:
+#   latest_subject_id()                      newest subjectId, or None
+#   get_subject(subject_id)                  subjects row as a dict, or None
+#   day_anomalies(subject_id, event_date)    anomalyIds already stored for that day
+#   update_subject(subject_id, fields)       update columns on one subject
+#   insert_events(rows)                      bulk insert into events
+#   bottle_routes()                          {bottleId: subjectId} for subjects with a bottle
+#   upsert_devices(rows)                     insert/update `devices` rows by deviceId (presence.py)
+#   delete_devices(device_ids)               delete forgotten `devices` rows (presence.py)
+#
+# plus what backfill.py needs to re-score history:
+#   subject_ids()                            every subjectId
+#   events_page(subject_id, after_id, limit) events with id > after_id, by id
+#   update_events(ids, fields)               set the same columns on many events
+#
+# and what rollups.py needs to keep the dashboard aggregates:
+#   events_after(after_id, limit)            events of every subject with id > after_id, by id
+#   subject_scores()                         name + currAdherenceScore of every subject
+#   upsert_rollups(rows)                     insert/update `rollups` rows by key
+#   get_rollups(keys)                        `rollups` rows with those keys
+#   recent_rollups(since)                    day/week `rollups` rows with period >= since
+#
+# Pick one with STORAGE_BACKEND = "supabase" | "sqlite" in config.py
+# (SQLITE_PATH sets the database file, default dose.db).
+
+import json
+import sqlite3
+import threading
+
+SUBJECT_COLUMNS = "pillWeight, prescription, dosingWindows, currAdherenceScore"
+EVENT_COLUMNS = "id, date, time, grams, anomalyId, adherenceScore"
+TAIL_COLUMNS = "id, subjectId, date, anomalyId, adherenceScore"
+SCORE_COLUMNS = "subjectId, firstName, lastName, currAdherenceScore"
+ROLLUP_COLUMNS = "key, kind, subjectId, period, data, updatedAt"
+
+
+class SupabaseStorage:
+    def __init__(self, url, key):
+        from supabase import create_client
+        self.client = create_client(url, key)
+
+    def latest_subject_id(self):
+        res = self.client.table("subjects").select("subjectId").order("subjectId", desc=True).limit(1).execute()
+        return res.data[0]["subjectId"] if res.data else None
+
+    def get_subject(self, subject_id):
+        res = self.client.table("subjects").select(SUBJECT_COLUMNS).eq("subjectId", subject_id).execute()
+        return res.data[0] if res.data else None
+
+    def day_anomalies(self, subject_id, event_date):
+        res = self.client.table("events").select("anomalyId").eq("subjectId", subject_id).eq("date", event_date).execute()
+        return [e["anomalyId"] for e in res.data]
+
+    def update_subject(self, subject_id, fields):
+        self.client.table("subjects").update(fields).eq("subjectId", subject_id).execute()
+
+    def insert_events(self, rows):
+        self.client.table("events").insert(rows).execute()
+
+    def upsert_devices(self, rows):
+        self.client.table("devices").upsert(rows, on_conflict="deviceId").execute()
+
+    def delete_devices(self, device_ids):
+        self.client.table("devices").delete().in_("deviceId", list(device_ids)).execute()
+
+    def bottle_routes(self):
+        # Ordered by subjectId, so a reassigned bottle routes to its newest subject
+        res = (self.client.table("subjects").select("subjectId, bottleId").not_.is_("bottleId", "null")
+               .order("subjectId").execute())
+        return {r["bottleId"]: r["subjectId"] for r in res.data}
+
+    def subject_ids(self):
+        res = self.client.table("subjects").select("subjectId").order("subjectId").execute()
+        return [r["subjectId"] for r in res.data]
+
+    def events_page(self, subject_id, after_id, limit):
+        res = (self.client.table("events").select(EVENT_COLUMNS).eq("subjectId", subject_id)
+               .gt("id", after_id).order("id").limit(limit).execute())
+        return res.data
+
+    def update_events(self, ids, fields):
+        self.client.table("events").update(fields).in_("id", ids).execute()
+
+    def events_after(self, after_id, limit):
+        res = self.client.table("events").select(TAIL_COLUMNS).gt("id", after_id).order("id").limit(limit).execute()
+        return res.data
+
+    def subject_scores(self):
+        res = self.client.table("subjects").select(SCORE_COLUMNS).order("subjectId").execute()
+        return res.data
+
+    def upsert_rollups(self, rows):
+        self.client.table("rollups").upsert(rows, on_conflict="key").execute()
+
+    def get_rollups(self, keys):
+        res = self.client.table("rollups").select(ROLLUP_COLUMNS).in_("key", keys).execute()
+        return res.data
+
+    def recent_rollups(self, since):
+        res = (self.client.table("rollups").select(ROLLUP_COLUMNS).in_("kind", ["day", "week"])
+               .gte("period", since).execute())
+        return res.data
+
+
+class SQLiteStorage:
+    # Local stand-in for the Supabase tables, same column names. JSON columns
+    # (prescription, dosingWindows) are stored as text and decoded on read.
+    def __init__(self, path="dose.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS subjects (
+                subjectId INTEGER PRIMARY KEY,
+                firstName TEXT,
+                lastName TEXT,
+                pillWeight REAL,
+                prescription TEXT,
+                dosingWindows TEXT,
+                currAdherenceScore REAL,
+                bottleId TEXT
+            );
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                subjectId INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                time TEXT,
+                grams TEXT,
+                anomalyId TEXT,
+                adherenceScore TEXT,
+                pillCount INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS events_subject_date ON events (subjectId, date);
+            CREATE TABLE IF NOT EXISTS devices (
+                deviceId TEXT PRIMARY KEY,
+                online INTEGER,
+                lastSeen TEXT
+            );
+            CREATE TABLE IF NOT EXISTS rollups (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                subjectId INTEGER,
+                period TEXT,
+                data TEXT,
+                updatedAt TEXT
+            );
+            CREATE INDEX IF NOT EXISTS rollups_kind_period ON rollups (kind, period);
+        """)
+        # Databases created before bottle routing
+        columns = [r[1] for r in self._db.execute("PRAGMA table_info(subjects)")]
+        if "bottleId" not in columns:
+            self._db.execute("ALTER TABLE subjects ADD COLUMN bottleId TEXT")
+        self._db.commit()
+
+    def add_subject(self, row):
+        # Seeding helper (dashboard inserts subjects in production)
+        row = dict(row)
+        for key in ("prescription", "dosingWindows"):
+            if key in row and not isinstance(row[key], str):
+                row[key] = json.dumps(row[key])
+        cols = ", ".join(row)
+        marks = ", ".join("?" for _ in row)
+        with self._lock:
+            cur = self._db.execute(f"INSERT INTO subjects ({cols}) VALUES ({marks})", list(row.values()))
+            self._db.commit()
+            return cur.lastrowid
+
+    def latest_subject_id(self):
+        with self._lock:
+            row = self._db.execute("SELECT MAX(subjectId) FROM subjects").fetchone()
+        return row[0]
+
+    def get_subject(self, subject_id):
+        with self._lock:
+            row = self._db.execute(f"SELECT {SUBJECT_COLUMNS} FROM subjects WHERE subjectId = ?", (subject_id,)).fetchone()
+        if row is None:
+            return None
+        row = dict(row)
+        for key in ("prescription", "dosingWindows"):
+            if isinstance(row[key], str):
+                row[key] = json.loads(row[key])
+        return row
+
+    def day_anomalies(self, subject_id, event_date):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT anomalyId FROM events WHERE subjectId = ? AND date = ?", (subject_id, event_date)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def update_subject(self, subject_id, fields):
+        sets = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            self._db.execute(f"UPDATE subjects SET {sets} WHERE subjectId = ?", [*fields.values(), subject_id])
+            self._db.commit()
+
+    def insert_events(self, rows):
+        if not rows:
+            return
+        cols = list(rows[0])
+        sql = f"INSERT INTO events ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)})"
+        with self._lock:
+            self._db.executemany(sql, [[r[c] for c in cols] for r in rows])
+            self._db.commit()
+
+    def upsert_devices(self, rows):
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO devices (deviceId, online, lastSeen) VALUES (?, ?, ?) "
+                "ON CONFLICT (deviceId) DO UPDATE SET online = excluded.online, lastSeen = excluded.lastSeen",
+                [(r["deviceId"], int(r["online"]), r["lastSeen"]) for r in rows],
+            )
+            self._db.commit()
+
+    def delete_devices(self, device_ids):
+        with self._lock:
+            self._db.executemany("DELETE FROM devices WHERE deviceId = ?", [(d,) for d in device_ids])
+            self._db.commit()
+
+    def bottle_routes(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT bottleId, subjectId FROM subjects WHERE bottleId IS NOT NULL ORDER BY subjectId"
+            ).fetchall()
+        return {r[0]: r[1] for r in rows}
+
+    def subject_ids(self):
+        with self._lock:
+            rows = self._db.execute("SELECT subjectId FROM subjects ORDER BY subjectId").fetchall()
+        return [r[0] for r in rows]
+
+    def events_page(self, subject_id, after_id, limit):
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {EVENT_COLUMNS} FROM events WHERE subjectId = ? AND id > ? ORDER BY id LIMIT ?",
+                (subject_id, after_id, limit),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def update_events(self, ids, fields):
+        sets = ", ".join(f"{k} = ?" for k in fields)
+        marks = ", ".join("?" for _ in ids)
+        with self._lock:
+            self._db.execute(f"UPDATE events SET {sets} WHERE id IN ({marks})", [*fields.values(), *ids])
+            self._db.commit()
+
+    def events_after(self, after_id, limit):
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {TAIL_COLUMNS} FROM events WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def subject_scores(self):
+        with self._lock:
+            rows = self._db.execute(f"SELECT {SCORE_COLUMNS} FROM subjects ORDER BY subjectId").fetchall()
+        return [dict(r) for r in rows]
+
+    def upsert_rollups(self, rows):
+        if not rows:
+            return
+        with self._lock:
+            self._db.executemany(
+                f"INSERT INTO rollups ({ROLLUP_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET data = excluded.data, updatedAt = excluded.updatedAt",
+                [(r["key"], r["kind"], r["subjectId"], r["period"], json.dumps(r["data"]), r["updatedAt"])
+                 for r in rows],
+            )
+            self._db.commit()
+
+    def _rollup_rows(self, where, params):
+        with self._lock:
+            rows = self._db.execute(f"SELECT {ROLLUP_COLUMNS} FROM rollups WHERE {where}", params).fetchall()
+        return [{**dict(r), "data": json.loads(r["data"])} for r in rows]
+
+    def get_rollups(self, keys):
+        if not keys:
+            return []
+        return self._rollup_rows(f"key IN ({', '.join('?' for _ in keys)})", list(keys))
+
+    def recent_rollups(self, since):
+        return self._rollup_rows("kind IN ('day', 'week') AND period >= ?", (since,))
+
+
+_storage = None
+
+
+def set_storage(storage):
+    # Override the configured backend (benchmarks, load tests); call before importing ingest
+    global _storage
+    _storage = storage
+
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        import config
+        backend = getattr(config, "STORAGE_BACKEND", "supabase")
+        if backend == "sqlite":
+            _storage = SQLiteStorage(getattr(config, "SQLITE_PATH", "dose.db"))
+        elif backend == "supabase":
+            _storage = SupabaseStorage(config.SUPABASE_URL, config.SUPABASE_KEY)
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {backend!r}")
+    return _storage
@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from dosing_windows import DosingWindowIndex
+
+# Cache settings
+SUBJECT_CACHE_SIZE = 1024  # subjects kept in memory (LRU beyond that)
+SUBJECT_CACHE_TTL = 300  # seconds before a subject row is re-read
+LATEST_SUBJECT_TTL = 5  # seconds before "latest subjectId" is re-read
+
+
+class SubjectInfo:
+    # Parsed view of a `subjects` row: everything insert_to_supabase needs
+    def __init__(self, subject_id, row):
+        prescription = row.get("prescription") or {}
+        if isinstance(prescription, str):
+            prescription = json.loads(prescription)
+        dosing_windows = row.get("dosingWindows") or {}
+        if isinstance(dosing_windows, str):
+            dosing_windows = json.loads(dosing_windows)
+
+        self.subject_id = subject_id
+        self.pill_weight = row.get("pillWeight")
+        self.prescription = prescription
+        self.dosing_windows = dosing_windows
+        self.window_index = DosingWindowIndex(dosing_windows)  # compiled once per cached row
+        self.adherence_score = row.get("currAdherenceScore")
+        self.pills_per_dose = int(prescription.get("pillsPerDose", 1))
+        self.pill_count = int(prescription.get("pillCount", 0))
+
+
+class SubjectCache:
+    # Bounded LRU of SubjectInfo keyed by subjectId, with a TTL per entry.
+    #
+    # `load_subject(subject_id)` returns the raw row (or None) and
+    # `load_latest_id()` returns the newest subjectId (or None). Both are only
+    # called on a miss. Writes we make ourselves go through `update()` so the
+    # cached row never goes stale; changes made elsewhere (dashboard, SQL)
+    # need `invalidate()` / `refresh()`.
+    def __init__(self, load_subject, load_latest_id, max_size=SUBJECT_CACHE_SIZE,
+                 ttl=SUBJECT_CACHE_TTL, latest_ttl=LATEST_SUBJECT_TTL, clock=time.monotonic):
+        self.load_subject = load_subject
+        self.load_latest_id = load_latest_id
+        self.max_size = max_size
+        self.ttl = ttl
+        self.latest_ttl = latest_ttl
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # subject_id -> (expires_at, SubjectInfo)
+        self._latest = None  # (expires_at, subject_id)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def latest_subject_id(self):
+        now = self.clock()
+        with self._lock:
+            if self._latest is not None and self._latest[0] > now:
+                self.hits += 1
+                return self._latest[1]
+            self.misses += 1
+
+        subject_id = self.load_latest_id()
+        if subject_id is not None:
+            with self._lock:
+                self._latest = (now + self.latest_ttl, subject_id)
+        return subject_id
+
+    def get(self, subject_id):
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(subject_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(subject_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        row = self.load_subject(subject_id)
+        if row is None:
+            return None
+        info = SubjectInfo(subject_id, row)
+        self._store(subject_id, info, now)
+        return info
+
+    def _store(self, subject_id, info, now):
+        with self._lock:
+            self._entries[subject_id] = (now + self.ttl, info)
+            self._entries.move_to_end(subject_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def update(self, subject_id, pill_weight=None, adherence_score=None):
+        # Write-through for the columns insert_to_supabase writes itself
+        with self._lock:
+            entry = self._entries.get(subject_id)
+            if entry is None:
+                return
+            info = entry[1]
+            if pill_weight is not None:
+                info.pill_weight = pill_weight
+            if adherence_score is not None:
+                info.adherence_score = adherence_score
+
+    def invalidate(self, subject_id=None):
+        # Drop one subject (or everything) so the next event re-reads it
+        with self._lock:
+            self.invalidations += 1
+            self._latest = None
+            if subject_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(subject_id, None)
+
+    def refresh(self, subject_id):
+        # Explicit refresh hook: reload a subject row right away
+        self.invalidate(subject_id)
+        return self.get(subject_id)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
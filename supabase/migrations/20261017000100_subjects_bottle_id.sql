@@ -0,0 +1,8 @@
+-- Bottle -> subject routing (backend.py / routing.py).
+-- Each bottle sends "id:<bottleId>" after connecting; readings go to the
+-- subject with that bottleId (the newest one if a bottle was reassigned).
+-- Bottles with no subject yet fall back to the latest subject.
+
+alter table public.subjects add column if not exists "bottleId" text;
+
+create index if not exists subjects_bottle_id on public.subjects ("bottleId");
@@ -0,0 +1,10 @@
+-- Bottle presence (presence.py): one row per bottle, upserted in batches by
+-- backend.py --async as bottles go online/offline, and deleted once a bottle
+-- has been offline for --device-retention (default a day). deviceId is the
+-- bottle's handshake id, or its IP for bottles that don't send one.
+
+create table if not exists public.devices (
+  "deviceId" text primary key,
+  online boolean not null default false,
+  "lastSeen" timestamptz
+);
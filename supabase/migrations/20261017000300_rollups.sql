@@ -0,0 +1,35 @@
+-- Dashboard aggregates (rollups.py), read by AggregateView.tsx.
+-- rollups.py upserts rows by key; the dashboard reads the histogram and
+-- cohort rows and follows changes to them over realtime.
+--
+--   day:<subjectId>:<YYYY-MM-DD>    one subject's day
+--   week:<subjectId>:<YYYY-MM-DD>   one subject's week (starting Monday)
+--   histogram:<range>               subjects per adherence range
+--   cohort:all                      cohort totals
+--   meta:tail                       last event id folded in
+
+create table if not exists public.rollups (
+  key text primary key,
+  kind text not null,
+  "subjectId" bigint,
+  period text,
+  data jsonb not null default '{}'::jsonb,
+  "updatedAt" timestamptz not null default now(),
+  constraint rollups_kind check (kind in ('day', 'week', 'histogram', 'cohort', 'meta')),
+  constraint rollups_key_kind check (key like kind || ':%'),
+  constraint rollups_subject check ((kind in ('day', 'week')) = ("subjectId" is not null))
+);
+
+create index if not exists rollups_kind_period on public.rollups (kind, period);
+
+-- Realtime (postgres_changes) only sees tables in this publication
+do $$
+begin
+  if not exists (
+    select 1 from pg_publication_tables
+    where pubname = 'supabase_realtime' and schemaname = 'public' and tablename = 'rollups'
+  ) then
+    alter publication supabase_realtime add table public.rollups;
+  end if;
+end
+$$;
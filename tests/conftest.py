@@ -0,0 +1,37 @@
+# Tests run against a throwaway SQLite database and journal, set up before
+# anything imports ingest (which opens both at import time).
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORKDIR = tempfile.mkdtemp(prefix="dose-tests-")
+os.environ["DOSE_JOURNAL_PATH"] = os.path.join(WORKDIR, "journal.db")
+
+import storage  # noqa: E402
+
+storage.set_storage(storage.SQLiteStorage(os.path.join(WORKDIR, "dose.db")))
+
+WINDOWS = {"window_1": "08:00", "window_2": "20:00"}
+
+
+@pytest.fixture
+def db():
+    return storage.get_storage()
+
+
+@pytest.fixture
+def add_subject(db):
+    # add_subject(**columns) -> subjectId, with a 1-pill twice-daily prescription by default
+    def add(**columns):
+        row = {"firstName": "Test", "lastName": "Subject", "pillWeight": 0.5,
+               "prescription": {"pillCount": 30, "pillsPerDose": 1}, "dosingWindows": WINDOWS,
+               "currAdherenceScore": 100}
+        row.update(columns)
+        return db.add_subject(row)
+    return add
@@ -0,0 +1,27 @@
+import random
+
+from adherence import AdherenceTracker, adherence_score, count_day
+
+
+def test_counters_match_a_full_recount_and_roll_over_by_day():
+    stored = {}  # (subject, day) -> anomalyIds
+    tracker = AdherenceTracker(lambda s, d: list(stored.get((s, d), [])))
+    stored[(1, "10/16/26")] = ["0", "3"]  # already in the table before the tracker saw subject 1
+    rng = random.Random(3)
+    for day in ("10/16/26", "10/17/26"):
+        for _ in range(50):
+            subject, anomaly = rng.choice([1, 2]), rng.choice(["0", "0", "1", "3"])
+            score = tracker.record(subject, day, anomaly)
+            stored.setdefault((subject, day), []).append(anomaly)
+            assert score == adherence_score(*count_day(stored[(subject, day)]))
+    assert tracker.stats()["rollovers"] == 2
+    assert tracker.stats()["warms"] == 4
+
+
+def test_verify_mode_repairs_drifted_counters():
+    stored = ["0", "0"]
+    tracker = AdherenceTracker(lambda s, d: list(stored), verify=True)
+    assert tracker.record(1, "10/17/26", "0") == "100"
+    stored += ["0", "3", "3"]  # written by someone else since
+    assert tracker.record(1, "10/17/26", "0") == adherence_score(6, 2)
+    assert tracker.stats()["mismatches"] == 1
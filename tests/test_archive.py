@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+import storage
+from archive import EventArchive, compact, snapshot
+from conftest import WINDOWS
+
+
+@pytest.fixture
+def events_db(tmp_path):
+    db = storage.SQLiteStorage(str(tmp_path / "events.db"))
+    for _ in range(3):
+        db.add_subject({"firstName": "A", "lastName": "B", "pillWeight": 0.5, "dosingWindows": WINDOWS,
+                        "prescription": {"pillCount": 30, "pillsPerDose": 1}, "currAdherenceScore": 100})
+    return db
+
+
+def add_events(db, per_subject, day="10/17/26"):
+    db.insert_events([{"subjectId": sid, "date": day, "time": f"{1 + i % 12:02d}:00 AM", "grams": str(30.0 - i),
+                       "anomalyId": str(i % 4), "adherenceScore": "100", "pillCount": 30}
+                      for sid in db.subject_ids() for i in range(per_subject)])
+
+
+def test_snapshot_writes_bounded_segments_and_only_new_events(events_db, tmp_path):
+    path = str(tmp_path / "archive")
+    add_events(events_db, 7)
+    assert snapshot(path, events_db, page_size=3, segment_rows=5) == 21
+    archive = EventArchive(path)
+    assert len(archive.segments) > 1
+    assert max(len(seg["id"]) for seg in archive.segments) < 5 + 3  # at most one page past the bound
+    assert sorted(archive.scan()["id"].tolist()) == list(range(1, 22))
+
+    add_events(events_db, 2, day="10/18/26")
+    assert snapshot(path, events_db, page_size=3, segment_rows=5) == 6
+    assert compact(path) == 27
+    assert sorted(EventArchive(path).scan()["id"].tolist()) == list(range(1, 28))
+    assert len(EventArchive(path).subject(2)["id"]) == 9
+
+
+def test_interrupted_snapshot_resumes_without_duplicates(events_db, tmp_path, monkeypatch):
+    path = str(tmp_path / "archive")
+    add_events(events_db, 7)
+    pages = {"left": 4}
+    events_page = events_db.events_page
+
+    def failing_page(*args):
+        if pages["left"] == 0:
+            raise ConnectionError("database went away")
+        pages["left"] -= 1
+        return events_page(*args)
+
+    monkeypatch.setattr(events_db, "events_page", failing_page)
+    with pytest.raises(ConnectionError):
+        snapshot(path, events_db, page_size=3, segment_rows=5)
+    partial = EventArchive(path).rows
+    assert 0 < partial < 21
+
+    monkeypatch.setattr(events_db, "events_page", events_page)
+    assert snapshot(path, events_db, page_size=3, segment_rows=5) == 21 - partial
+    ids = EventArchive(path).scan()["id"]
+    assert len(ids) == len(np.unique(ids)) == 21
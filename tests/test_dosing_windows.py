@@ -0,0 +1,46 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from batch_classify import classify_batch
+from dosing_windows import DosingWindowIndex, to_minutes
+from subject_cache import SubjectInfo
+
+
+def batch_timing(dosing_windows, hhmm):
+    # anomalyId the live path (classify_batch) gives a reading at hhmm
+    subject = SubjectInfo(1, {"pillWeight": 1.0, "dosingWindows": dosing_windows,
+                              "prescription": {"pillCount": 30, "pillsPerDose": 1}})
+    when = datetime.strptime(f"2026-10-17 {hhmm}", "%Y-%m-%d %H:%M")
+    scored = classify_batch([1], [when], [29.0], {1: subject}, previous_weight=30.0)
+    return str(int(scored["anomaly_id"][0]))
+
+
+@pytest.mark.parametrize("windows, hhmm, expected", [
+    ({"night": "00:10"}, "23:00", "1"),  # 70 min before tomorrow's dose, not 22 h 50 m late
+    ({"night": "23:50"}, "01:00", "2"),  # 70 min after yesterday's dose
+    ({"night": "00:10"}, "23:50", "0"),  # the margin reaches across midnight
+    ({"morning": "08:00", "evening": "22:00"}, "23:30", "2"),
+    ({"morning": "08:00", "evening": "22:00"}, "03:30", "1"),
+    ({"morning": "08:00", "evening": "20:00"}, "14:00", "2"),  # tie: the window listed first wins
+    ({"evening": "20:00", "morning": "08:00"}, "14:00", "1"),
+    ({"morning": "08:00"}, "20:00", "2"),  # single window, exactly half a day either way
+])
+def test_early_and_late_across_midnight(windows, hhmm, expected):
+    assert DosingWindowIndex(windows).classify(to_minutes(hhmm)) == expected
+    assert batch_timing(windows, hhmm) == expected
+
+
+def test_index_and_batch_agree_on_every_minute():
+    rng = np.random.default_rng(6)
+    for _ in range(20):
+        windows = {f"w{j}": f"{rng.integers(24):02d}:{rng.integers(60):02d}" for j in range(rng.integers(1, 4))}
+        index = DosingWindowIndex(windows)
+        subject = SubjectInfo(1, {"pillWeight": 1.0, "dosingWindows": windows,
+                                  "prescription": {"pillCount": 30, "pillsPerDose": 1}})
+        minutes = np.arange(0, 24 * 60, 7)
+        times = np.datetime64("2026-10-17T00:00") + minutes.astype("timedelta64[m]")
+        grams = 300.0 - np.arange(1, len(minutes) + 1)  # one pill per reading: any anomaly is timing
+        scored = classify_batch(np.ones(len(minutes)), times, grams, {1: subject}, previous_weight=300.0)
+        assert [index.classify(int(m)) for m in minutes] == [str(a) for a in scored["anomaly_id"]]
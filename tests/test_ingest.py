@@ -0,0 +1,25 @@
+from datetime import datetime, timedelta
+
+import ingest
+from adherence import adherence_score, count_day
+from ingest import BottleState, insert_to_supabase
+
+
+def test_readings_are_scored_journaled_and_flushed(add_subject, db):
+    subject = add_subject(pillWeight=1.0)
+    state = BottleState(("10.0.0.9", 1))
+    start = datetime(2026, 10, 17, 7, 50)
+    readings = [(0, 30.0), (5, 29.0), (300, 28.0), (725, 26.0)]  # 07:50, 07:55, 12:50 (early), 19:55 (2 pills)
+    stored = [insert_to_supabase(grams, state, now=start + timedelta(minutes=m), subject_id=subject)
+              for m, grams in readings]
+    assert [d["anomalyId"] for d in stored] == ["3", "0", "2", "3"]
+
+    ingest.writer.flush()
+    anomalies = db.day_anomalies(subject, "10/17/26")
+    assert sorted(anomalies) == ["0", "2", "3", "3"]
+    assert stored[-1]["adherenceScore"] == adherence_score(*count_day(anomalies))
+    assert db.get_subject(subject)["currAdherenceScore"] == float(stored[-1]["adherenceScore"])
+
+
+def test_unknown_subject_is_not_stored(db):
+    assert insert_to_supabase(10.0, BottleState(("10.0.0.9", 2)), subject_id=10 ** 6) is None
@@ -0,0 +1,84 @@
+from backend import device_id
+from ingest import BottleState
+from presence import PresenceTracker
+
+
+class Table:
+    # In-memory `devices` table
+    def __init__(self):
+        self.rows = {}
+
+    def upsert(self, rows):
+        self.rows.update({row["deviceId"]: row for row in rows})
+
+    def delete(self, device_ids):
+        for device in device_ids:
+            self.rows.pop(device, None)
+
+
+def tracker(table, offline_after=15.0, retention=60.0):
+    return PresenceTracker(table.upsert, table.delete, offline_after=offline_after, retention=retention,
+                           clock=lambda: 0.0)
+
+
+def test_goes_offline_after_silence_and_back_on_a_ping():
+    table = Table()
+    presence = tracker(table)
+    presence.seen("bottle-1", now=0.0)
+    for t in range(0, 15):
+        presence.seen("bottle-1", now=float(t))
+        assert presence.expire(now=t + 0.5) == []
+    assert presence.expire(now=31.0) == ["bottle-1"]
+    presence.flush()
+    assert table.rows["bottle-1"]["online"] is False
+
+    presence.seen("bottle-1", now=40.0)
+    assert presence.is_online("bottle-1")
+    assert presence.expire(now=50.0) == []  # its retention deadline was dropped with the ping
+
+
+def test_wheel_is_sized_for_long_offline_periods():
+    presence = tracker(Table(), offline_after=120.0, retention=0)
+    presence.seen("bottle-1", now=0.0)
+    for t in range(1, 120):
+        presence.seen("bottle-1", now=float(t))
+        assert presence.expire(now=float(t)) == []
+    assert presence.expire(now=240.0) == ["bottle-1"]
+
+
+def test_offline_devices_are_forgotten_after_retention():
+    table = Table()
+    presence = tracker(table, offline_after=15.0, retention=60.0)
+    presence.seen("10.0.0.7", now=0.0)
+    presence.expire(now=16.0)
+    presence.flush()
+    assert "10.0.0.7" in table.rows
+
+    for t in range(17, 62):
+        presence.expire(now=float(t))
+    assert presence.fleet() == {"devices": 0, "online": 0, "offline": 0}
+    assert presence.last_seen("10.0.0.7") is None
+    assert presence.stats()["filed"] == 0
+    presence.flush()
+    assert table.rows == {}
+
+
+def test_device_back_before_flush_is_not_deleted():
+    table = Table()
+    presence = tracker(table, offline_after=15.0, retention=30.0)
+    presence.seen("bottle-1", now=0.0)
+    presence.expire(now=16.0)
+    presence.expire(now=31.0)
+    assert presence.stats()["evicted"] == 1
+    presence.seen("bottle-1", now=32.0)
+    presence.flush()
+    assert table.rows["bottle-1"]["online"] is True
+
+
+def test_reconnects_from_one_address_are_one_device():
+    presence = tracker(Table())
+    for port in range(50000, 50020):
+        presence.seen(device_id(BottleState(("10.0.0.7", port))), now=float(port - 50000))
+    presence.seen(device_id(BottleState(("10.0.0.7", 50021), "BOTTLE123")), now=21.0)
+    assert presence.fleet() == {"devices": 2, "online": 2, "offline": 0}
+    assert presence.is_online("10.0.0.7") and presence.is_online("BOTTLE123")
@@ -0,0 +1,67 @@
+# The rows rollups.py publishes must fit the `rollups` table the Supabase
+# migration creates, and the dashboard needs that table in the realtime
+# publication.
+
+import glob
+import json
+import os
+import re
+
+import pytest
+
+import storage
+from conftest import ROOT, WINDOWS
+from rollups import RollupService
+
+
+@pytest.fixture(scope="module")
+def migration():
+    paths = glob.glob(os.path.join(ROOT, "supabase", "migrations", "*_rollups.sql"))
+    assert len(paths) == 1
+    with open(paths[0]) as f:
+        return f.read()
+
+
+def table_columns(sql):
+    body = re.search(r"create table if not exists public\.rollups \((.*?)\n\);", sql, re.S).group(1)
+    return {m.group(1) for m in re.finditer(r'^\s*"?(\w+)"? (?:text|bigint|jsonb|timestamptz)', body, re.M)}
+
+
+def allowed_kinds(sql):
+    check = re.search(r"constraint rollups_kind check \(kind in \(([^)]*)\)\)", sql).group(1)
+    return set(re.findall(r"'(\w+)'", check))
+
+
+@pytest.fixture
+def published(tmp_path):
+    # Every row a fresh RollupService upserts for a couple of subjects' events
+    db = storage.SQLiteStorage(str(tmp_path / "rollups.db"))
+    ids = [db.add_subject({"firstName": name, "lastName": "Test", "pillWeight": 0.5,
+                           "prescription": {"pillCount": 30, "pillsPerDose": 1}, "dosingWindows": WINDOWS,
+                           "currAdherenceScore": 100}) for name in ("Ada", "Bo")]
+    db.insert_events([{"subjectId": sid, "date": day, "time": "08:00 AM", "grams": "10.0",
+                       "anomalyId": anomaly, "adherenceScore": score, "pillCount": 30}
+                      for sid in ids for day, anomaly, score in (("10/13/26", "0", "100"), ("10/14/26", "3", "50"))])
+    rows = []
+    upsert = db.upsert_rollups
+    db.upsert_rollups = lambda batch: (rows.extend(batch), upsert(batch))
+    RollupService(db=db, rebuild=True).run(once=True)
+    return rows
+
+
+def test_published_rows_fit_the_migration(migration, published):
+    columns, kinds = table_columns(migration), allowed_kinds(migration)
+    assert columns == {c.strip() for c in storage.ROLLUP_COLUMNS.split(",")}
+    assert {row["kind"] for row in published} == kinds
+    for row in published:
+        assert set(row) == columns
+        assert row["key"].startswith(row["kind"] + ":")
+        assert (row["subjectId"] is not None) == (row["kind"] in ("day", "week"))
+        json.dumps(row["data"])
+
+
+def test_dashboard_kinds_are_published_over_realtime(migration):
+    dashboard = open(os.path.join(ROOT, "components", "AggregateView.tsx")).read()
+    read = set(re.findall(r"kind=eq\.(\w+)", dashboard))
+    assert read and read <= allowed_kinds(migration)
+    assert re.search(r"alter publication supabase_realtime add table public\.rollups", migration)
@@ -0,0 +1,45 @@
+import ingest
+from ingest import BottleState, resolve_subject
+from shards import shard_of
+
+
+def test_fallbacks_resolve_to_the_latest_subjects_own_shard(add_subject):
+    other = add_subject(bottleId="bottle-other")
+    latest = add_subject(bottleId="bottle-latest")
+    ingest.refresh_subjects()
+
+    states = [BottleState(("10.0.0.1", 1)),  # no handshake
+              BottleState(("10.0.0.2", 2), "bottle-unassigned"),
+              BottleState(("10.0.0.3", 3), "bottle-latest")]
+    assert [resolve_subject(s) for s in states] == [latest] * 3
+    assert resolve_subject(BottleState(("10.0.0.4", 4), "bottle-other")) == other
+
+    for num_shards in range(1, 9):
+        assert len({shard_of(resolve_subject(s), num_shards) for s in states}) == 1
+
+
+def test_one_subject_never_lands_on_two_shards(add_subject):
+    subjects = [add_subject(bottleId=f"bottle-{i}") for i in range(6)]
+    ingest.refresh_subjects()
+    latest = subjects[-1]
+
+    owner = {}  # subjectId -> shard, per shard count
+    for num_shards in (1, 2, 3, 4, 7):
+        for bottle_id in [None, "bottle-nobody"] + [f"bottle-{i}" for i in range(6)]:
+            subject_id = resolve_subject(BottleState(("10.0.0.1", 1), bottle_id))
+            shard = shard_of(subject_id, num_shards)
+            assert owner.setdefault((num_shards, subject_id), shard) == shard
+        assert (num_shards, latest) in owner
+
+
+def test_newly_assigned_bottle_moves_to_its_subject_without_sighup(add_subject, db, monkeypatch):
+    subject = add_subject()
+    latest = add_subject()
+    ingest.refresh_subjects()
+    monkeypatch.setattr(ingest.routes, "miss_reload", 0.0)
+    monkeypatch.setattr(ingest.routes, "_next_miss_reload", 0.0)  # earlier misses started the timer
+    state = BottleState(("10.0.0.1", 1), "bottle-new")
+    assert resolve_subject(state) == latest
+
+    db.update_subject(subject, {"bottleId": "bottle-new"})
+    assert resolve_subject(state) == subject
@@ -0,0 +1,44 @@
+import re
+
+import storage
+from storage import SQLiteStorage, SupabaseStorage
+
+
+def contract():
+    # Method names listed in storage.py's header, the interface both backends implement
+    with open(storage.__file__) as f:
+        header = f.read().split("\n\n", 1)[0]
+    return re.findall(r"^#\s+(\w+)\(", header, re.M)
+
+
+def test_both_backends_implement_the_whole_contract():
+    names = contract()
+    assert "insert_events" in names and "delete_devices" in names
+    for backend in (SupabaseStorage, SQLiteStorage):
+        assert [n for n in names if not callable(getattr(backend, n, None))] == []
+
+
+def test_sqlite_round_trip(tmp_path):
+    db = SQLiteStorage(str(tmp_path / "dose.db"))
+    assert db.latest_subject_id() is None
+    first = db.add_subject({"firstName": "A", "prescription": {"pillCount": 30}, "dosingWindows": {"w": "08:00"},
+                            "bottleId": "bottle-1"})
+    second = db.add_subject({"firstName": "B", "bottleId": "bottle-1"})  # bottle reassigned
+    assert db.latest_subject_id() == second
+    assert db.get_subject(first)["prescription"] == {"pillCount": 30}
+    assert db.get_subject(first)["dosingWindows"] == {"w": "08:00"}
+    assert db.get_subject(999) is None
+    assert db.bottle_routes() == {"bottle-1": second}
+
+    db.insert_events([{"subjectId": first, "date": "10/17/26", "time": "08:00 AM", "grams": "10.0",
+                       "anomalyId": a, "adherenceScore": "100", "pillCount": 30} for a in ("0", "3")])
+    assert sorted(db.day_anomalies(first, "10/17/26")) == ["0", "3"]
+    assert db.day_anomalies(first, "10/18/26") == []
+
+    db.update_subject(first, {"currAdherenceScore": 50.0, "pillWeight": 0.5})
+    assert db.get_subject(first)["currAdherenceScore"] == 50.0
+    assert [r["subjectId"] for r in db.subject_scores()] == [first, second]
+
+    db.upsert_devices([{"deviceId": "bottle-1", "online": True, "lastSeen": "2026-10-17T08:00:00"}])
+    db.upsert_devices([{"deviceId": "bottle-1", "online": False, "lastSeen": "2026-10-17T08:01:00"}])
+    db.delete_devices(["bottle-1"])
@@ -0,0 +1,75 @@
+import threading
+import time
+
+from write_behind import WriteBehindQueue
+
+
+def event(subject_id, anomaly_id="0", event_date="10/17/26"):
+    return ({"subjectId": subject_id, "date": event_date, "time": "08:00 AM", "grams": "10.0",
+             "anomalyId": anomaly_id, "adherenceScore": 100, "pillCount": 30},
+            {"currAdherenceScore": 100.0})
+
+
+def unreachable(*_):
+    raise ConnectionError("database down")
+
+
+def journal_from_crashed_process(path, entries):
+    # Rows left in the journal by a process that never reached the database
+    queue = WriteBehindQueue(unreachable, unreachable, path=str(path), retry_base=60.0)
+    queue.append_many(entries)
+    queue.close(flush=False)
+
+
+def test_replay_counts_backlog_from_the_journal(tmp_path):
+    path = tmp_path / "journal.db"
+    journal_from_crashed_process(path, [event(1), event(1), event(2)])
+
+    table = []
+    queue = WriteBehindQueue(table.extend, lambda *_: None, path=str(path))
+    assert queue.journaled == queue.pending() == 3
+    assert queue.flush() == 3
+    assert queue.journaled == 0
+
+    queue.append(*event(3))
+    queue.close()
+    assert queue.journaled == queue.pending() == 0
+    assert [row["subjectId"] for row in table] == [1, 1, 2, 3]
+    assert queue.stats()["appended"] == 1 and queue.stats()["flushed_events"] == 4
+
+
+def test_day_anomalies_sees_each_event_once_while_a_flush_runs(tmp_path):
+    path = tmp_path / "journal.db"
+    journal_from_crashed_process(path, [event(7, "3"), event(7, "0"), event(8, "1")])
+
+    table = []
+    queue = WriteBehindQueue(table.extend, lambda *_: None, path=str(path))
+    flusher = threading.Thread(target=queue.flush)
+
+    def load_stored(subject_id, event_date):
+        # Read the table, then give a flush every chance to land before the journal is read
+        stored = [e["anomalyId"] for e in table if e["subjectId"] == subject_id and e["date"] == event_date]
+        flusher.start()
+        time.sleep(0.2)
+        return stored
+
+    assert sorted(queue.day_anomalies(load_stored, 7, "10/17/26")) == ["0", "3"]
+    flusher.join()
+    assert queue.pending() == 0
+    assert queue.day_anomalies(lambda s, d: [e["anomalyId"] for e in table if e["subjectId"] == s], 7,
+                               "10/17/26") == ["3", "0"]
+
+
+def test_subject_updates_are_coalesced_per_batch(tmp_path):
+    path = tmp_path / "journal.db"
+    journal_from_crashed_process(path, [(event(subject_id)[0], {"currAdherenceScore": score})
+                                        for subject_id, score in [(1, 100.0), (2, 90.0), (1, 50.0), (1, 25.0)]])
+
+    updates = []
+    queue = WriteBehindQueue(lambda rows: None, lambda s, fields: updates.append((s, fields)),
+                             path=str(path), batch_size=3)
+    assert queue.flush() == 4
+    # Batch one holds 1, 2, 1: subject 1 gets only its latest score; batch two is the last event
+    assert updates == [(1, {"currAdherenceScore": 50.0}), (2, {"currAdherenceScore": 90.0}),
+                       (1, {"currAdherenceScore": 25.0})]
+    assert queue.stats()["flushed_subjects"] == 3
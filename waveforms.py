@@ -0,0 +1,214 @@
+# Raw load-cell streams for simulated bottles, as the HX711 sees them.
+#
+# The firmware samples at 100 Hz and only sends a weight once a 5-sample
+# stddev settles, so everything server-side only ever sees final grams. This
+# writes what the device sees around each woz.py dose: the bottle lifted off
+# and put back (or pills tipped out while it sits on the scale), hand
+# pressure and handling noise, damped settling, slow drift, occasional
+# spikes and sensor noise, so stability detectors can be benchmarked and
+# tuned offline.
+#
+#   python waveforms.py --out raw/ --bottles 10000 --hours 24 --workers 8
+#
+# Output (memory-mapped, load with load()):
+#   raw/samples.npy  float32 [bottles, hours * 3600 * SAMPLE_HZ], grams
+#   raw/events.npy   one row per interaction (EVENT_DTYPE): where it starts,
+#                    where the signal is settled again, and the true weight
+#                    before/after -- the ground truth a detector should find
+#
+# Each bottle is seeded from (seed, bottle) alone, so the data is identical
+# for any --workers. Bottle i is woz subject i.
+
+import argparse
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import woz
+
+SAMPLE_HZ = 100
+EVENTS_PER_DAY = (2, 4)  # woz events per bottle per simulated day
+
+# Sensor
+NOISE_SD = 0.02  # grams, white noise per sample
+DRIFT_SD_PER_HOUR = 0.02  # grams/hour, per-bottle linear drift rate
+WALK_SD = 0.002  # grams per sqrt(second), slow random walk (temperature, creep)
+SPIKES_PER_HOUR = 6
+SPIKE_GRAMS = (2.0, 30.0)  # magnitude range, either sign, 1-3 samples wide
+
+# Handling
+IN_PLACE_PROB = 0.3  # pills tipped out with the bottle left on the scale (small doses only)
+OFF_SCALE_SECONDS = (3.0, 20.0)  # bottle lifted off while pills are taken out
+HANDLING_SECONDS = (0.5, 2.0)  # hand still on the bottle after putting it back
+HANDLING_SD = (0.5, 3.0)  # grams
+HAND_PRESSURE = (0.0, 5.0)  # grams, decays over the handling period
+RING_GRAMS = (0.5, 3.0)  # damped oscillation once released
+RING_HZ = (3.0, 8.0)
+RING_TAU = (0.1, 0.5)  # seconds
+SETTLE_GRAMS = 0.05  # settled once the ringing envelope is below this
+
+LIFT, IN_PLACE = 0, 1
+EVENT_DTYPE = np.dtype([
+    ("bottle", np.int32),
+    ("subject", np.int32),
+    ("style", np.int8),  # LIFT or IN_PLACE
+    ("start", np.int64),  # first sample touched
+    ("settled", np.int64),  # first sample where the signal is stable again
+    ("before", np.float32),  # true weight before/after, grams
+    ("after", np.float32),
+    ("pills", np.float32),  # pills removed (negative for a refill)
+])
+
+
+def bottle_events(num_bottles, seed, start, hours):
+    # Returns ({bottle: (event offsets in seconds, grams after each event)},
+    # full-bottle weight per bottle, grams per pill per bottle). Missed doses
+    # are dropped: nobody touches the bottle.
+    days = math.ceil(hours / 24)
+    subjects, events = woz.generate(num_bottles, seed=seed, today=start.date() + timedelta(days=days), days=days,
+                                    events_per_subject=tuple(x * (days + 1) for x in EVENTS_PER_DAY))
+    ts = pd.to_datetime(events["date"] + " " + events["time"])
+    events = events.assign(offset=(ts - start).dt.total_seconds())
+    events = events[(events["offset"] >= 0) & (events["offset"] < hours * 3600) & (events["anomalyId"] != 3)]
+
+    grouped = {int(sid): (g["offset"].to_numpy(), g["grams"].to_numpy()) for sid, g in events.groupby("subjectId")}
+    per_bottle = {b: grouped.get(b, (np.zeros(0), np.zeros(0))) for b in range(num_bottles)}
+    full = (subjects["pill_count"] * subjects["grams_per_pill"]).to_numpy()
+    return per_bottle, full, subjects["grams_per_pill"].to_numpy()
+
+
+def ring(rng, n_samples):
+    # Damped oscillation after the bottle is released; returns (wave, samples to settle)
+    amp, hz, tau = rng.uniform(*RING_GRAMS), rng.uniform(*RING_HZ), rng.uniform(*RING_TAU)
+    settle = int(tau * math.log(amp / SETTLE_GRAMS) * SAMPLE_HZ) + 1
+    t = np.arange(min(n_samples, 5 * settle)) / SAMPLE_HZ
+    return (amp * np.exp(-t / tau) * np.sin(2 * np.pi * hz * t)).astype(np.float32), settle
+
+
+def synthesize_bottle(bottle, offsets, grams, full, grams_per_pill, n_samples, seed):
+    # One bottle's stream (float32 grams) and its ground-truth interactions
+    rng = np.random.default_rng(np.random.SeedSequence([seed, bottle]))
+    signal = np.empty(n_samples, dtype=np.float32)
+    labels = []
+    level, cursor = float(full), 0  # true weight; signal[:cursor] is already written
+
+    for offset, after in zip(offsets, grams):
+        at = max(int(offset * SAMPLE_HZ), cursor)
+        if at >= n_samples:
+            break
+        signal[cursor:at] = level
+        pills = round((level - after) / grams_per_pill, 1)
+        in_place = 0 < pills <= 4 and rng.random() < IN_PLACE_PROB
+
+        if in_place:
+            # Pills tipped out one by one: a step per pill with a burst of shaking
+            segments, weight = [], level
+            for i in range(max(1, int(round(pills)))):
+                step = rng.uniform(*HANDLING_SECONDS)
+                burst = np.full(int(step * SAMPLE_HZ), weight, dtype=np.float32)
+                burst += rng.normal(0, rng.uniform(*HANDLING_SD) / 2, len(burst)).astype(np.float32)
+                weight = after if i == int(round(pills)) - 1 else weight - grams_per_pill
+                segments.append(burst)
+            handled = np.concatenate(segments)
+        else:
+            # Lifted off (reads ~0), put back with a hand still on it
+            off = np.zeros(int(rng.uniform(*OFF_SCALE_SECONDS) * SAMPLE_HZ), dtype=np.float32)
+            ramp = np.linspace(level, 0, int(0.2 * SAMPLE_HZ), dtype=np.float32)
+            n_hand = int(rng.uniform(*HANDLING_SECONDS) * SAMPLE_HZ)
+            pressure = rng.uniform(*HAND_PRESSURE) * np.linspace(1, 0, n_hand, dtype=np.float32)
+            hand = after + pressure + rng.normal(0, rng.uniform(*HANDLING_SD), n_hand).astype(np.float32)
+            handled = np.concatenate([ramp, off, hand])
+
+        wave, settle = ring(rng, n_samples)
+        end = min(at + len(handled), n_samples)
+        signal[at:end] = handled[:end - at]
+        tail = min(len(wave), n_samples - end)
+        signal[end:end + tail] = after + wave[:tail]
+        labels.append((bottle, bottle, IN_PLACE if in_place else LIFT, at, min(end + settle, n_samples),
+                       level, after, pills))
+        level, cursor = float(after), end + tail
+
+    signal[cursor:] = level
+
+    # Drift: a per-bottle rate plus a random walk, stepped once a second
+    # (far below the sensor noise per step)
+    seconds = -(-n_samples // SAMPLE_HZ)
+    walk = np.cumsum(rng.normal(0, WALK_SD, seconds))
+    walk += rng.normal(0, DRIFT_SD_PER_HOUR) / 3600 * np.arange(seconds)
+    signal += np.repeat(walk.astype(np.float32), SAMPLE_HZ)[:n_samples]
+
+    # Sensor noise and spikes
+    signal += rng.standard_normal(n_samples, dtype=np.float32) * np.float32(NOISE_SD)
+    n_spikes = rng.poisson(SPIKES_PER_HOUR * n_samples / (SAMPLE_HZ * 3600))
+    where = rng.integers(0, n_samples, n_spikes)
+    size = rng.uniform(*SPIKE_GRAMS, n_spikes) * rng.choice([-1, 1], n_spikes)
+    widths = rng.integers(1, 4, n_spikes)
+    for width in (1, 2, 3):
+        pick = widths >= width
+        np.add.at(signal, np.minimum(where[pick] + width - 1, n_samples - 1), size[pick].astype(np.float32))
+
+    return signal, labels
+
+
+def write_bottle(path, bottle, offsets, grams, full, grams_per_pill, n_samples, seed):
+    # Worker: synthesize one bottle straight into its row of the shared memmap
+    signal, labels = synthesize_bottle(bottle, offsets, grams, full, grams_per_pill, n_samples, seed)
+    samples = np.load(path, mmap_mode="r+")
+    samples[bottle] = signal
+    samples.flush()
+    return labels
+
+
+def generate(out_dir, num_bottles, hours=24, seed=42, start=None, workers=1):
+    start = start or datetime.combine(date.today() - timedelta(days=math.ceil(hours / 24)), datetime.min.time())
+    n_samples = int(hours * 3600 * SAMPLE_HZ)
+    events, full, grams_per_pill = bottle_events(num_bottles, seed, start, hours)
+
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, "samples.npy")
+    np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(num_bottles, n_samples)).flush()
+    jobs = [(path, b, *events[b], full[b], grams_per_pill[b], n_samples, seed) for b in range(num_bottles)]
+
+    if workers <= 1:
+        results = [write_bottle(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(write_bottle, *zip(*jobs), chunksize=16))
+
+    labels = np.array([row for rows in results for row in rows], dtype=EVENT_DTYPE)
+    np.save(os.path.join(out_dir, "events.npy"), labels)
+    return path, labels
+
+
+def load(out_dir):
+    # (samples memmap [bottles, samples], events) without reading the samples
+    return (np.load(os.path.join(out_dir, "samples.npy"), mmap_mode="r"),
+            np.load(os.path.join(out_dir, "events.npy")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate raw 100 Hz load-cell streams for simulated bottles")
+    parser.add_argument("--out", required=True, help="output directory")
+    parser.add_argument("--bottles", type=int, default=100)
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--start", type=datetime.fromisoformat, help="stream start (default: midnight, days ago)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    size_gb = args.bottles * args.hours * 3600 * SAMPLE_HZ * 4 / 1e9
+    print(f"Writing {args.bottles} bottles x {args.hours:g} h at {SAMPLE_HZ} Hz ({size_gb:.2f} GB) to {args.out}")
+    began = time.perf_counter()
+    path, labels = generate(args.out, args.bottles, args.hours, args.seed, args.start, args.workers)
+    elapsed = time.perf_counter() - began
+    print(f"{len(labels)} interactions ({np.mean(labels['style'] == IN_PLACE):.0%} in place) in {elapsed:.1f}s "
+          f"({args.bottles * args.hours * 3600 / elapsed:,.0f} bottle-seconds/s)")
+
+
+if __name__ == "__main__":
+    main()
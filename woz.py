@@ -1,17 +1,15 @@
 # Creating synthetic "Wizard of Oz" dataset: 100 subjects (subject_id 0-99) and ~10,000 events.
 # This will create two CSVs in /mnt/data: subjects.csv and events.csv
-# It will also display small samples of the generated data.
+# It will also display small samples of the generated data (when run in a notebook).
+#
+# generate() returns the same data as DataFrames for other tools (e.g. loadgen.py).
 
-import random
-from datetime import date, datetime, timedelta, time as dtime
+from datetime import date, timedelta
 import json
 import numpy as np
 import pandas as pd
 import os
 
-random.seed(42)
-np.random.seed(42)
-
 NUM_SUBJECTS = 100  # subject_id 0..99
 SUBJECT_IDS = list(range(NUM_SUBJECTS))
 
@@ -63,230 +61,328 @@ female_height_sd_cm = 6.0
 female_weight_mean_kg = 78.0
 female_weight_sd_kg = 13.0
 
-# Date range for events (last 180 days)
-today = date.today()
-start_date = today - timedelta(days=180)
-days_range = (today - start_date).days
+# Event timing/volume
+DAYS = 180  # events fall in the last DAYS days
+EVENTS_PER_SUBJECT = (80, 120)  # inclusive range per subject
+JITTER_SD_MIN = 20  # dose time jitter around the scheduled window, clipped to +-60 min
 
-subjects_rows = []
-events_rows = []
+# WOZ anomaly ids (index into the tables below)
+# 0 = on time/normal, 1 = extra, 2 = partial, 3 = missed
+ANOMALY_ADHERENCE = np.array([1.0, 0.9, 0.8, 0.0])
+ANOMALY_CUTOFFS = [(0.01, 3), (0.03, 1), (0.035, 2)]  # random draw < cutoff -> anomaly id
 
-for sid in SUBJECT_IDS:
-    sex = random.choice(["M", "F"])
-    first_name = random.choice(first_names)
-    last_name = random.choice(last_names)
-    # age: truncated normal between 18 and 85
-    age = int(np.clip(np.random.normal(45, 18), 18, 85))
-    race = np.random.choice(race_choices, p=race_probs)
-    
-    if sex == "M":
-        height = float(np.clip(np.random.normal(male_height_mean_cm, male_height_sd_cm), 150, 200))
-        weight = float(np.clip(np.random.normal(male_weight_mean_kg, male_weight_sd_kg), 50, 160))
-    else:
-        height = float(np.clip(np.random.normal(female_height_mean_cm, female_height_sd_cm), 140, 190))
-        weight = float(np.clip(np.random.normal(female_weight_mean_kg, female_weight_sd_kg), 40, 140))
-    
-    pill_count = int(random.randint(30, 180))
-    doses_per_day = int(np.random.choice(doses_choices, p=doses_probs))
-    pills_per_dose = int(np.random.choice(pills_per_dose_choices, p=pills_probs))
-    
-    # grams per pill between 0.25 and 1.0 g (typical small pill mass in grams for demo purposes)
-    grams_per_pill = round(float(np.round(np.random.uniform(0.25, 1.0), 3)), 3)
-    
-    # Create dosing windows as JSON object: evenly spaced times between 06:00 and 22:00
-    earliest = 6 * 60  # minutes after midnight
+READING_NOISE_SD = 0.003  # relative scale noise on each bottle reading
+
+
+def scheduled_minutes(doses_per_day):
+    # Evenly spaced doses between 06:00 and 22:00 (minutes after midnight)
+    earliest = 6 * 60
     latest = 22 * 60
     if doses_per_day == 1:
-        scheduled_minutes = [11 * 60]  # around 11:00
-    else:
-        interval = (latest - earliest) / (doses_per_day - 1)
-        scheduled_minutes = [int(earliest + i * interval) for i in range(doses_per_day)]
-    dosing_windows = {}
-    for i, mins in enumerate(scheduled_minutes):
-        hh = mins // 60
-        mm = mins % 60
-        dosing_windows[f"window_{i+1}"] = f"{hh:02d}:{mm:02d}"
-    
-    subjects_rows.append({
-        "subject_id": sid,
+        return [11 * 60]  # around 11:00
+    interval = (latest - earliest) / (doses_per_day - 1)
+    return [int(earliest + i * interval) for i in range(doses_per_day)]
+
+
+# Only len(doses_choices) distinct schedules exist, so build them once:
+# SCHEDULES[doses - 1, k] is the k-th window for that many doses a day
+SCHEDULES = np.zeros((max(doses_choices), max(doses_choices)), dtype=np.int64)
+DOSING_WINDOWS_JSON = {}
+for _d in doses_choices:
+    SCHEDULES[_d - 1, :_d] = scheduled_minutes(_d)
+    DOSING_WINDOWS_JSON[_d] = json.dumps({
+        f"window_{i+1}": f"{m // 60:02d}:{m % 60:02d}" for i, m in enumerate(scheduled_minutes(_d))
+    })
+
+# "HH:MM:SS" for every minute of the day at :00 and :30 seconds
+TIME_STRINGS = np.array([f"{m // 60:02d}:{m % 60:02d}:{s:02d}" for m in range(24 * 60) for s in (0, 30)])
+
+
+def simulate_bottles(starts, counts, capacity, grams_per_pill, dose_pills, noise):
+    # Turn per-event doses into bottle readings. Events are grouped by subject
+    # (subject i owns [starts[i], starts[i] + counts[i])) and sorted by time;
+    # capacity/grams_per_pill are per subject, dose_pills/noise per event.
+    # Returns (pills_left, grams_read) per event.
+    #
+    # Pills: the bottle starts full and is refilled to capacity whenever it
+    # holds fewer pills than the dose being taken (never for a missed dose).
+    # Between refills pills_left is capacity minus a cumulative dose sum, so
+    # only the refill points need finding: from each refill, the next one is
+    # the first event whose running dose total passes capacity (searchsorted).
+    # That walk advances every subject one refill per step.
+    n = len(dose_pills)
+    ends = starts + counts
+    subject = np.repeat(np.arange(len(starts)), counts)
+    total = np.concatenate([[0.0], np.cumsum(dose_pills)])  # total[j] = doses before event j
+    # next event at or after j that actually takes pills (missed doses never refill)
+    next_dose = np.minimum.accumulate(np.where(dose_pills > 0, np.arange(n), n)[::-1])[::-1]
+    next_dose = np.append(next_dose, n)
+
+    segment_start = np.zeros(n, dtype=bool)
+    segment_start[starts[counts > 0]] = True
+    current = starts[counts > 0]
+    owner = np.flatnonzero(counts > 0)
+    while len(current):
+        over = np.searchsorted(total, total[current] + capacity[owner], side="right") - 1
+        refill = next_dose[np.minimum(np.maximum(current + 1, over), n)]
+        keep = refill < ends[owner]
+        current, owner = refill[keep], owner[keep]
+        segment_start[current] = True
+
+    last_start = np.maximum.accumulate(np.where(segment_start, np.arange(n), 0))
+    pills_left = np.maximum(0.0, capacity[subject] - (total[1:] - total[last_start]))
+
+    # Readings: noisy, and never above the previous reading unless the bottle
+    # reads heavier than that (i.e. it was refilled). Each reading depends on
+    # the one before, so step all subjects through their k-th event together.
+    base = pills_left * grams_per_pill[subject]
+    noisy = base * noise
+    grams_read = np.empty(n)
+    by_count = np.argsort(-counts, kind="stable")
+    first = starts[by_count]
+    desc = -counts[by_count]  # ascending, for searchsorted
+    prev = (capacity * grams_per_pill)[by_count]
+    for k in range(counts.max(initial=0)):
+        m = np.searchsorted(desc, -k, side="left")  # subjects with more than k events
+        idx = first[:m] + k
+        b, nz, p = base[idx], noisy[idx], prev[:m]
+        r = np.where(b > p, nz, np.minimum(nz, p))
+        grams_read[idx] = r
+        prev[:m] = r
+    return pills_left, grams_read
+
+
+def generate(num_subjects=NUM_SUBJECTS, seed=42, today=None, days=DAYS, events_per_subject=None, first_subject=0):
+    # Returns (subjects_df, events_df); same seed -> same dataset.
+    # Everything is drawn in bulk from one Generator: per-subject attributes
+    # as arrays of num_subjects, per-event fields as arrays of all events.
+    # Subject ids are first_subject..first_subject + num_subjects - 1.
+    # events_per_subject defaults to EVENTS_PER_SUBJECT scaled to `days`.
+    rng = np.random.default_rng(seed)
+    n = num_subjects
+    if events_per_subject is None:
+        events_per_subject = tuple(x * days // DAYS for x in EVENTS_PER_SUBJECT)
+
+    # Date range for events (last `days` days)
+    today = today or date.today()
+    start_date = today - timedelta(days=days)
+
+    # --- Subjects ---
+    sex = rng.choice(["M", "F"], n)
+    first_name = rng.choice(first_names, n)
+    last_name = rng.choice(last_names, n)
+    # age: truncated normal between 18 and 85
+    age = np.clip(rng.normal(45, 18, n), 18, 85).astype(int)
+    race = rng.choice(race_choices, n, p=race_probs)
+
+    male = sex == "M"
+    height = np.where(male,
+                      np.clip(rng.normal(male_height_mean_cm, male_height_sd_cm, n), 150, 200),
+                      np.clip(rng.normal(female_height_mean_cm, female_height_sd_cm, n), 140, 190))
+    weight = np.where(male,
+                      np.clip(rng.normal(male_weight_mean_kg, male_weight_sd_kg, n), 50, 160),
+                      np.clip(rng.normal(female_weight_mean_kg, female_weight_sd_kg, n), 40, 140))
+
+    pill_count = rng.integers(30, 181, n)
+    doses_per_day = rng.choice(doses_choices, n, p=doses_probs)
+    pills_per_dose = rng.choice(pills_per_dose_choices, n, p=pills_probs)
+    # grams per pill between 0.25 and 1.0 g (typical small pill mass in grams for demo purposes)
+    grams_per_pill = np.round(rng.uniform(0.25, 1.0, n), 3)
+
+    # --- Events ---
+    lo, hi = events_per_subject
+    counts = rng.integers(lo, hi + 1, n)
+    subject = np.repeat(np.arange(n), counts)
+    n_events = len(subject)
+
+    # random day in range; one of the subject's windows with jitter (sd 20 min)
+    day = rng.integers(0, days + 1, n_events)
+    window = (rng.random(n_events) * doses_per_day[subject]).astype(int)
+    jitter = np.clip(rng.normal(0, JITTER_SD_MIN, n_events), -60, 60).astype(int)
+    minute = np.clip(SCHEDULES[doses_per_day[subject] - 1, window] + jitter, 0, 23 * 60 + 59)
+    half_minute = rng.integers(0, 4, n_events) == 3  # occasionally :30 seconds
+
+    # Mostly the prescribed dose, small chance of missed/extra/partial
+    r = rng.random(n_events)
+    anomaly = np.zeros(n_events, dtype=np.int64)
+    for cutoff, anomaly_id in reversed(ANOMALY_CUTOFFS):
+        anomaly[r < cutoff] = anomaly_id
+
+    # Sort each subject's events by time (stable, so equal times keep draw order).
+    # subject is already grouped, so one int64 key sorts much faster than lexsort
+    order = np.argsort(subject * ((days + 1) * 86400) + day * 86400 + minute * 60 + half_minute * 30,
+                       kind="stable")
+    subject, day, minute, half_minute, anomaly = (a[order] for a in (subject, day, minute, half_minute, anomaly))
+
+    # --- Make grams a monotonic bottle reading (+pillCount/adherence/anomalyId) ---
+    ppd = pills_per_dose[subject].astype(float)
+    dose_pills = np.select([anomaly == 3, anomaly == 2, anomaly == 1],
+                           [0.0, np.maximum(0.5, ppd * 0.5), ppd + 1], ppd)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    noise = rng.normal(1.0, READING_NOISE_SD, n_events)
+    pills_left, grams_read = simulate_bottles(starts, counts, pill_count.astype(float),
+                                              grams_per_pill, dose_pills, noise)
+
+    dates = np.array([(start_date + timedelta(days=d)).isoformat() for d in range(days + 1)])
+    events_df = pd.DataFrame({
+        "subjectId": first_subject + subject,
+        "date": dates[day],
+        "time": TIME_STRINGS[minute * 2 + half_minute],
+        "grams": np.round(grams_read, 3),
+        "anomalyId": anomaly,
+        "adherenceScore": ANOMALY_ADHERENCE[anomaly],
+        "pillCount": np.round(pills_left).astype(int),
+    })
+
+    subjects_df = pd.DataFrame({
+        "subject_id": first_subject + np.arange(n),
         "first_name": first_name,
         "last_name": last_name,
         "age": age,
         "race": race,
         "sex": sex,
-        "weight": round(weight,2),
-        "height": round(height,2),
+        "weight": np.round(weight, 2),
+        "height": np.round(height, 2),
         "pill_count": pill_count,
         "doses_per_day": doses_per_day,
         "pills_per_dose": pills_per_dose,
-        "dosing_windows": json.dumps(dosing_windows),
+        "dosing_windows": [DOSING_WINDOWS_JSON[d] for d in doses_per_day.tolist()],
         "grams_per_pill": grams_per_pill,
-        "num_anomalies": 0,
-        "adherence_score": 1
+        # Number of events with anomalyId != 0
+        "num_anomalies": np.bincount(subject[anomaly != 0], minlength=n),
+        "adherence_score": 1,
     })
-    
-    # Create events for this subject: 80-120 events
-    n_events = random.randint(80, 120)
-    for _ in range(n_events):
-        # random day in range
-        day_offset = random.randint(0, days_range)
-        event_date = start_date + timedelta(days=day_offset)
-        
-        # choose one scheduled window and add jitter (normal with sd=20 minutes)
-        scheduled = random.choice(scheduled_minutes)
-        jitter = int(np.clip(np.random.normal(0, 20), -60, 60))
-        event_minutes = scheduled + jitter
-        # clamp to 0..1439
-        event_minutes = int(np.clip(event_minutes, 0, 23*60+59))
-        hh = event_minutes // 60
-        mm = event_minutes % 60
-        event_time = dtime(hh, mm, random.choice([0,0,0,30]))  # occasionally :30 seconds
-        
-        # Determine pills taken: mostly equals pills_per_dose, small chance of missed/extra/partial
-        r = random.random()
-        if r < 0.01:
-            pills_taken = 0.0
-            anomaly = "missed"
-        elif r < 0.03:
-            pills_taken = pills_per_dose + 1
-            anomaly = "extra"
-        elif r < 0.035:
-            pills_taken = max(0.5, pills_per_dose * 0.5)
-            anomaly = "partial"
-        else:
-            pills_taken = pills_per_dose
-            anomaly = None
-        
-        # grams measured with small measurement noise
-        grams = round(pills_taken * grams_per_pill * float(np.random.normal(1.0, 0.02)), 3)
-        if grams < 0:
-            grams = 0.0
-        
-        events_rows.append({
-            "subject_id": sid,
-            "event_date": event_date.isoformat(),
-            "event_time": event_time.strftime("%H:%M:%S"),
-            "grams": grams,
-            "anomaly_id": anomaly if anomaly is not None else ""
-        })
-
-# Build DataFrames
-subjects_df = pd.DataFrame(subjects_rows)
-events_df = pd.DataFrame(events_rows)
-
-# --- Make grams a monotonic bottle reading (+pillCount/adherence/anomalyId) ---
-
-# Join subject info needed for simulation
-ev = events_df.merge(
-    subjects_df[["subject_id", "pill_count", "pills_per_dose", "grams_per_pill"]],
-    on="subject_id", how="left"
-)
-
-# Build a timestamp and sort
-ev["ts"] = pd.to_datetime(ev["event_date"] + " " + ev["event_time"])
-ev = ev.sort_values(["subject_id", "ts"]).reset_index(drop=True)
-
-# Map WOZ anomaly labels to numeric id + adherence + dose multiplier
-# 0 = on time/normal, 1 = extra, 2 = partial, 3 = missed
-def anomaly_props(label, pills_per_dose):
-    if label == "missed":   # no change
-        return 3, 0.0, 0.0
-    if label == "partial":  # ~half dose
-        return 2, 0.8, max(0.5, pills_per_dose * 0.5)
-    if label == "extra":    # one extra pill
-        return 1, 0.9, pills_per_dose + 1
-    return 0, 1.0, pills_per_dose  # normal
-
-pill_counts = []
-bottle_grams = []
-anom_ids = []
-adherences = []
-
-state = {}  # per-subject state: pills_left, capacity, prev_grams
-
-for i, row in ev.iterrows():
-    sid = row["subject_id"]
-    if sid not in state:
-        state[sid] = {
-            "pills_left": float(row["pill_count"]),
-            "capacity":   float(row["pill_count"]),
-            "prev_grams": float(row["pill_count"]) * float(row["grams_per_pill"]),
-        }
-
-    pills_left = state[sid]["pills_left"]
-    cap        = state[sid]["capacity"]
-    gpp        = float(row["grams_per_pill"])
-
-    an_id, adh, dose_pills = anomaly_props(row["anomaly_id"], float(row["pills_per_dose"]))
-
-    # Refill if not enough pills for the intended dose
-    if pills_left < dose_pills and an_id != 3:  # don't refill for a missed dose; allow bottle to sit
-        pills_left = cap
-
-    # Apply dose (missed => 0)
-    pills_left = max(0.0, pills_left - dose_pills)
-
-    # Bottle reading after the event
-    base_grams = pills_left * gpp
-    noisy = base_grams * float(np.random.normal(1.0, 0.003))  # tiny noise
-    # Enforce monotonic non-increasing unless we refilled this step
-    prev = state[sid]["prev_grams"]
-    refilled = base_grams > prev  # this only happens when we refilled above
-    grams_read = noisy if refilled else min(noisy, prev)
-
-    # Save state & outputs
-    state[sid]["pills_left"] = pills_left
-    state[sid]["prev_grams"] = grams_read
-
-    pill_counts.append(int(round(pills_left)))
-    bottle_grams.append(round(grams_read, 3))
-    anom_ids.append(an_id)
-    adherences.append(adh)
-
-# Write back to a schema your app expects
-ev["pillCount"] = pill_counts
-ev["grams"] = bottle_grams
-ev["anomalyId"] = anom_ids
-ev["adherenceScore"] = adherences
-
-# Finalize columns / names
-events_df_fixed = (
-    ev[["subject_id", "event_date", "event_time", "grams", "anomalyId", "adherenceScore", "pillCount"]]
-    .rename(columns={"subject_id":"subjectId", "event_date":"date", "event_time":"time"})
-)
-
-# From here on, use the fixed events
-events_df = events_df_fixed.copy()
-
-# Update num_anomalies per subject from fixed events (anomalyId != 0)
-anomaly_counts = (
-    events_df.loc[events_df["anomalyId"] != 0]
-             .groupby("subjectId").size()
-)
-subjects_df["num_anomalies"] = (
-    subjects_df["subject_id"].map(anomaly_counts).fillna(0).astype(int)
-)
-
-# Summary stats (use fixed events)
-total_events = len(events_df)
-per_subject_counts = events_df.groupby("subjectId").size()
-min_ev, max_ev = int(per_subject_counts.min()), int(per_subject_counts.max())
-
-print(f"Created {len(subjects_df)} subjects and {total_events} events (per-subject events range: {min_ev}-{max_ev})")
-
-# Save CSVs (do not overwrite with the old df)
-os.makedirs("/mnt/data", exist_ok=True)
-subjects_csv = "/mnt/data/subjects.csv"
-events_csv = "/mnt/data/events.csv"
-
-subjects_df.to_csv(subjects_csv, index=False)
-events_df.to_csv(events_csv, index=False)
-
-# Show samples from the FIXED events
-from caas_jupyter_tools import display_dataframe_to_user
-display_dataframe_to_user("subjects_sample", subjects_df.head(10))
-display_dataframe_to_user("events_sample", events_df.sample(10))
-
-{"subjects_csv": subjects_csv, "events_csv": events_csv,
- "num_subjects": len(subjects_df), "total_events": total_events,
- "min_events_per_subject": min_ev, "max_events_per_subject": max_ev}
+
+    return subjects_df, events_df
+
+
+def summarize(subjects_df, events_df):
+    # Summary stats (use fixed events)
+    total_events = len(events_df)
+    per_subject_counts = events_df.groupby("subjectId").size()
+    min_ev, max_ev = int(per_subject_counts.min()), int(per_subject_counts.max())
+
+    print(f"Created {len(subjects_df)} subjects and {total_events} events (per-subject events range: {min_ev}-{max_ev})")
+    return total_events, min_ev, max_ev
+
+
+def main(out_dir="/mnt/data", num_subjects=NUM_SUBJECTS, seed=42, today=None, days=DAYS):
+    subjects_df, events_df = generate(num_subjects, seed=seed, today=today, days=days)
+    total_events, min_ev, max_ev = summarize(subjects_df, events_df)
+
+    # Save CSVs (do not overwrite with the old df)
+    os.makedirs(out_dir, exist_ok=True)
+    subjects_csv = os.path.join(out_dir, "subjects.csv")
+    events_csv = os.path.join(out_dir, "events.csv")
+
+    subjects_df.to_csv(subjects_csv, index=False)
+    events_df.to_csv(events_csv, index=False)
+
+    # Show samples from the FIXED events (only available inside the notebook tool)
+    try:
+        from caas_jupyter_tools import display_dataframe_to_user
+    except ImportError:
+        pass
+    else:
+        display_dataframe_to_user("subjects_sample", subjects_df.head(10))
+        display_dataframe_to_user("events_sample", events_df.sample(10))
+
+    return {"subjects_csv": subjects_csv, "events_csv": events_csv,
+            "num_subjects": len(subjects_df), "total_events": total_events,
+            "min_events_per_subject": min_ev, "max_events_per_subject": max_ev}
+
+
+# --- Sharded Parquet output (large datasets) ---
+#
+#   python woz.py --parquet out/ --subjects 100000 --days 365 --workers 8
+#
+# Subjects are generated in fixed-size shards, each seeded from (seed, first
+# subject id) alone, so the output is identical for any --workers. Each shard
+# is written straight to Parquet and dropped, so memory stays at one shard per
+# worker:
+#   out/subjects/bucket=B/part-<first subject>.parquet
+#   out/events/bucket=B/month=YYYY-MM/part-<first subject>.parquet
+# where B = subjectId // bucket size.
+
+SHARD_SUBJECTS = 1000
+BUCKET_SUBJECTS = 10_000
+
+
+def write_shard(out_dir, first_subject, num_subjects, seed, today, days, bucket_subjects=BUCKET_SUBJECTS):
+    # Returns (subjects written, events written)
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    subjects_df, events_df = generate(num_subjects, seed=np.random.SeedSequence([seed, first_subject]),
+                                      today=today, days=days, first_subject=first_subject)
+    part = f"part-{first_subject:09d}.parquet"
+
+    def write(df, *partition):
+        path = os.path.join(out_dir, *partition)
+        os.makedirs(path, exist_ok=True)
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), os.path.join(path, part))
+
+    for bucket, df in subjects_df.groupby(subjects_df["subject_id"] // bucket_subjects):
+        write(df, "subjects", f"bucket={bucket}")
+    keys = [events_df["subjectId"] // bucket_subjects, events_df["date"].str.slice(0, 7)]
+    for (bucket, month), df in events_df.groupby(keys, sort=True):
+        write(df, "events", f"bucket={bucket}", f"month={month}")
+    return len(subjects_df), len(events_df)
+
+
+def peak_rss_mb(who):
+    # ru_maxrss is KiB on Linux (bytes on macOS)
+    import resource
+    import sys
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def main_parquet(out_dir, num_subjects, seed=42, today=None, days=DAYS, workers=1,
+                 shard_subjects=SHARD_SUBJECTS, bucket_subjects=BUCKET_SUBJECTS):
+    import resource
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+
+    today = today or date.today()  # fixed once so every worker agrees
+    shards = [(first, min(shard_subjects, num_subjects - first)) for first in range(0, num_subjects, shard_subjects)]
+    args = [(out_dir, first, n, seed, today, days, bucket_subjects) for first, n in shards]
+
+    start = time.perf_counter()
+    if workers <= 1:
+        results = [write_shard(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(write_shard, *zip(*args)))
+    elapsed = time.perf_counter() - start
+
+    total_subjects = sum(r[0] for r in results)
+    total_events = sum(r[1] for r in results)
+    print(f"Created {total_subjects} subjects and {total_events} events in {len(shards)} shards "
+          f"under {out_dir} in {elapsed:.1f}s ({total_events / elapsed:,.0f} events/s)")
+    print(f"Peak RSS: {peak_rss_mb(resource.RUSAGE_SELF):.0f} MB main process"
+          + (f", {peak_rss_mb(resource.RUSAGE_CHILDREN):.0f} MB largest worker" if workers > 1 else ""))
+    return {"out_dir": out_dir, "num_subjects": total_subjects, "total_events": total_events,
+            "shards": len(shards), "seconds": elapsed}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate the synthetic WOZ dataset")
+    parser.add_argument("--out-dir", default="/mnt/data", help="where the CSVs go (default)")
+    parser.add_argument("--parquet", metavar="DIR", help="write sharded, partitioned Parquet to DIR instead")
+    parser.add_argument("--subjects", type=int, default=NUM_SUBJECTS)
+    parser.add_argument("--days", type=int, default=DAYS)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--today", type=date.fromisoformat, help="last day of data (YYYY-MM-DD, default today)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--shard-size", type=int, default=SHARD_SUBJECTS, help="subjects per shard")
+    parser.add_argument("--bucket-size", type=int, default=BUCKET_SUBJECTS, help="subjects per subjectId partition")
+    args = parser.parse_args()
+
+    if args.parquet:
+        main_parquet(args.parquet, args.subjects, seed=args.seed, today=args.today, days=args.days,
+                     workers=args.workers, shard_subjects=args.shard_size, bucket_subjects=args.bucket_size)
+    else:
+        main(args.out_dir, args.subjects, seed=args.seed, today=args.today, days=args.days)
@@ -0,0 +1,195 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import metrics
+
+# Write-behind settings
+JOURNAL_PATH = os.environ.get("DOSE_JOURNAL_PATH", "ingest_journal.db")  # shards.py gives each worker its own
+BATCH_SIZE = 500  # events per bulk insert
+FLUSH_INTERVAL = 1.0  # seconds between flushes when the queue is quiet
+RETRY_BASE = 0.5  # first backoff after a failed flush, doubled each time
+RETRY_MAX = 30.0  # backoff ceiling
+
+
+class WriteBehindQueue:
+    # Durable queue between insert_to_supabase and the database.
+    #
+    # Each event is appended to a local SQLite journal (WAL, synchronous=FULL,
+    # so it is fsync'd before append() returns). A background thread then
+    # drains the journal in batches: it writes one `subjects` update per
+    # subject (the latest values in the batch win), bulk-inserts the events and
+    # deletes the flushed rows. Anything still in the journal when the process
+    # dies is flushed on the next start.
+    #
+    # `insert_events(rows)` and `update_subject(subject_id, fields)` do the
+    # actual writes; both may raise, in which case the batch is retried with
+    # exponential backoff. Delivery is at-least-once: a crash between the
+    # insert and the journal delete replays that batch.
+    #
+    # Moving a batch (insert, then delete from the journal) happens under
+    # _handoff_lock, and day_anomalies() reads the table and the journal
+    # under it too, so it sees each event exactly once.
+    def __init__(self, insert_events, update_subject, path=JOURNAL_PATH, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, retry_base=RETRY_BASE, retry_max=RETRY_MAX):
+        self.insert_events = insert_events
+        self.update_subject = update_subject
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS journal (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                subject_id INTEGER NOT NULL,
+                event_date TEXT NOT NULL,
+                anomaly_id TEXT NOT NULL,
+                event TEXT NOT NULL,
+                subject TEXT NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS journal_subject_day ON journal (subject_id, event_date)")
+        self._db_lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._handoff_lock = threading.Lock()  # held while a batch is in both the journal and the table
+        self.journaled = self._db.execute("SELECT COUNT(*) FROM journal").fetchone()[0]  # rows waiting, replay included
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.appended = 0
+        self.flushed_events = 0
+        self.flushed_subjects = 0
+        self.failures = 0
+        self.last_error = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def append(self, event, subject_fields):
+        # Journal one computed event plus the subject columns it changes
+        self.append_many([(event, subject_fields)])
+
+    def append_many(self, entries):
+        # Journal [(event, subject_fields), ...] in one transaction (one fsync)
+        rows = [(event["subjectId"], event["date"], event["anomalyId"], json.dumps(event), json.dumps(fields))
+                for event, fields in entries]
+        with self._db_lock:
+            with self._db:  # commits, or rolls back if the insert fails
+                self._db.execute("BEGIN")
+                self._db.executemany(
+                    "INSERT INTO journal (subject_id, event_date, anomaly_id, event, subject) VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+            self.appended += len(rows)
+            self.journaled += len(rows)
+            backlog = self.journaled
+        self.start()
+        if backlog >= self.batch_size:
+            self._wake.set()
+
+    def pending(self):
+        with self._db_lock:
+            return self._db.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+
+    def pending_anomalies(self, subject_id, event_date):
+        # anomalyIds journaled but not yet in `events` (used to warm adherence counters)
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT anomaly_id FROM journal WHERE subject_id = ? AND event_date = ? ORDER BY seq",
+                (subject_id, event_date),
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def day_anomalies(self, load_stored, subject_id, event_date):
+        # load_stored(subject_id, event_date) (anomalyIds in the table) plus the
+        # journaled ones, read with no batch moving in between: a flush landing
+        # between the two reads would count its events twice or not at all
+        with self._handoff_lock:
+            return load_stored(subject_id, event_date) + self.pending_anomalies(subject_id, event_date)
+
+    def flush(self):
+        # Drain the journal now; returns the number of events written.
+        # Raises if the database write fails (the rows stay journaled).
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._db_lock:
+                    batch = self._db.execute(
+                        "SELECT seq, subject_id, event, subject FROM journal ORDER BY seq LIMIT ?",
+                        (self.batch_size,),
+                    ).fetchall()
+                if not batch:
+                    return written
+
+                # Coalesce subject updates: only the latest values per subject
+                latest = {}
+                for _, subject_id, _, subject in batch:
+                    latest[subject_id] = json.loads(subject)
+
+                # Subject updates are idempotent, so do them before the events
+                # insert; a failed insert then just repeats them on retry
+                with metrics.stage("update_subjects"):
+                    for subject_id, fields in latest.items():
+                        self.update_subject(subject_id, fields)
+                with self._handoff_lock:
+                    with metrics.stage("insert_events"):
+                        self.insert_events([json.loads(event) for _, _, event, _ in batch])
+                    with self._db_lock:
+                        self._db.execute("DELETE FROM journal WHERE seq <= ?", (batch[-1][0],))
+                        self.journaled -= len(batch)
+                self.flushed_events += len(batch)
+                self.flushed_subjects += len(latest)
+                written += len(batch)
+
+    def _run(self):
+        delay = 0
+        while not self._stop.is_set():
+            try:
+                written = self.flush()
+                if written:
+                    print(f"Flushed {written} events ({self.pending()} pending)")
+                delay = 0
+                timeout = self.flush_interval
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                metrics.ERRORS.inc("flush")
+                delay = min(self.retry_max, delay * 2 if delay else self.retry_base)
+                timeout = delay * random.uniform(0.5, 1.0)  # jitter so shards don't retry in lockstep
+                print(f"Flush failed ({e}); retrying in {timeout:.1f}s")
+                self._stop.wait(timeout)  # a full batch shouldn't cut the backoff short
+                continue
+            if self._wake.wait(timeout):
+                self._wake.clear()
+
+    def close(self, flush=True):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        if flush:
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Final flush failed, {self.pending()} events left in {self.path}: {e}")
+
+    def stats(self):
+        return {
+            "pending": self.pending(),
+            "appended": self.appended,
+            "journaled": self.journaled,
+            "flushed_events": self.flushed_events,
+            "flushed_subjects": self.flushed_subjects,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }